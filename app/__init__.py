@@ -1,6 +1,23 @@
 import os
-from dotenv import load_dotenv
 
-load_dotenv()
+_ENV_LOADED = False
 
-APP_ENV = os.getenv("APP_ENV", default="production")
+
+def load_env():
+    '''
+    Loads the .env file into the environment (once; python-dotenv is only imported here).
+    '''
+    global _ENV_LOADED
+    if not _ENV_LOADED:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _ENV_LOADED = True
+
+
+def __getattr__(name):
+    # APP_ENV is read when it is first imported (from app import APP_ENV), so importing
+    # the package alone does not load the .env file
+    if name == 'APP_ENV':
+        load_env()
+        return os.getenv("APP_ENV", default="production")
+    raise AttributeError(f"module 'app' has no attribute '{name}'")
@@ -0,0 +1,5 @@
+# __main__.py
+
+from app.cli import main
+
+main()
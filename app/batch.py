@@ -0,0 +1,184 @@
+# batch.py
+
+# IMPORT PACKAGES
+
+import csv
+import os
+import sys
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+from app.ingest import Ingestor
+from app.store import store_read
+from app.returns_engine import ReturnsPanel
+from app.parallel import parallel_returns_many
+from app.benchmark_index import benchmark_index
+from app.portfolio_import import portfolio_import
+from app import APP_ENV
+
+# FUNCTIONS
+
+INPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'input')
+
+
+def load_portfolios(source):
+    '''
+    Imports a batch of portfolio CSV files from the input folder.
+
+    Param: source (str) either a subfolder of the input folder (every CSV file in it is
+    one portfolio, named after the file) or a manifest CSV file with name and file columns
+    (file paths relative to the input folder)
+
+    Example: load_portfolios('clients')
+
+    Returns: dictionary of {portfolio name: portfolio (list of dict)}
+    '''
+    source_path = os.path.join(INPUT_DIR, source)
+
+    if os.path.isdir(source_path):
+        files = sorted(f for f in os.listdir(source_path) if f.endswith('.csv'))
+        entries = [(os.path.splitext(f)[0], os.path.join(source, f)) for f in files]
+
+    else:
+        with open(source_path, 'r') as manifest_file:
+            entries = [(row['name'], row['file']) for row in csv.DictReader(manifest_file)]
+
+    return {name: portfolio_import(file_name) for name, file_name in entries}
+
+
+def holdings_matrix(portfolios):
+    '''
+    Stacks a batch of portfolios into one ticker x portfolio matrix of share quantities.
+
+    Param: portfolios (dictionary of {portfolio name: portfolio})
+
+    Returns: list of unique tickers, list of portfolio names, quantity matrix (numpy array)
+    '''
+    names = list(portfolios.keys())
+    tickers = sorted({p['tck'] for portfolio in portfolios.values() for p in portfolio})
+    tck_index = {t: i for i, t in enumerate(tickers)}
+
+    qty = np.zeros((len(tickers), len(names)))
+    for j, name in enumerate(names):
+        for p in portfolios[name]:
+            qty[tck_index[p['tck']], j] += float(p['qty'])
+
+    return tickers, names, qty
+
+
+def batch_returns(panel, names, qty, spy_join, fred_join, periods=[1, 2, 3, 5], workers=None):
+    '''
+    Evaluates every portfolio in the batch against the shared price panel.
+
+    Like the single portfolio report, a portfolio only gets results for the longer
+    periods while its data covers the full length of the previous period.  All
+    (portfolio, period) combinations are spread over the analysis process pool
+    (see parallel.py) and the cut-off is applied afterwards.
+
+    Param: panel (ReturnsPanel), names (list of portfolio names), qty (ticker x portfolio
+    matrix aligned to panel.tickers), spy_join, fred_join (or a BenchmarkIndex and None), periods (list of years),
+    workers (int or None)
+
+    Returns: results DataFrame with one row per portfolio and analysis period
+    '''
+    results = []
+    active = np.ones(len(names), dtype=bool)
+
+    for i, period_results in zip(periods, parallel_returns_many(panel, qty, periods, spy_join, fred_join, workers)):
+        period_results.insert(0, 'portfolio', names)
+        results.append(period_results[active])
+
+        # Stop reporting a portfolio once its data no longer cover the target period
+        active = active & (period_results['years_act'].to_numpy() == i)
+
+    results = pd.concat(results, ignore_index=True)
+
+    return results.sort_values(by=['portfolio', 'years_tgt']).reset_index(drop=True)
+
+
+def batch_reports(panel, names, qty, results, spy_join, fred_join, renderer):
+    '''
+    Queues a report for every portfolio and analysis period in the batch results.
+
+    The cumulative returns of each portfolio are calculated over its own window (like
+    returns_many()) while the reports of the previous portfolios are being rendered.
+
+    Param: panel (ReturnsPanel), names (list of portfolio names), qty (ticker x portfolio
+    matrix aligned to panel.tickers), results (DataFrame from batch_returns), spy_join,
+    fred_join, renderer (ReportRenderer)
+    '''
+    first, last = panel.window(qty)
+    for j, name in enumerate(names):
+        for i in results.loc[results['portfolio'] == name, 'years_tgt']:
+            ret_calc, tot_ret_dict, _ = panel.returns(i, spy_join, fred_join, panel.months[first[j]],
+                                                      panel.months[last[j]], qty[:, j])
+            renderer.submit(ret_calc, tot_ret_dict, f'{name}-{i}y')
+
+
+def batch_analysis(source, ap_api_key=None, fred_api_key=None, report=False):
+    '''
+    Downloads market data once for a batch of portfolios and analyzes all of them.
+
+    Each unique ticker is requested once, and S&P 500 and risk free rate data are
+    pulled once for the whole batch.  In the development environment the stored
+    port_panel, working_spy and working_fred datasets are used instead.
+
+    Param: source (str) input subfolder or manifest file (see load_portfolios), report (bool)
+    to also write a report for every portfolio and period (see report.py)
+
+    Returns: results DataFrame (see batch_returns)
+    '''
+    portfolios = load_portfolios(source)
+    tickers, names, qty = holdings_matrix(portfolios)
+
+    if APP_ENV == 'development':
+        spy_join = store_read('working_spy').set_index('month')
+        fred_join = store_read('working_fred').set_index('month')
+        compact = store_read('port_panel')
+
+    else:
+        universe = [{'tck': t, 'qty': 0} for t in tickers]
+        ingestor = Ingestor()
+        spy_join, fred_join, sub, minomax, maxomin = ingestor.run(universe, ap_api_key, fred_api_key)
+        # The full (untrimmed) panel of every ticker from this download
+        compact = ingestor.panel
+
+    panel = ReturnsPanel(compact)
+    qty = pd.DataFrame(qty, index=tickers)
+    missing = qty.index.difference(panel.tickers)
+    if len(missing) > 0:
+        print(f'WARNING! NO DATA FOR TICKER(S): {", ".join(missing)}', flush=True)
+    qty = qty.reindex(panel.tickers, fill_value=0).to_numpy()
+
+    index = benchmark_index(spy_join, fred_join)
+    results = batch_returns(panel, names, qty, index, None)
+
+    if report:
+        from app.report import ReportRenderer
+
+        with ReportRenderer() as renderer:
+            batch_reports(panel, names, qty, results, index, None, renderer)
+
+    return results
+
+
+if __name__ == '__main__':
+
+    # Load environment variables
+    load_dotenv()
+    ap_api_key = os.environ.get('ALPHAVANTAGE_API_KEY')
+    fred_api_key = os.environ.get('FRED_API_KEY')
+    batch_source = sys.argv[1] if len(sys.argv) > 1 else os.environ.get('PORTFOLIO_BATCH')
+    report = 'report' in sys.argv[2:]
+
+    results = batch_analysis(batch_source, ap_api_key, fred_api_key, report)
+
+    results_filepath = os.path.join(os.path.dirname(os.path.abspath(
+        __file__)), '..', 'data', 'batch_results.csv')
+    results.to_csv(results_filepath, index=False)
+
+    print('-----------------------------------------------', flush=True)
+    print(f'Analyzed {len(set(results["portfolio"]))} portfolios.', flush=True)
+    print(f'WRITING RESULTS TO CSV: {os.path.abspath(results_filepath)}', flush=True)
+    print('-----------------------------------------------', flush=True)
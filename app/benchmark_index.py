@@ -0,0 +1,223 @@
+# benchmark_index.py
+
+# IMPORT PACKAGES
+
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pyarrow import feather
+
+from app.store import store_path
+
+# FUNCTIONS
+
+# Bump when the layout of the index file changes; older files are then rebuilt
+INDEX_VERSION = 2
+
+# Columns of the index file.  Row 0 is the month before the first month (an empty
+# starting point for the running sums and products); row i + 1 holds month i.
+# Missing values are stored as 0 and flagged by the running counts (n_s for S&P 500
+# returns, n_r for rates, n_e for months with both).
+INDEX_COLUMNS = ['spret', 'rate', 'growth', 'n_s', 'sum_s', 'sumsq_s', 'n_r', 'n_e', 'sum_e', 'sumsq_e']
+
+
+class BenchmarkIndex:
+    '''
+    Month-indexed S&P 500 returns, cumulative S&P 500 growth and monthly risk free
+    rates, with running sums (counts, sums, sums of squares) of S&P 500 returns and
+    S&P 500 excess returns.
+
+    Months are consecutive, so a month's row is found from its ordinal, and the
+    S&P 500 measures of any analysis period come from the running sums at its first
+    and last month instead of aligning and accumulating the series on every call.
+
+    Param: first_month (Period), columns (dictionary of {name: array} with INDEX_COLUMNS),
+    path (str or None) of the saved file, source (str or None) fingerprint of the series
+    it was built from (see index_source())
+
+    Example: index = BenchmarkIndex.build(spy_join, fred_join); index.stats(months)
+    '''
+
+    def __init__(self, first_month, columns, path=None, source=None):
+        self.first_month = first_month
+        self.path = path
+        self.source = source
+        for name in INDEX_COLUMNS:
+            setattr(self, name, columns[name])
+        self.months = pd.period_range(first_month, periods=len(self.spret) - 1, freq='M', name='month')
+
+    @classmethod
+    def build(cls, spy_join, fred_join):
+        '''
+        Builds the index from the monthly S&P 500 returns (spy_format()) and risk free
+        rates (fred_format()), over every month from the first to the last month of either.
+        '''
+        spy = spy_join['spret'] if isinstance(spy_join, pd.DataFrame) else spy_join
+        fred = fred_join['rate'] if isinstance(fred_join, pd.DataFrame) else fred_join
+        months = pd.period_range(min(spy.index.min(), fred.index.min()), max(spy.index.max(), fred.index.max()),
+                                 freq='M', name='month')
+
+        spret = spy.reindex(months).to_numpy(dtype='float64')
+        rate = fred.reindex(months).to_numpy(dtype='float64')
+        valid_s = np.isfinite(spret)
+        valid_r = np.isfinite(rate)
+        valid_e = valid_s & valid_r
+        s = np.where(valid_s, spret, 0.0)
+        e = np.where(valid_e, spret - rate, 0.0)
+
+        def running(x, start=0.0, func=np.cumsum):
+            return np.concatenate([[start], func(x)])
+
+        columns = {'spret': running(s, func=np.asarray), 'rate': running(np.where(valid_r, rate, 0.0), func=np.asarray),
+                   'growth': running(1 + s, 1.0, np.cumprod),
+                   'n_s': running(valid_s.astype('float64')), 'sum_s': running(s), 'sumsq_s': running(s * s),
+                   'n_r': running(valid_r.astype('float64')),
+                   'n_e': running(valid_e.astype('float64')), 'sum_e': running(e), 'sumsq_e': running(e * e)}
+
+        return cls(months[0], columns, source=index_source(spy_join, fred_join))
+
+    def write(self, name='benchmark_index'):
+        '''
+        Saves the index to the columnar store (uncompressed, so it can be memory-mapped).
+
+        Returns: path of the written file
+        '''
+        table = pa.table({c: getattr(self, c) for c in INDEX_COLUMNS})
+        table = table.replace_schema_metadata({'version': str(INDEX_VERSION), 'first_month': str(self.first_month),
+                                               'source': self.source or ''})
+
+        filepath = store_path(name)
+        feather.write_feather(table, f'{filepath}.tmp', compression='uncompressed')
+        os.replace(f'{filepath}.tmp', filepath)
+        self.path = filepath
+
+        return filepath
+
+    @classmethod
+    def read(cls, name='benchmark_index', path=None):
+        '''
+        Opens a saved index through a memory map (the arrays are views of the file, not copies).
+
+        Returns: BenchmarkIndex or None if there is no index or it has another version
+        '''
+        filepath = path or store_path(name)
+        if not os.path.exists(filepath):
+            return None
+
+        table = feather.read_table(filepath, memory_map=True)
+        meta = table.schema.metadata or {}
+        if meta.get(b'version') != str(INDEX_VERSION).encode():
+            return None
+
+        columns = {c: table.column(c).to_numpy() for c in INDEX_COLUMNS}
+
+        return cls(pd.Period(meta[b'first_month'].decode(), freq='M'), columns, filepath, meta[b'source'].decode() or None)
+
+    def rows(self, months):
+        '''
+        Returns: index rows of the given months (PeriodIndex), -1 where the index has no such month
+        '''
+        rows = months.asi8 - self.first_month.ordinal + 1
+        rows[(rows < 1) | (rows >= len(self.spret))] = -1
+
+        return rows
+
+    def _valid(self, counts, rows):
+        return (rows > 0) & (counts[rows] - counts[np.maximum(rows - 1, 0)] > 0)
+
+    def values(self, months):
+        '''
+        Returns: S&P 500 returns and risk free rates for the given months (nan where missing)
+        '''
+        rows = self.rows(months)
+        spret = np.where(self._valid(self.n_s, rows), self.spret[rows], np.nan)
+        rate = np.where(self._valid(self.n_r, rows), self.rate[rows], np.nan)
+
+        return spret, rate
+
+    def cum_growth(self, months):
+        '''
+        Returns: cumulative S&P 500 return factors from the month before the first given month
+        (nan in months without an S&P 500 return, like the monthly engine, and in every
+        month if the first given month is outside the index)
+        '''
+        rows = self.rows(months)
+        if len(rows) == 0 or rows[0] < 1:
+            return np.full(len(rows), np.nan)
+
+        cum = self.growth[rows] / self.growth[rows[0] - 1]
+        cum[~self._valid(self.n_s, rows)] = np.nan
+
+        return cum
+
+    def stats(self, months):
+        '''
+        S&P 500 measures of an analysis period from the running sums at its ends.
+
+        Param: months (PeriodIndex of consecutive months with returns in the period)
+
+        Returns: dictionary with months_act, ann_spret, mon_spret, mon_sp_sdev, ann_sp_sdev,
+        var_s (variance of S&P 500 returns) and sharpe_sp, or None if the months are
+        not consecutive or not all in the index
+        '''
+        rows = self.rows(months)
+        if len(rows) == 0 or rows[0] < 1 or rows[-1] - rows[0] + 1 != len(rows):
+            return None
+
+        a = rows[0] - 1
+        b = rows[-1]
+
+        def moments(n, total, squares):
+            n = n[b] - n[a]
+            total = total[b] - total[a]
+            squares = squares[b] - squares[a]
+            mean = total / n if n > 0 else np.nan
+            var = (squares - total * mean) / (n - 1) if n > 1 else np.nan
+            return mean, max(var, 0.0) if np.isfinite(var) else var
+
+        mean_s, var_s = moments(self.n_s, self.sum_s, self.sumsq_s)
+        mean_e, var_e = moments(self.n_e, self.sum_e, self.sumsq_e)
+
+        months_act = len(rows)
+        cum_spret = self.growth[b] / self.growth[a] if self.n_s[b] > self.n_s[b - 1] else np.nan
+        mon_sp_sdev = var_s ** .5
+
+        return {'months_act': months_act, 'cum_spret': cum_spret,
+                'ann_spret': cum_spret**(1 / (months_act / 12)) - 1, 'mon_spret': cum_spret**(1 / months_act) - 1,
+                'mon_sp_sdev': mon_sp_sdev, 'ann_sp_sdev': mon_sp_sdev * (12 ** .5), 'var_s': var_s,
+                'sharpe_sp': (mean_e / var_e ** .5) * (12 ** .5)}
+
+
+def index_source(spy_join, fred_join):
+    '''
+    Returns: fingerprint (str) of the months and values of the S&P 500 returns and risk
+    free rates an index is built from
+    '''
+    spy = spy_join['spret'] if isinstance(spy_join, pd.DataFrame) else spy_join
+    fred = fred_join['rate'] if isinstance(fred_join, pd.DataFrame) else fred_join
+
+    digest = hashlib.sha1()
+    for series in [spy, fred]:
+        digest.update(np.asarray(series.index.asi8, dtype='int64').tobytes())
+        digest.update(series.to_numpy(dtype='float64').tobytes())
+
+    return digest.hexdigest()
+
+
+def benchmark_index(spy_join, fred_join, name='benchmark_index'):
+    '''
+    Opens the saved benchmark index, building and saving it first unless it was built
+    from the same S&P 500 returns and risk free rates.  Runs on unchanged market data
+    (and the worker processes of a run) so share one file instead of rewriting it.
+
+    Returns: BenchmarkIndex opened through a memory map of the saved file
+    '''
+    index = BenchmarkIndex.read(name)
+    if index is not None and index.source == index_source(spy_join, fred_join):
+        return index
+
+    BenchmarkIndex.build(spy_join, fred_join).write(name)
+
+    return BenchmarkIndex.read(name)
@@ -0,0 +1,207 @@
+# benchmark_registry.py
+
+# IMPORT PACKAGES
+
+import os
+import pandas as pd
+from dotenv import load_dotenv
+
+from app.cache import cache_read
+from app.ingest import Ingestor, ingest
+from app.store import store_read, store_write
+from app.returns_engine import ReturnsPanel
+from app.portfolio_import import portfolio_import
+from app import APP_ENV
+
+# FUNCTIONS
+
+def semiannual_rate(daily):
+    '''
+    Converts daily Treasury yields (percent, bond-equivalent with semi-annual
+    compounding) to monthly risk free rates, like fred_format().
+
+    Param: daily (DataFrame with date and rate columns)
+
+    Returns: pandas Series of monthly risk free rates indexed by month
+    '''
+    rate = daily.groupby(daily['date'].dt.to_period('M'))['rate'].mean()
+    rate.index.name = 'month'
+
+    return (1 + rate / 200)**(1 / 6) - 1
+
+
+def monthly_rate(daily):
+    '''
+    Converts daily annual rates (percent, compounded monthly) to monthly risk free rates.
+    '''
+    rate = daily.groupby(daily['date'].dt.to_period('M'))['rate'].mean()
+    rate.index.name = 'month'
+
+    return rate / 1200
+
+
+# Risk free rate sources: FRED series id and the conversion of its daily
+# observations to monthly rates.  Add entries with register_risk_free().
+RISK_FREE_SOURCES = {
+    'DGS1': semiannual_rate,     # 1-Year Treasury constant maturity (the default)
+    'DGS6MO': semiannual_rate,   # 6-Month Treasury constant maturity
+    'DGS3MO': semiannual_rate,   # 3-Month Treasury constant maturity
+    'DFF': monthly_rate,         # Effective federal funds rate
+}
+
+
+def register_risk_free(series_id, convert):
+    '''
+    Adds a FRED series as a risk free rate source.
+
+    Param: series_id (str) like 'DGS2', convert (function of a daily DataFrame with date and
+    rate columns returning monthly rates indexed by month)
+    '''
+    RISK_FREE_SOURCES[series_id] = convert
+
+
+def benchmark_symbols():
+    '''
+    Returns the benchmark symbols to compare against (BENCHMARKS, comma separated, default SPY).
+    '''
+    return [s.strip().upper() for s in os.environ.get('BENCHMARKS', 'SPY').split(',') if s.strip()]
+
+
+def risk_free_series():
+    '''
+    Returns the FRED series used for risk free rates (RISK_FREE_SERIES, default DGS1).
+    '''
+    series_id = os.environ.get('RISK_FREE_SERIES', 'DGS1').upper()
+    if series_id not in RISK_FREE_SOURCES:
+        raise ValueError(f'Unknown risk free series {series_id}; register it with register_risk_free()')
+
+    return series_id
+
+
+def benchmark_matrix(frames):
+    '''
+    Converts benchmark price data to a month x benchmark matrix of monthly returns.
+
+    Param: frames (dictionary of {symbol: DataFrame with timestamp and adj close columns})
+
+    Returns: DataFrame of monthly returns indexed by month, one column per benchmark
+    '''
+    prices = pd.DataFrame({s: f.set_index(f['timestamp'].dt.to_period('M'))['adj close'] for s, f in frames.items()})
+    prices = prices.sort_index()
+    prices.index.name = 'month'
+
+    return prices.pct_change(fill_method=None)
+
+
+def benchmark_pull(symbols, ap_api_key, fred_api_key, series_id='DGS1', ingestor=None, spy_join=None, fred_join=None):
+    '''
+    Downloads benchmark and risk free data through the cached, rate limited downloader.
+
+    The S&P 500 returns and DGS1 rates already returned by ingest() can be passed in, so
+    SPY and DGS1 are not downloaded a second time.
+
+    Param: symbols (list of str), ap_api_key (str), fred_api_key (str), series_id (str),
+    ingestor (Ingestor or None), spy_join (SPY monthly returns or None), fred_join (monthly
+    DGS1 risk free rates or None)
+
+    Returns: month x benchmark returns (DataFrame), monthly risk free rates (Series)
+    '''
+    known = {'SPY': spy_join} if spy_join is not None else {}
+    download = [s for s in dict.fromkeys(symbols) if s not in known]
+    rates_known = fred_join is not None and series_id == 'DGS1'
+
+    frames, rates = {}, None
+    if len(download) > 0 or not rates_known:
+        if ingestor is None:
+            ingestor = Ingestor()
+        frames, rates = ingestor.run_benchmarks(download, ap_api_key, fred_api_key, None if rates_known else series_id)
+
+    failed = [s for s, f in frames.items() if not isinstance(f, pd.DataFrame)]
+    if len(failed) > 0:
+        print(f'WARNING! NO DATA FOR BENCHMARK(S): {", ".join(failed)}', flush=True)
+    if not rates_known and not isinstance(rates, pd.DataFrame):
+        raise ValueError(f'Unable to download the {series_id} risk free series: {rates}')
+
+    matrix = benchmark_matrix({s: f for s, f in frames.items() if s not in failed})
+    columns = {**{s: matrix[s] for s in matrix.columns}, **{s: v for s, v in known.items() if s in symbols}}
+    bench_join = pd.DataFrame(columns, columns=[s for s in dict.fromkeys(symbols) if s in columns]).sort_index()
+    bench_join.index.name = 'month'
+
+    return bench_join, fred_join if rates_known else RISK_FREE_SOURCES[series_id](rates)
+
+
+def benchmark_cached(symbols, series_id='DGS1'):
+    '''
+    Reads benchmark and risk free data from the market data cache only (no downloads).
+
+    Returns: month x benchmark returns (DataFrame), monthly risk free rates (Series)
+    '''
+    frames = {}
+    for s in symbols:
+        entry = cache_read('alphavantage', s, 'monthly_adjusted')
+        if entry is None:
+            print(f'WARNING! BENCHMARK {s} IS NOT IN THE MARKET DATA CACHE', flush=True)
+        else:
+            frames[s] = entry['data']
+
+    entry = cache_read('fred', series_id, 'observations')
+    if entry is None:
+        raise ValueError(f'The {series_id} risk free series is not in the market data cache')
+
+    return benchmark_matrix(frames), RISK_FREE_SOURCES[series_id](entry['data'])
+
+
+def compare_benchmarks(panel, spy_join, bench_join, fred_join, min_start, max_end, periods=[1, 2, 3, 5]):
+    '''
+    Compares a portfolio with every benchmark over each analysis period (see
+    ReturnsPanel.returns()).
+
+    Like the report, the longer periods are skipped once a period is cut short by the data.
+
+    Returns: DataFrame with one row per (period, benchmark)
+    '''
+    results = []
+    for i in periods:
+        ret_calc, _, _ = panel.returns(i, spy_join, fred_join, min_start, max_end, bench_join=bench_join)
+        comparison = ret_calc['benchmarks']
+        for j, k in enumerate(['years_tgt', 'st_date', 'end_date', 'ann_ret', 'sharpe_port']):
+            comparison.insert(j, k, ret_calc[k])
+        results.append(comparison)
+        if ret_calc['years_tgt'] != ret_calc['years_act']:
+            break
+
+    return pd.concat(results).reset_index()
+
+
+if __name__ == '__main__':
+
+    # Load environment variables
+    load_dotenv()
+    port_file_name = os.environ.get('PORTFOLIO_FILE_NAME')
+    ap_api_key = os.environ.get('ALPHAVANTAGE_API_KEY')
+    fred_api_key = os.environ.get('FRED_API_KEY')
+    symbols = benchmark_symbols()
+    series_id = risk_free_series()
+
+    if APP_ENV == 'development':
+        sub = store_read('working_port')
+        maxomin = sub['month'].min()
+        minomax = sub['month'].max()
+        spy_join = store_read('working_spy').set_index('month')
+        bench_join, fred_join = benchmark_cached(symbols, series_id)
+
+    else:
+        # SPY and DGS1 come with the portfolio download and are reused for the benchmarks
+        portfolio = portfolio_import(port_file_name)
+        spy_join, dgs1_join, sub, minomax, maxomin = ingest(portfolio, ap_api_key, fred_api_key)
+        bench_join, fred_join = benchmark_pull(symbols, ap_api_key, fred_api_key, series_id,
+                                               spy_join=spy_join, fred_join=dgs1_join)
+
+    panel = ReturnsPanel(sub)
+    comparison = compare_benchmarks(panel, spy_join, bench_join, fred_join, maxomin, minomax)
+    store_write(comparison, 'benchmark_comparison')
+
+    print('-----------------------------------------------', flush=True)
+    print(f'BENCHMARK COMPARISON (RISK FREE RATE: {series_id})', flush=True)
+    print(comparison.to_string(index=False, float_format=lambda x: f'{x:.4f}'), flush=True)
+    print('-----------------------------------------------', flush=True)
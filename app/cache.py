@@ -0,0 +1,158 @@
+# cache.py
+
+# IMPORT PACKAGES
+
+import datetime
+import json
+import os
+
+from app.instrument import stage
+
+# FUNCTIONS
+
+# Bump when the layout of cache files changes; older files are then ignored
+# and rebuilt from the API on the next run.
+CACHE_VERSION = 2
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'cache')
+
+
+def cache_path(source, symbol, series):
+    '''
+    Builds the path of the cache files for a (source, symbol, series) key (without extension).
+
+    Example: cache_path('alphavantage', 'SPY', 'monthly_adjusted')
+
+    Returns: data/cache/alphavantage/monthly_adjusted/SPY
+    '''
+    return os.path.join(CACHE_DIR, source, series, symbol)
+
+
+def cache_meta(source, symbol, series):
+    '''
+    Reads the metadata of a cache entry (without its observations, so pandas is not needed).
+
+    Returns: metadata (dict) or None if there is no entry or it was written by another cache version
+    '''
+    filepath = cache_path(source, symbol, series)
+
+    if not (os.path.exists(f'{filepath}.json') and os.path.exists(f'{filepath}.feather')):
+        return None
+
+    with open(f'{filepath}.json', 'r') as meta_file:
+        entry = json.load(meta_file)
+
+    if entry.get('version') != CACHE_VERSION:
+        return None
+
+    return entry
+
+
+def cache_read(source, symbol, series):
+    '''
+    Reads a cache entry: a JSON file of metadata and a Feather file of observations.
+
+    Returns: entry (dict with metadata and a 'data' DataFrame) or None if there is no
+    entry or it was written by another cache version
+    '''
+    # Imported here so that freshness checks (cache_meta, cache_fresh) start quickly
+    from pyarrow import feather
+
+    entry = cache_meta(source, symbol, series)
+    if entry is None:
+        return None
+    filepath = cache_path(source, symbol, series)
+
+    with stage('cache read', source=source, symbol=symbol) as rec:
+        entry['data'] = feather.read_table(f'{filepath}.feather', memory_map=True).to_pandas()
+        rec['rows'] = len(entry['data'])
+
+    return entry
+
+
+def cache_ttl():
+    '''
+    Returns the number of hours a cache entry stays fresh (MARKET_CACHE_TTL_HOURS, default 12).
+    '''
+    return float(os.environ.get('MARKET_CACHE_TTL_HOURS', 12))
+
+
+def cache_fresh(entry, ttl_hours=None):
+    '''
+    Checks whether a cache entry was refreshed within the last ttl_hours hours.
+    '''
+    if entry is None:
+        return False
+
+    if ttl_hours is None:
+        ttl_hours = cache_ttl()
+
+    fetched_at = datetime.datetime.fromisoformat(entry['fetched_at'])
+    age = datetime.datetime.now() - fetched_at
+
+    return age < datetime.timedelta(hours=ttl_hours)
+
+
+def cache_update(entry, source, symbol, series, data, date_col, period=None):
+    '''
+    Merges new or revised observations into a cache entry and writes it to disk.
+
+    Rows are matched on date_col, or on the period of date_col if period is given.
+    Alpha Vantage dates the row of the current month with its latest trading day,
+    so monthly series are matched on the month (period='M'): a re-dated month
+    replaces the cached row instead of being added next to it.  Dates (or periods)
+    that are not in the new data are kept as they are, so a partial (incremental)
+    download only touches the dates it contains.
+
+    Param: entry (dict or None), source (str), symbol (str), series (str),
+    data (DataFrame of new observations), date_col (str) like 'timestamp',
+    period (str or None) like 'M'
+
+    Returns: updated entry (dict)
+    '''
+    import pandas as pd
+
+    if entry is None:
+        entry = {'version': CACHE_VERSION, 'source': source, 'symbol': symbol, 'series': series,
+                 'data': data.iloc[0:0]}
+
+    old = entry['data']
+    data = data.sort_values(by=[date_col]).reset_index(drop=True)
+
+    def match_keys(frame):
+        return frame[date_col] if period is None else frame[date_col].dt.to_period(period)
+
+    new_keys = match_keys(data)
+    old_keys = match_keys(old)
+
+    # Count rows that are new or differ from the cached row for the same date (or period)
+    previous = old.assign(_key=old_keys).drop_duplicates('_key', keep='last')
+    matched = data.assign(_key=new_keys).merge(previous, on='_key', how='left', suffixes=('', ' old'), indicator=True)
+    changed = (matched['_merge'] == 'left_only').to_numpy()
+    for col in data.columns:
+        changed = changed | (matched[col] != matched[f'{col} old']).to_numpy()
+
+    merged = pd.concat([old[~old_keys.isin(new_keys)], data], ignore_index=True)
+    merged = merged.sort_values(by=[date_col]).reset_index(drop=True)
+
+    entry['data'] = merged
+    entry['fetched_at'] = datetime.datetime.now().isoformat()
+    entry['last_obs'] = f'{merged[date_col].max():%Y-%m-%d}' if len(merged) > 0 else None
+    entry['last_changed'] = int(changed.sum())
+
+    filepath = cache_path(source, symbol, series)
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+
+    # Write to temporary files first so an interrupted run never leaves a
+    # half-written entry behind
+    with stage('cache write', source=source, symbol=symbol) as rec:
+        merged.to_feather(f'{filepath}.feather.tmp', compression='uncompressed')
+        os.replace(f'{filepath}.feather.tmp', f'{filepath}.feather')
+        rec['rows'] = len(merged)
+        rec['bytes'] = os.path.getsize(f'{filepath}.feather')
+
+    with open(f'{filepath}.json.tmp', 'w') as meta_file:
+        json.dump({k: v for k, v in entry.items() if k != 'data'}, meta_file)
+    os.replace(f'{filepath}.json.tmp', f'{filepath}.json')
+
+    return entry
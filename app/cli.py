@@ -0,0 +1,268 @@
+# cli.py
+
+# IMPORT PACKAGES
+
+import argparse
+import datetime
+import hashlib
+import json
+import math
+import os
+import sys
+
+from app import load_env
+from app.cache import cache_meta, cache_fresh
+from app import store
+from app.store import store_path
+from app.portfolio_import import portfolio_import
+
+# FUNCTIONS
+
+# Everything imported above is light.  pandas, numpy, requests and plotly are only
+# imported by the command step that needs them, so a run that finds its data up to
+# date (fetch) or its results already calculated (analyze) finishes in a fraction
+# of the time of a full run.
+
+RESULTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'analysis_results.json')
+
+WORKING_STORES = ['working_port', 'working_spy', 'working_fred']
+
+
+def working_portfolio_path():
+    '''
+    Returns: path of the fingerprint of the portfolio the working datasets were built from
+    '''
+    return os.path.join(store.STORE_DIR, 'working_portfolio.json')
+
+
+def portfolio_fingerprint(portfolio):
+    '''
+    Returns: hash (str) of the tickers and quantities of a portfolio, in any row order
+    '''
+    positions = sorted((str(p['tck']), float(p['qty'])) for p in portfolio)
+
+    return hashlib.sha1(json.dumps(positions).encode('utf-8')).hexdigest()
+
+
+def working_portfolio():
+    '''
+    Returns: fingerprint (str) of the portfolio of the working datasets, or None
+    '''
+    if not os.path.exists(working_portfolio_path()):
+        return None
+    with open(working_portfolio_path(), 'r') as fingerprint_file:
+        return json.load(fingerprint_file).get('portfolio')
+
+
+def market_data_fresh(portfolio):
+    '''
+    Checks, from the cache metadata only, whether every series of the portfolio, the
+    S&P 500 and the risk free rate is fresh (see cache_fresh()) and the working
+    datasets were built from the same tickers and quantities after the last download.
+    '''
+    if os.environ.get('MARKET_CACHE', 'on').lower() == 'off':
+        return False
+
+    if working_portfolio() != portfolio_fingerprint(portfolio):
+        return False
+
+    keys = [('alphavantage', p['tck'], 'monthly_adjusted') for p in portfolio]
+    keys += [('alphavantage', 'SPY', 'monthly_adjusted'), ('fred', 'DGS1', 'observations')]
+    entries = [cache_meta(*k) for k in keys]
+    if not all(cache_fresh(entry) for entry in entries):
+        return False
+
+    stores = [store_path(name) for name in WORKING_STORES]
+    if not all(os.path.exists(path) for path in stores):
+        return False
+    stored_at = datetime.datetime.fromtimestamp(min(os.path.getmtime(path) for path in stores))
+
+    return max(datetime.datetime.fromisoformat(entry['fetched_at']) for entry in entries) <= stored_at
+
+
+def fetch(portfolio, ap_api_key, fred_api_key, force=False, partial=None):
+    '''
+    Downloads market data for the portfolio (through the cache) and saves the working
+    datasets used by analyze and render.  With partial, positions that could not be
+    downloaded are left out instead of stopping (see fetch_job.py).
+
+    Returns: True if data were downloaded, False if they were already up to date
+    '''
+    if not force and market_data_fresh(portfolio):
+        return False
+
+    from app.ingest import ingest
+    from app.store import store_write
+
+    spy_join, fred_join, sub, minomax, maxomin = ingest(portfolio, ap_api_key, fred_api_key, partial)
+    store_write(sub, 'working_port')
+    store_write(spy_join.reset_index(), 'working_spy')
+    store_write(fred_join.reset_index(), 'working_fred')
+
+    # The working datasets are only reused for the same tickers and quantities
+    with open(f'{working_portfolio_path()}.tmp', 'w') as fingerprint_file:
+        json.dump({'portfolio': portfolio_fingerprint(portfolio)}, fingerprint_file)
+    os.replace(f'{working_portfolio_path()}.tmp', working_portfolio_path())
+
+    return True
+
+
+def input_fingerprint(periods):
+    '''
+    Returns: dictionary identifying the inputs of an analysis (periods and the size and
+    modification time of each working dataset)
+
+    Raises: FileNotFoundError if a working dataset has not been built yet
+    '''
+    missing = [name for name in WORKING_STORES if not os.path.exists(store_path(name))]
+    if len(missing) > 0:
+        raise FileNotFoundError(f"No downloaded market data ({', '.join(missing)} not found). "
+                                "Run 'python -m app fetch' first.")
+
+    stores = {}
+    for name in WORKING_STORES:
+        stat = os.stat(store_path(name))
+        stores[name] = [stat.st_mtime_ns, stat.st_size]
+
+    return {'periods': periods, 'stores': stores}
+
+
+def read_results():
+    '''
+    Returns: saved analysis results (dict) or None
+    '''
+    if not os.path.exists(RESULTS_PATH):
+        return None
+    with open(RESULTS_PATH, 'r') as results_file:
+        return json.load(results_file)
+
+
+def analyze(periods, recalculate=False):
+    '''
+    Calculates the results of every analysis period from the working datasets, or
+    returns the saved results when the working datasets have not changed since.
+
+    Like the portfolio report, the longer periods are skipped once a period is cut
+    short by the data.
+
+    Returns: dictionary with the input fingerprint and a list of results (one dictionary
+    per period, with the cumulative returns for charting under 'chart')
+    '''
+    fingerprint = input_fingerprint(periods)
+    saved = read_results()
+    if not recalculate and saved is not None and saved['fingerprint'] == fingerprint:
+        return saved
+
+    from app.store import store_read
+    from app.returns_engine import ReturnsPanel, json_value
+    from app.parallel import parallel_returns
+    from app.benchmark_index import benchmark_index
+
+    sub = store_read('working_port')
+    spy_join = store_read('working_spy').set_index('month')
+    fred_join = store_read('working_fred').set_index('month')
+    maxomin = sub['month'].min()
+    minomax = sub['month'].max()
+
+    panel = ReturnsPanel(sub)
+    index = benchmark_index(spy_join, fred_join)
+    period_returns = parallel_returns(panel, [(0, i, maxomin, minomax) for i in periods], index, None)
+
+    results = []
+    for ret_calc, tot_ret_dict, _ in period_returns:
+        result = {k: json_value(v) for k, v in ret_calc.items()}
+        result['chart'] = {k: [json_value(v) for v in values] for k, values in tot_ret_dict.items()}
+        results.append(result)
+        if ret_calc['years_tgt'] != ret_calc['years_act']:
+            break
+
+    saved = {'fingerprint': fingerprint, 'results': results}
+    with open(f'{RESULTS_PATH}.tmp', 'w') as results_file:
+        json.dump(saved, results_file)
+    os.replace(f'{RESULTS_PATH}.tmp', RESULTS_PATH)
+
+    return saved
+
+
+def render(results, name, fmt=None):
+    '''
+    Writes a report for every analysis period (see report.py).
+
+    Returns: list of written file paths
+    '''
+    from app.report import ReportRenderer
+
+    renderer = ReportRenderer(fmt=fmt)
+    try:
+        for result in results:
+            ret_calc = {k: math.nan if v is None else v for k, v in result.items() if k != 'chart'}
+            tot_ret_dict = {k: [math.nan if v is None else v for v in values] for k, values in result['chart'].items()}
+            renderer.submit(ret_calc, tot_ret_dict, f'{name}-{result["years_tgt"]}y')
+    finally:
+        paths = renderer.close()
+
+    return paths
+
+
+def _fmt(value, spec):
+    return 'n/a' if value is None else format(value, spec)
+
+
+def print_results(results):
+    for r in results:
+        print(f"{r['years_tgt']}Y ({r['st_date']} to {r['end_date']}): return {_fmt(r['ann_ret'], '.2%')}, "
+              f"std. dev. {_fmt(r['ann_sdev'], '.2%')}, sharpe {_fmt(r['sharpe_port'], '.2f')}, "
+              f"beta {_fmt(r['beta'], '.2f')}", flush=True)
+
+
+def main(argv=None):
+    '''
+    Command-line entry point (python -m app).
+
+    Example: python -m app fetch; python -m app analyze; python -m app render --format png
+    '''
+    parser = argparse.ArgumentParser(prog='python -m app', description='Portfolio performance analysis')
+    parser.add_argument('--portfolio', help='portfolio CSV file in the input folder (default: PORTFOLIO_FILE_NAME)')
+    parser.add_argument('--periods', default='1,2,3,5', help='analysis periods in years (default: 1,2,3,5)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    fetch_parser = commands.add_parser('fetch', help='download market data unless the cached data are fresh')
+    fetch_parser.add_argument('--force', action='store_true', help='download even if the cached data are fresh')
+    fetch_parser.add_argument('--partial', action='store_true', default=None,
+                              help='continue without positions that could not be downloaded (default: FETCH_PARTIAL)')
+
+    analyze_parser = commands.add_parser('analyze', help='calculate results from the downloaded data')
+    analyze_parser.add_argument('--recalculate', action='store_true', help='ignore saved results')
+
+    render_parser = commands.add_parser('render', help='write reports of the results')
+    render_parser.add_argument('--format', choices=['html', 'png', 'browser'], help='default: REPORT_FORMAT')
+
+    args = parser.parse_args(argv)
+
+    load_env()
+    port_file_name = args.portfolio or os.environ.get('PORTFOLIO_FILE_NAME', 'sample.csv')
+    periods = [int(p) for p in args.periods.split(',')]
+
+    if args.command == 'fetch':
+        portfolio = portfolio_import(port_file_name)
+        downloaded = fetch(portfolio, os.environ.get('ALPHAVANTAGE_API_KEY'), os.environ.get('FRED_API_KEY'), args.force, args.partial)
+        print('Market data downloaded.' if downloaded else 'Market data are up to date.', flush=True)
+
+    else:
+        try:
+            saved = analyze(periods, args.command == 'analyze' and args.recalculate)
+        except FileNotFoundError as err:
+            print(f'ERROR: {err}', flush=True)
+            sys.exit(1)
+
+        if args.command == 'analyze':
+            print_results(saved['results'])
+
+        else:
+            name = os.path.splitext(os.path.basename(port_file_name))[0]
+            for path in render(saved['results'], name, args.format):
+                print(f'WROTE REPORT: {os.path.abspath(path)}', flush=True)
+
+
+if __name__ == '__main__':
+    main()
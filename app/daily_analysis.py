@@ -0,0 +1,132 @@
+# daily_analysis.py
+
+# IMPORT PACKAGES
+
+import os
+import sys
+import pandas as pd
+from dotenv import load_dotenv
+
+from app.ingest import Ingestor
+from app.rolling import rolling_stats
+from app.store import store_write, store_read
+from app.portfolio_import import portfolio_import
+from app import APP_ENV
+
+# FUNCTIONS
+
+def daily_risk_free(fred, dates):
+    '''
+    Converts 1-Year Treasury Bill rates to daily risk free rates on the given trading days.
+
+    Uses the same semi-annual compounding as the monthly conversion in other_data_pull,
+    with 126 trading days per half year.
+
+    Param: fred (DataFrame with date and rate columns), dates (DatetimeIndex)
+
+    Returns: pandas Series of daily risk free rates indexed by date
+    '''
+    rate = fred.set_index('date')['rate'].sort_index()
+    rate = rate.reindex(rate.index.union(dates)).ffill().reindex(dates)
+
+    return (1 + rate / 200)**(1 / 126) - 1
+
+
+def daily_returns(frames, portfolio, fred, window=252):
+    '''
+    Calculates daily portfolio and S&P 500 returns with rolling risk measures.
+
+    Param: frames (dictionary of {symbol: daily DataFrame}, including SPY), portfolio
+    (list of dict), fred (DataFrame of daily rates), window (int) number of trading days
+
+    Returns: DataFrame indexed by date with port ret, spret and rate columns and the
+    rolling measures from rolling.rolling_stats()
+    '''
+    tickers = [p['tck'] for p in portfolio]
+    qty = pd.Series({p['tck']: float(p['qty']) for p in portfolio})
+
+    adj_close = pd.DataFrame({t: frames[t].set_index('timestamp')['adj close'] for t in tickers}).sort_index()
+    close = pd.DataFrame({t: frames[t].set_index('timestamp')['close'] for t in tickers}).reindex_like(adj_close)
+
+    # Resize data for consistent periods (latest first day to earliest last day)
+    start = adj_close.apply(pd.Series.first_valid_index).max()
+    end = adj_close.apply(pd.Series.last_valid_index).min()
+    adj_close = adj_close.loc[start:end].ffill()
+    close = close.loc[start:end].ffill()
+    dates = adj_close.index
+
+    spy = frames['SPY'].set_index('timestamp')['adj close'].sort_index()
+    spy = spy.reindex(spy.index.union(dates)).ffill().reindex(dates)
+
+    # Daily portfolio values with the starting share values compounded at adjusted returns
+    start_val = qty[tickers] * close.iloc[0]
+    value = (adj_close / adj_close.iloc[0]) @ start_val
+
+    daily = pd.DataFrame({'port val': value, 'port ret': value.pct_change(), 'spret': spy.pct_change(),
+                          'rate': daily_risk_free(fred, dates)}).iloc[1:]
+    daily.index.name = 'date'
+
+    stats = rolling_stats(daily['port ret'].to_numpy(), daily['spret'].to_numpy(), daily['rate'].to_numpy(), window)
+    for k, v in stats.items():
+        daily[f'roll {k}'] = v
+
+    return daily
+
+
+def daily_pull(portfolio, ap_api_key, fred_api_key):
+    '''
+    Downloads daily data for the portfolio and SPY and saves it to the columnar store
+    (daily_panel and daily_fred datasets).
+
+    Returns: dictionary of {symbol: daily DataFrame}, DataFrame of daily rates
+    '''
+    tickers = [p['tck'] for p in portfolio]
+    frames, fred = Ingestor().run_daily(tickers, ap_api_key, fred_api_key)
+
+    failed = [s for s, f in frames.items() if not isinstance(f, pd.DataFrame)]
+    if len(failed) > 0:
+        print("-------------------------")
+        print("ERROR SUMMARY:")
+        print("The program was unable to pull daily data from the API for the following ticker(s):")
+        for s in failed:
+            print(f"----{s}: {list(frames[s].keys())[0]}")
+        print("Please check the accuracy of the ticker(s) and try again.")
+
+        sys.exit(1)
+
+    store_write(pd.concat([f.assign(ticker=s) for s, f in frames.items()], ignore_index=True), 'daily_panel')
+    store_write(fred, 'daily_fred')
+
+    return frames, fred
+
+
+if __name__ == '__main__':
+
+    # Load environment variables
+    load_dotenv()
+    port_file_name = os.environ.get('PORTFOLIO_FILE_NAME')
+    ap_api_key = os.environ.get('ALPHAVANTAGE_API_KEY')
+    fred_api_key = os.environ.get('FRED_API_KEY')
+    window = int(os.environ.get('ROLLING_WINDOW', 252))
+
+    portfolio = portfolio_import(port_file_name)
+
+    if APP_ENV == 'development':
+        panel = store_read('daily_panel')
+        frames = {s: f.drop(columns=['ticker']) for s, f in panel.groupby('ticker')}
+        fred = store_read('daily_fred')
+
+    else:
+        frames, fred = daily_pull(portfolio, ap_api_key, fred_api_key)
+
+    daily = daily_returns(frames, portfolio, fred, window)
+    store_write(daily.reset_index(), 'daily_rolling')
+
+    latest = daily.iloc[-1]
+    print('-----------------------------------------------', flush=True)
+    print(f'ROLLING {window}-DAY MEASURES AS OF {daily.index[-1]:%Y-%m-%d}', flush=True)
+    print(f"Volatility (Ann.): {latest['roll vol']:.2%}  (S&P 500: {latest['roll bench_vol']:.2%})", flush=True)
+    print(f"Sharpe Ratio: {latest['roll sharpe']:.2f}  (S&P 500: {latest['roll bench_sharpe']:.2f})", flush=True)
+    print(f"Beta: {latest['roll beta']:.2f}", flush=True)
+    print(f"Drawdown: {latest['roll drawdown']:.2%}  (Max since start: {latest['roll max_drawdown']:.2%})", flush=True)
+    print('-----------------------------------------------', flush=True)
@@ -0,0 +1,199 @@
+# fetch_job.py
+
+# IMPORT PACKAGES
+
+import datetime
+import hashlib
+import json
+import os
+import shutil
+
+from app import store
+
+# FUNCTIONS
+
+# Bump when the layout of job manifests changes; older jobs are then started over
+JOB_VERSION = 1
+
+# Incomplete jobs older than this are removed when a new job is opened
+JOB_RETENTION_DAYS = 7
+
+# Symbols with these statuses are requested again (invalid symbols are not)
+RETRY_STATUSES = ('pending', 'throttled', 'failed')
+
+
+def job_dir():
+    '''
+    Returns: folder of job manifests and checkpointed data (data/jobs, next to the store)
+    '''
+    return os.path.join(store.STORE_DIR, 'jobs')
+
+
+def fetch_partial():
+    '''
+    Returns whether the analysis continues without positions that could not be
+    downloaded (FETCH_PARTIAL='on') instead of stopping (the default).
+    '''
+    return os.environ.get('FETCH_PARTIAL', 'off').lower() == 'on'
+
+
+def retry_rounds():
+    '''
+    Returns the number of extra rounds for failed or throttled symbols (FETCH_RETRY_ROUNDS, default 2).
+    '''
+    return int(os.environ.get('FETCH_RETRY_ROUNDS', 2))
+
+
+def response_status(response):
+    '''
+    Classifies a download result: 'done' (DataFrame), 'throttled' (Alpha Vantage "Note"),
+    'invalid' (Alpha Vantage "Error Message", an unknown symbol) or 'failed'.
+    '''
+    if not isinstance(response, dict):
+        return 'done'
+    if 'Note' in response:
+        return 'throttled'
+    if 'Error Message' in response:
+        return 'invalid'
+    return 'failed'
+
+
+class FetchJob:
+    '''
+    Checkpointed download of a list of symbols.
+
+    A manifest (data/jobs/<job id>.json) records the status of every symbol and is
+    rewritten as each symbol finishes, and downloaded series are saved next to it.
+    A job is identified by its symbols and the day, so a run that crashed, was
+    stopped or had failures resumes where it left off: completed symbols are read
+    back from the checkpoint and only failed or throttled symbols are requested again.
+
+    Param: symbols (list of str), job_id (str)
+
+    Example: job = FetchJob.open(['AZO', 'ABBV']); job.pending()
+    '''
+
+    def __init__(self, symbols, job_id):
+        self.job_id = job_id
+        self.path = os.path.join(job_dir(), f'{job_id}.json')
+        self.data_dir = os.path.join(job_dir(), job_id)
+        self.symbols = {s: {'status': 'pending', 'attempts': 0, 'error': None, 'updated': None} for s in symbols}
+
+    @classmethod
+    def open(cls, symbols, day=None):
+        '''
+        Resumes today's job for these symbols, or starts a new one.
+
+        Returns: FetchJob
+        '''
+        day = day or datetime.date.today().isoformat()
+        symbols = list(dict.fromkeys(symbols))
+        digest = hashlib.sha1('\n'.join(sorted(symbols)).encode('utf-8')).hexdigest()[:12]
+        job = cls(symbols, f'{day}-{digest}')
+
+        prune_jobs()
+        if os.path.exists(job.path):
+            with open(job.path, 'r') as manifest_file:
+                manifest = json.load(manifest_file)
+            if manifest.get('version') == JOB_VERSION and set(manifest['symbols']) == set(symbols):
+                job.symbols.update(manifest['symbols'])
+
+        return job
+
+    def status(self, symbol):
+        return self.symbols[symbol]['status']
+
+    def pending(self):
+        '''
+        Returns: symbols still to be requested
+        '''
+        return [s for s, entry in self.symbols.items() if entry['status'] in RETRY_STATUSES]
+
+    def failures(self):
+        '''
+        Returns: dictionary of {symbol: status} for symbols that were not downloaded
+        '''
+        return {s: entry['status'] for s, entry in self.symbols.items() if entry['status'] != 'done'}
+
+    def load(self, symbol):
+        '''
+        Returns: checkpointed series of a completed symbol (DataFrame), or None if it is missing
+        '''
+        from pyarrow import feather
+
+        filepath = os.path.join(self.data_dir, f'{symbol}.feather')
+        if not os.path.exists(filepath):
+            return None
+
+        return feather.read_table(filepath, memory_map=True).to_pandas()
+
+    def record(self, symbol, response, error=None):
+        '''
+        Records the result of one request (saving the series if it was downloaded) and
+        checkpoints the manifest.
+        '''
+        status = response_status(response)
+        if status == 'done':
+            os.makedirs(self.data_dir, exist_ok=True)
+            filepath = os.path.join(self.data_dir, f'{symbol}.feather')
+            response.reset_index(drop=True).to_feather(f'{filepath}.tmp', compression='uncompressed')
+            os.replace(f'{filepath}.tmp', filepath)
+
+        entry = self.symbols[symbol]
+        entry['status'] = status
+        entry['attempts'] += 1
+        entry['error'] = error or (None if status == 'done' else next(iter(response.values()), None))
+        entry['updated'] = datetime.datetime.now().isoformat(timespec='seconds')
+        self.save()
+
+    def save(self):
+        os.makedirs(job_dir(), exist_ok=True)
+        with open(f'{self.path}.tmp', 'w') as manifest_file:
+            json.dump({'version': JOB_VERSION, 'job': self.job_id, 'symbols': self.symbols}, manifest_file, indent=1)
+        os.replace(f'{self.path}.tmp', self.path)
+
+    def finish(self):
+        '''
+        Removes the manifest and checkpointed data once every symbol was downloaded
+        (jobs with failures are kept so that a later run can resume them).
+
+        Returns: True if the job was complete
+        '''
+        if len(self.failures()) > 0:
+            return False
+
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+        return True
+
+
+def prune_jobs(days=JOB_RETENTION_DAYS):
+    '''
+    Removes jobs that were last checkpointed more than `days` days ago.
+    '''
+    folder = job_dir()
+    if not os.path.isdir(folder):
+        return
+
+    cutoff = datetime.datetime.now().timestamp() - days * 86400
+    for name in os.listdir(folder):
+        if name.endswith('.json') and os.path.getmtime(os.path.join(folder, name)) < cutoff:
+            os.remove(os.path.join(folder, name))
+            shutil.rmtree(os.path.join(folder, name[:-len('.json')]), ignore_errors=True)
+
+
+if __name__ == '__main__':
+
+    # Lists the checkpointed jobs and the symbols each is still missing
+    folder = job_dir()
+    names = sorted(n for n in os.listdir(folder) if n.endswith('.json')) if os.path.isdir(folder) else []
+    if len(names) == 0:
+        print('No incomplete download jobs.', flush=True)
+    for name in names:
+        with open(os.path.join(folder, name), 'r') as manifest_file:
+            manifest = json.load(manifest_file)
+        missing = {s: e['status'] for s, e in manifest['symbols'].items() if e['status'] != 'done'}
+        print(f"{manifest['job']}: {len(manifest['symbols']) - len(missing)} of {len(manifest['symbols'])} downloaded"
+              f"{'; missing ' + ', '.join(f'{s} ({st})' for s, st in missing.items()) if missing else ''}", flush=True)
@@ -0,0 +1,293 @@
+# ingest.py
+
+# IMPORT PACKAGES
+
+import asyncio
+import datetime
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.cache import cache_read, cache_fresh, cache_update
+from app.fetch_job import FetchJob, retry_rounds
+from app.other_data_pull import spy_request, spy_format, fred_request, fred_format
+from app.port_data_pull import av_monthly_request, av_daily_request, av_throttled, av_bucket, port_data_compile
+
+# FUNCTIONS
+
+# Maximum number of requests in flight per host.  Alpha Vantage is additionally
+# limited by the token bucket (see rate_limit.py).
+HOST_LIMITS = {'www.alphavantage.co': 5, 'api.stlouisfed.org': 2}
+
+# Number of days re-requested before the last cached FRED observation so that
+# revised rates are picked up by incremental refreshes
+FRED_LOOKBACK_DAYS = 31
+
+
+class Ingestor:
+    '''
+    Asynchronous downloader sharing one pooled keep-alive HTTP session across all
+    Alpha Vantage and FRED requests.
+
+    Requests are limited per host, time out after `timeout` seconds, and are
+    retried with jittered exponential backoff on connection errors and 5xx
+    responses.  Alpha Vantage requests also spend tokens from `bucket`, and a
+    throttle ("Note") response pauses the bucket for throttle_delay seconds
+    (doubling on each further throttle response) before the request is retried.
+
+    Unless use_cache is False (or MARKET_CACHE is set to 'off'), series are read
+    from the local market data cache (see cache.py) and only requested when the
+    cache entry is stale; refreshed observations are merged into the cache.
+
+    Param: bucket (TokenBucket or None), timeout (int), retries (int), host_limits (dict or None),
+    use_cache (bool or None), throttle_delay (int) in seconds
+
+    Example: Ingestor().run(portfolio, ap_api_key, fred_api_key)
+    '''
+
+    def __init__(self, bucket=None, timeout=30, retries=3, host_limits=None, use_cache=None, throttle_delay=60):
+        self.bucket = bucket if bucket is not None else av_bucket()
+        if use_cache is None:
+            use_cache = os.environ.get('MARKET_CACHE', 'on').lower() != 'off'
+        self.use_cache = use_cache
+        self.timeout = timeout
+        self.retries = retries
+        self.throttle_delay = throttle_delay
+        self.host_limits = dict(HOST_LIMITS if host_limits is None else host_limits)
+
+        pool_size = max(self.host_limits.values())
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.host_limits), pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.executor = ThreadPoolExecutor(max_workers=sum(self.host_limits.values()) + 1)
+        self.semaphores = {}
+        self.panel = None
+
+    def _semaphore(self, host):
+        if host not in self.semaphores:
+            self.semaphores[host] = asyncio.Semaphore(self.host_limits.get(host, 2))
+        return self.semaphores[host]
+
+    async def _call(self, host, request, *args, throttled=None):
+        '''
+        Runs a blocking request function in the thread pool under the host's
+        concurrency limit, retrying network failures and throttle responses.
+        '''
+        loop = asyncio.get_running_loop()
+        delay = 1
+        throttle_delay = self.throttle_delay
+
+        for attempt in range(self.retries + 1):
+            try:
+                async with self._semaphore(host):
+                    result = await loop.run_in_executor(self.executor, lambda: self._request(host, request, args))
+            except (requests.RequestException, ValueError):
+                if attempt == self.retries:
+                    raise
+                await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+                delay = delay * 2
+                continue
+
+            if throttled is not None and throttled(result) and attempt < self.retries:
+                self.bucket.backoff(throttle_delay)
+                throttle_delay = throttle_delay * 2
+                continue
+
+            return result
+
+    def _request(self, host, request, args):
+        if host == 'www.alphavantage.co':
+            self.bucket.acquire()
+        return request(*args, session=self)
+
+    def get(self, url, **kwargs):
+        '''
+        Session-backed GET used by the request functions in place of requests.get
+        (raises on 5xx responses so that they are retried).
+        '''
+        kwargs['timeout'] = self.timeout
+        response = self.session.get(url, **kwargs)
+        if response.status_code >= 500:
+            response.raise_for_status()
+        return response
+
+    async def _av_series(self, symbol, request, *args, series='monthly_adjusted'):
+        '''
+        Returns adjusted price data for one symbol, from the cache when it is fresh.
+        '''
+        entry = cache_read('alphavantage', symbol, series) if self.use_cache else None
+        if cache_fresh(entry):
+            return entry['data']
+
+        parsed = await self._call('www.alphavantage.co', request, *args, throttled=av_throttled)
+
+        if not self.use_cache or not isinstance(parsed, pd.DataFrame):
+            return parsed
+
+        entry = cache_update(entry, 'alphavantage', symbol, series, parsed, 'timestamp',
+                             'M' if series.startswith('monthly') else None)
+        return entry['data']
+
+    async def _fred_series(self, api_key, series_id='DGS1'):
+        '''
+        Returns observations of a FRED series, only requesting the dates after the cached history.
+        '''
+        entry = cache_read('fred', series_id, 'observations') if self.use_cache else None
+        if cache_fresh(entry):
+            return entry['data']
+
+        start = None
+        if entry is not None and entry['last_obs'] is not None:
+            last_obs = datetime.date.fromisoformat(entry['last_obs'])
+            start = (last_obs - datetime.timedelta(days=FRED_LOOKBACK_DAYS)).isoformat()
+
+        parsed = await self._call('api.stlouisfed.org', fred_request, api_key, start, series_id)
+
+        if not self.use_cache or not isinstance(parsed, pd.DataFrame):
+            return parsed
+
+        entry = cache_update(entry, 'fred', series_id, 'observations', parsed, 'date')
+        return entry['data']
+
+    async def _job_series(self, job, tkr, api_key):
+        '''
+        Downloads one ticker of a checkpointed job.  A request that still fails after
+        its retries is recorded as failed instead of stopping the other downloads.
+        '''
+        try:
+            parsed = await self._av_series(tkr, av_monthly_request, tkr, api_key)
+            job.record(tkr, parsed)
+        except (requests.RequestException, ValueError) as err:
+            parsed = {'Error': repr(err)}
+            job.record(tkr, parsed, repr(err))
+        return parsed
+
+    async def _portfolio(self, portfolio, api_key, job=None):
+        tck_list = [p['tck'] for p in portfolio]
+        if job is None:
+            parsed = await asyncio.gather(*[self._av_series(tkr, av_monthly_request, tkr, api_key) for tkr in tck_list])
+            return dict(zip(tck_list, parsed))
+
+        # Completed tickers of a resumed job are read back from its checkpoint
+        responses = {}
+        for tkr in tck_list:
+            if job.status(tkr) == 'done':
+                responses[tkr] = job.load(tkr)
+                if responses[tkr] is None:
+                    job.symbols[tkr]['status'] = 'pending'
+            elif job.status(tkr) == 'invalid':
+                responses[tkr] = {'Error Message': job.symbols[tkr]['error']}
+        if len(responses) > 0:
+            print(f'Resuming download job {job.job_id}: {len(tck_list) - len(job.pending())} of {len(tck_list)} ticker(s) already downloaded.', flush=True)
+
+        # Failed and throttled tickers get further rounds, each after a longer pause
+        todo = job.pending()
+        for attempt in range(retry_rounds() + 1):
+            if len(todo) == 0:
+                break
+            if attempt > 0:
+                delay = self.throttle_delay * 2 ** (attempt - 1)
+                print(f'Retrying {len(todo)} ticker(s) in {delay} seconds: {", ".join(todo)}', flush=True)
+                await asyncio.sleep(delay)
+            parsed = await asyncio.gather(*[self._job_series(job, tkr, api_key) for tkr in todo])
+            responses.update(zip(todo, parsed))
+            todo = job.pending()
+
+        return responses
+
+    async def _run(self, portfolio, ap_api_key, fred_api_key, job=None):
+        return await asyncio.gather(
+            self._av_series('SPY', spy_request, ap_api_key),
+            self._fred_series(fred_api_key),
+            self._portfolio(portfolio, ap_api_key, job))
+
+    async def _run_daily(self, tickers, ap_api_key, fred_api_key):
+        symbols = list(dict.fromkeys(['SPY'] + list(tickers)))
+        parsed = await asyncio.gather(
+            self._fred_series(fred_api_key),
+            *[self._av_series(t, av_daily_request, t, ap_api_key, series='daily_adjusted') for t in symbols])
+        return dict(zip(symbols, parsed[1:])), parsed[0]
+
+    async def _run_benchmarks(self, symbols, ap_api_key, fred_api_key, series_id):
+        parsed = await asyncio.gather(
+            *[self._av_series(s, av_monthly_request, s, ap_api_key) for s in symbols],
+            *([self._fred_series(fred_api_key, series_id)] if series_id is not None else []))
+        return dict(zip(symbols, parsed)), parsed[-1] if series_id is not None else None
+
+    def run_benchmarks(self, symbols, ap_api_key, fred_api_key, series_id='DGS1'):
+        '''
+        Downloads monthly adjusted data for benchmark symbols and daily observations of a
+        risk free rate series (unless series_id is None), through the same cache, limits
+        and token bucket as holdings.
+
+        Returns: dictionary of {symbol: DataFrame or error response}, DataFrame of daily rates (or None)
+        '''
+        try:
+            return asyncio.run(self._run_benchmarks(list(dict.fromkeys(symbols)), ap_api_key, fred_api_key, series_id))
+        finally:
+            self.executor.shutdown()
+            self.session.close()
+
+    def run_daily(self, tickers, ap_api_key, fred_api_key):
+        '''
+        Downloads daily adjusted data for the tickers and SPY, and daily 1-Year Treasury Bill rates.
+
+        Returns: dictionary of {symbol: DataFrame or error response}, DataFrame of daily rates
+        '''
+        try:
+            return asyncio.run(self._run_daily(tickers, ap_api_key, fred_api_key))
+        finally:
+            self.executor.shutdown()
+            self.session.close()
+
+    def run(self, portfolio, ap_api_key, fred_api_key, partial=None):
+        '''
+        Downloads S&P 500, 1-Year Treasury Bill and portfolio data concurrently.
+
+        Portfolio downloads are checkpointed (see fetch_job.py): a run resumes the
+        day's unfinished job for the same tickers, and failed or throttled tickers are
+        retried in further rounds.  If some tickers still fail, the analysis stops
+        unless partial (default: FETCH_PARTIAL) is set, in which case it continues
+        without them.
+
+        The full panel of every ticker is kept in self.panel (CompactPanel), so callers
+        that need more than the common window use this run's data rather than the
+        shared port_panel store file, which another run may overwrite.
+
+        Returns: S&P 500 returns, risk free rates, portfolio dataset, last common month, first common month
+        '''
+        job = FetchJob.open([p['tck'] for p in portfolio])
+        try:
+            parsed_spy, parsed_fred, responses = asyncio.run(self._run(portfolio, ap_api_key, fred_api_key, job))
+        finally:
+            self.executor.shutdown()
+            self.session.close()
+
+        spy_join = spy_format(parsed_spy)
+        fred_join = fred_format(parsed_fred)
+        if len(job.failures()) > 0:
+            print(f'Completed downloads are kept; run again to resume job {job.job_id} (see {os.path.abspath(job.path)}).', flush=True)
+        sub, minomax, maxomin, self.panel = port_data_compile(portfolio, responses, self.bucket, partial)
+        job.finish()
+
+        return spy_join, fred_join, sub, minomax, maxomin
+
+
+def ingest(portfolio, ap_api_key, fred_api_key, partial=None):
+    '''
+    Single entry point for all market data downloads used by port_data_analysis.
+
+    Param: portfolio (list of dict), ap_api_key (str), fred_api_key (str), partial (bool or
+    None) to continue without tickers that could not be downloaded
+
+    Example: spy_join, fred_join, sub, minomax, maxomin = ingest(portfolio, ap_api_key, fred_api_key)
+
+    Returns: S&P 500 returns, risk free rates, portfolio dataset, last common month, first common month
+    '''
+    return Ingestor().run(portfolio, ap_api_key, fred_api_key, partial)
@@ -0,0 +1,195 @@
+# instrument.py
+
+# IMPORT PACKAGES
+
+import contextlib
+import cProfile
+import datetime
+import json
+import os
+import threading
+import time
+import tracemalloc
+import uuid
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# FUNCTIONS
+
+# One id per process run, so that the records of a run can be grouped in the trace file
+RUN_ID = uuid.uuid4().hex[:12]
+
+PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'profiles')
+
+_LOCK = threading.Lock()
+_LOCAL = threading.local()
+_COUNTER = iter(range(10**9))
+
+# Peak traced memory of every open stage in tracemalloc mode, by stage key
+_PEAKS = {}
+
+
+def trace_path():
+    '''
+    Returns the JSON-lines trace file (PIPELINE_TRACE) or None when tracing is off.
+    '''
+    return os.environ.get('PIPELINE_TRACE') or None
+
+
+def profile_mode():
+    '''
+    Returns the capture mode (PIPELINE_PROFILE): 'cprofile', 'tracemalloc' or None.
+    '''
+    mode = os.environ.get('PIPELINE_PROFILE', '').lower()
+    return mode if mode in ('cprofile', 'tracemalloc') else None
+
+
+def _peak_rss():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux (bytes on macOS)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _fold_peak():
+    '''
+    Raises the peak of every open stage to the traced peak since the last reset (call
+    with _LOCK held, before tracemalloc.reset_peak() and when a stage ends).
+    '''
+    peak = tracemalloc.get_traced_memory()[1]
+    for key in _PEAKS:
+        _PEAKS[key] = max(_PEAKS[key], peak)
+
+
+def trace_write(record):
+    '''
+    Appends one record to the trace file.  Each record is written as a single line in
+    append mode, so processes sharing the trace file do not interleave records.
+    '''
+    path = trace_path()
+    if path is None:
+        return
+    line = json.dumps(record, default=str) + '\n'
+    with _LOCK:
+        with open(path, 'a') as trace_file:
+            trace_file.write(line)
+
+
+@contextlib.contextmanager
+def stage(name, **fields):
+    '''
+    Times a pipeline stage and writes a trace record when tracing is on.
+
+    The block can fill in the rows and bytes it processed on the yielded record.
+    Records hold the wall time, the peak memory (peak traced Python allocations of
+    all threads during the stage in tracemalloc mode, otherwise the peak resident
+    size of the process) and the name of the enclosing stage.  tracemalloc has one
+    peak for the process, so before it is reset for a new stage the peak so far is
+    added to every open stage, and nested or concurrent stages keep their peaks.
+    In cprofile mode the outermost stage of the main thread is profiled and saved
+    to data/profiles.
+
+    Param: name (str) like 'returns', fields (extra values to record, like years=3)
+
+    Example: with stage('store write', dataset='SPY') as rec: rec['rows'] = len(df)
+    '''
+    record = {'rows': None, 'bytes': None}
+    if trace_path() is None:
+        yield record
+        return
+
+    stack = getattr(_LOCAL, 'stack', None)
+    if stack is None:
+        stack = _LOCAL.stack = []
+
+    mode = profile_mode()
+    profiler = None
+    key = next(_COUNTER)
+    if mode == 'tracemalloc':
+        with _LOCK:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            _fold_peak()
+            tracemalloc.reset_peak()
+            _PEAKS[key] = tracemalloc.get_traced_memory()[0]
+    elif mode == 'cprofile' and len(stack) == 0 and threading.current_thread() is threading.main_thread():
+        profiler = cProfile.Profile()
+
+    parent = stack[-1] if stack else None
+    stack.append(name)
+    started = datetime.datetime.now().isoformat()
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+
+    try:
+        yield record
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        seconds = time.perf_counter() - start
+        stack.pop()
+
+        if mode == 'tracemalloc':
+            with _LOCK:
+                _fold_peak()
+                peak = _PEAKS.pop(key)
+        else:
+            peak = _peak_rss()
+
+        record.update({'run': RUN_ID, 'pid': os.getpid(), 'stage': name, 'parent': parent, 'started': started,
+                       'seconds': seconds, 'peak_mem': peak, 'mem_mode': 'tracemalloc' if mode == 'tracemalloc' else 'rss'})
+        record.update(fields)
+
+        if profiler is not None:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            record['profile'] = os.path.join(PROFILE_DIR, f"{RUN_ID}-{key}-{name.replace(' ', '_')}.prof")
+            profiler.dump_stats(record['profile'])
+
+        trace_write(record)
+
+
+def counted(chunks, record):
+    '''
+    Passes chunks through while adding their sizes to record['bytes'].
+    '''
+    record['bytes'] = record['bytes'] or 0
+    for chunk in chunks:
+        record['bytes'] += len(chunk)
+        yield chunk
+
+
+def trace_summary(path=None):
+    '''
+    Totals the trace records by stage.
+
+    Returns: DataFrame with count, total and mean seconds, rows, bytes and the largest
+    peak memory of every stage (slowest stages first)
+    '''
+    import pandas as pd
+
+    with open(path or trace_path(), 'r') as trace_file:
+        records = pd.DataFrame([json.loads(line) for line in trace_file])
+
+    summary = records.groupby('stage').agg(count=('seconds', 'size'), seconds=('seconds', 'sum'),
+                                           mean_seconds=('seconds', 'mean'), rows=('rows', 'sum'),
+                                           bytes=('bytes', 'sum'), peak_mem=('peak_mem', 'max'))
+
+    return summary.sort_values(by='seconds', ascending=False)
+
+
+if __name__ == '__main__':
+
+    import sys
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    path = sys.argv[1] if len(sys.argv) > 1 else trace_path()
+    if path is None:
+        print('Pass a trace file or set PIPELINE_TRACE.', flush=True)
+    else:
+        print(trace_summary(path).to_string(), flush=True)
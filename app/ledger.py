@@ -0,0 +1,275 @@
+# ledger.py
+
+# IMPORT PACKAGES
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+from app.ingest import Ingestor
+from app.store import store_read
+from app.returns_engine import ReturnsPanel
+from app.panel import month_ordinals
+from app.portfolio_import import INPUT_DIR, TICKER_COLUMNS, QTY_COLUMNS, normalize_ticker
+from app.instrument import stage
+from app import APP_ENV
+
+# FUNCTIONS
+
+DATE_COLUMNS = ['date', 'trade_date', 'trade date']
+PRICE_COLUMNS = ['price', 'trade_price', 'trade price']
+
+
+def _column(frame, names):
+    for c in frame.columns:
+        if c.strip().lower() in names:
+            return frame[c]
+    return None
+
+
+def load_ledger(file_name):
+    '''
+    Imports a transaction ledger from the input folder.
+
+    The file needs date, ticker (tck, ticker or symbol) and quantity (qty, quantity or
+    shares: positive for buys, negative for sells) columns, and may have a price column
+    (the trade price per share; missing prices are valued at the month-end close).
+    Record stock splits as trades of the extra shares at a price of 0.  Rows with an
+    invalid date, ticker, quantity or price are skipped with a warning.
+
+    Param: file_name (str) like 'ledger.csv', relative to the input folder
+
+    Returns: DataFrame with date, ticker, qty and price columns, sorted by date
+    '''
+    raw = pd.read_csv(os.path.join(INPUT_DIR, file_name), dtype=str, keep_default_na=False)
+
+    dates = _column(raw, DATE_COLUMNS)
+    tickers = _column(raw, TICKER_COLUMNS)
+    qty = _column(raw, QTY_COLUMNS)
+    if dates is None or tickers is None or qty is None:
+        raise ValueError(f'{file_name} needs date, ticker ({", ".join(TICKER_COLUMNS)}) '
+                         f'and quantity ({", ".join(QTY_COLUMNS)}) columns')
+    price = _column(raw, PRICE_COLUMNS)
+
+    # Each distinct ticker spelling is normalized once
+    spellings = tickers.unique()
+    normalized = dict(zip(spellings, [normalize_ticker(t) for t in spellings]))
+
+    def numbers(col):
+        text = col.str.strip().str.replace(',', '', regex=False)
+        return pd.to_numeric(text.str.replace(r'^\((.*)\)$', r'-\1', regex=True), errors='coerce')
+
+    ledger = pd.DataFrame({'date': pd.to_datetime(dates.str.strip(), errors='coerce'),
+                           'ticker': tickers.map(normalized),
+                           'qty': numbers(qty),
+                           'price': numbers(price) if price is not None else np.nan})
+
+    blank = price.str.strip() == '' if price is not None else pd.Series(True, index=raw.index)
+    invalid = ledger[['date', 'ticker', 'qty']].isna().any(axis=1) | (ledger['price'].isna() & ~blank)
+    if invalid.any():
+        lines = (np.flatnonzero(invalid.to_numpy()) + 2).tolist()
+        print('-----------------------------------------------', flush=True)
+        print(f'WARNING! SKIPPED {len(lines)} INVALID LEDGER ROW(S) IN {file_name} (LINES {", ".join(map(str, lines[:10]))}'
+              f'{", ..." if len(lines) > 10 else ""})', flush=True)
+        print('-----------------------------------------------', flush=True)
+
+    return ledger.loc[~invalid].sort_values(by='date', kind='stable').reset_index(drop=True)
+
+
+def ledger_positions(panel, ledger):
+    '''
+    Rebuilds month-end share positions and monthly cash flows from a ledger.
+
+    Trades are scattered into a sparse month x ticker matrix of share changes in one
+    step and positions are its cumulative sum down the months, so the cost does not
+    depend on replaying trades one by one.  Trades before the first month of the panel
+    count as opening positions, and trades in a month missing from the panel are
+    booked at the start of the next month it has; trades after its last month and
+    tickers without price data are left out.
+
+    Param: panel (ReturnsPanel), ledger (DataFrame from load_ledger())
+
+    Returns: dictionary with positions (months x tickers), flows (cash invested per month,
+    sells negative), weighted_flows (flows weighted by the part of the month they were
+    invested, for Modified Dietz returns) and the month, day fraction and amount of each trade
+    '''
+    tickers = ledger['ticker'].to_numpy()
+    ticker_codes = panel.tickers.get_indexer(tickers)
+
+    # Position of the first panel month on or after each trade's month
+    ordinals = month_ordinals(ledger['date'])
+    month_codes = panel.months.asi8.searchsorted(ordinals)
+    keep = (ticker_codes >= 0) & (month_codes < len(panel.months))
+    if not keep.all():
+        missing = sorted(set(tickers[ticker_codes < 0]))
+        print(f'WARNING! LEFT OUT {int((~keep).sum())} TRADE(S) OUTSIDE THE PRICE DATA'
+              f'{" (NO DATA FOR: " + ", ".join(missing) + ")" if missing else ""}', flush=True)
+
+    month_codes = month_codes[keep]
+    ticker_codes = ticker_codes[keep]
+    qty = ledger['qty'].to_numpy(dtype='float64')[keep]
+    price = ledger['price'].to_numpy(dtype='float64')[keep]
+    dates = ledger['date'][keep]
+
+    # Trades without a price are valued at the month-end close
+    price = np.where(np.isnan(price), panel.close[month_codes, ticker_codes], price)
+    amount = np.nan_to_num(qty * price)
+
+    # Part of the month left after each trade (trades booked in a later month count fully)
+    day_frac = ((dates.dt.day - 1) / dates.dt.days_in_month).to_numpy(dtype='float64', copy=True)
+    day_frac[panel.months.asi8[month_codes] != ordinals[keep]] = 0.0
+
+    changes = np.zeros((len(panel.months), len(panel.tickers)))
+    np.add.at(changes, (month_codes, ticker_codes), qty)
+
+    return {'positions': np.cumsum(changes, axis=0),
+            'flows': np.bincount(month_codes, weights=amount, minlength=len(panel.months)),
+            'weighted_flows': np.bincount(month_codes, weights=amount * (1 - day_frac), minlength=len(panel.months)),
+            'trade_month': month_codes, 'trade_frac': day_frac, 'trade_amount': amount}
+
+
+def money_weighted_rate(amounts, times, low=-0.99, high=10.0, iterations=200):
+    '''
+    Solves for the internal rate of return of dated cash flows by bisection (all flows
+    are discounted at once for every trial rate).
+
+    Param: amounts (array of cash flows, money paid in negative), times (array of times
+    in months), low and high (monthly rates bracketing the answer)
+
+    Returns: monthly rate, or nan if the net present value does not change sign
+    '''
+    def npv(rate):
+        return (amounts * (1 + rate) ** -times).sum()
+
+    npv_low = npv(low)
+    npv_high = npv(high)
+    if not (np.isfinite(npv_low) and np.isfinite(npv_high)) or np.sign(npv_low) == np.sign(npv_high):
+        return np.nan
+
+    for _ in range(iterations):
+        mid = (low + high) / 2
+        npv_mid = npv(mid)
+        if np.sign(npv_mid) == np.sign(npv_low):
+            low, npv_low = mid, npv_mid
+        else:
+            high = mid
+        if high - low < 1e-12:
+            break
+
+    return (low + high) / 2
+
+
+def ledger_returns(panel, ledger, period_length, min_start=None, max_end=None, positions=None):
+    '''
+    Calculates time-weighted and money-weighted returns of a portfolio whose holdings
+    change over time.
+
+    Monthly returns are Modified Dietz returns: the gain of the month (change in market
+    value less the cash invested, plus dividends) over the value at the start of the
+    month plus the cash invested, weighted by the part of the month it was invested.
+    Dividends are taken as paid out: the dividends per share of the month times the
+    shares held at its start.  Splits recorded as trades at a price of 0 change the
+    shares but not the value, so they are neither income nor cash invested.  The
+    time-weighted return chains the monthly returns; the money-weighted return is the
+    internal rate of return of the opening value, the trades, the dividends and the
+    closing value.
+
+    Param: panel (ReturnsPanel built with dividends=True), ledger (DataFrame from
+    load_ledger()), period_length (int) in years like 3, min_start and max_end (Period
+    or None) to limit the analysis window, positions (dictionary from ledger_positions() or None to rebuild it)
+
+    Returns: results dictionary, monthly DataFrame
+    '''
+    with stage('ledger returns', years=period_length, trades=len(ledger)) as rec:
+        if positions is None:
+            positions = ledger_positions(panel, ledger)
+        if min_start is None:
+            min_start = panel.months[0]
+        if max_end is None:
+            max_end = panel.months[-1]
+
+        pd_start = max(max_end - (period_length * 12), min_start)
+        start = panel.month_index(pd_start)
+        end = panel.month_index(max_end)
+        months = panel.months[start + 1:end + 1]
+
+        pos = positions['positions']
+        close = np.nan_to_num(panel.close[start:end + 1])
+
+        value = (pos[start:end + 1] * close).sum(axis=1)
+        income = (pos[start:end] * panel.div[start + 1:end + 1]).sum(axis=1)
+        flows = positions['flows'][start + 1:end + 1]
+        weighted = positions['weighted_flows'][start + 1:end + 1]
+
+        gain = value[1:] - value[:-1] - flows + income
+        base = value[:-1] + weighted
+        mon_ret = np.where(base > 0, gain / np.where(base > 0, base, 1), np.nan)
+
+        cum_twr = np.cumprod(np.nan_to_num(mon_ret) + 1)
+        months_act = len(months)
+        years = months_act / 12
+
+        # Money-weighted return: flows from the investor's side, in months since the period start
+        trade = (positions['trade_month'] > start) & (positions['trade_month'] <= end)
+        amounts = np.concatenate([[-value[0]], -positions['trade_amount'][trade], income, [value[-1]]])
+        times = np.concatenate([[0.0], positions['trade_month'][trade] - start - 1 + positions['trade_frac'][trade],
+                                np.arange(1, months_act + 1), [months_act]])
+        mwr = money_weighted_rate(amounts, times)
+
+        ret_calc = {'years_tgt': period_length, 'years_act': years, 'months_act': months_act,
+                    'st_date': pd_start.strftime('%Y-%m'), 'end_date': max_end.strftime('%Y-%m'),
+                    'start_val': value[0], 'end_val': value[-1], 'net_flows': flows.sum(), 'income': income.sum(),
+                    'cum_twr': cum_twr[-1] - 1, 'ann_twr': cum_twr[-1]**(1 / years) - 1,
+                    'mon_mwr': mwr, 'ann_mwr': (1 + mwr)**12 - 1}
+
+        port_ret = pd.DataFrame({'value': value[1:], 'flow': flows, 'income': income, 'mon ret': mon_ret,
+                                 'cum twr': cum_twr}, index=months)
+        rec['rows'] = months_act
+
+    return ret_calc, port_ret
+
+
+def ledger_window(panel, ledger):
+    '''
+    Returns: first and last month (Periods) with price data for every ticker traded in the
+    ledger, starting no earlier than the month before the first trade
+    '''
+    traded = np.isin(np.asarray(panel.tickers, dtype=str), ledger['ticker'].unique())
+    first, last = panel.window(traded[:, None])
+    first_trade = panel.months.searchsorted(ledger['date'].min().to_period('M'))
+
+    return panel.months[max(first[0], first_trade - 1, 0)], panel.months[last[0]]
+
+
+if __name__ == '__main__':
+
+    # Load environment variables
+    load_dotenv()
+    ledger_file_name = sys.argv[1] if len(sys.argv) > 1 else os.environ.get('LEDGER_FILE_NAME')
+    ap_api_key = os.environ.get('ALPHAVANTAGE_API_KEY')
+    fred_api_key = os.environ.get('FRED_API_KEY')
+
+    ledger = load_ledger(ledger_file_name)
+
+    if APP_ENV == 'development':
+        compact = store_read('port_panel')
+
+    else:
+        universe = [{'tck': t, 'qty': 0} for t in ledger['ticker'].unique()]
+        ingestor = Ingestor()
+        ingestor.run(universe, ap_api_key, fred_api_key)
+        # The full (untrimmed) panel of every ticker from this download
+        compact = ingestor.panel
+
+    panel = ReturnsPanel(compact, dividends=True)
+    positions = ledger_positions(panel, ledger)
+    min_start, max_end = ledger_window(panel, ledger)
+
+    for i in [1, 2, 3, 5]:
+        r, _ = ledger_returns(panel, ledger, i, min_start, max_end, positions)
+        print(f"{r['years_tgt']}Y ({r['st_date']} to {r['end_date']}): time-weighted {r['ann_twr']:.2%}, "
+              f"money-weighted {r['ann_mwr']:.2%}, net flows {r['net_flows']:,.2f}, value {r['end_val']:,.2f}", flush=True)
+        if r['years_act'] != i:
+            break
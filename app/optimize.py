@@ -0,0 +1,259 @@
+# optimize.py
+
+# IMPORT PACKAGES
+
+import numpy as np
+import pandas as pd
+
+from app.returns_engine import period_stats, benchmark_values, nan_cov
+from app.instrument import stage
+
+# FUNCTIONS
+
+def project_simplex(v):
+    '''
+    Projects each column of v onto the long-only weights that add up to 1 (the
+    closest point by Euclidean distance), all columns at once.
+
+    Param: v (n x k array)
+
+    Returns: n x k array of non-negative weights, each column summing to 1
+    '''
+    n = v.shape[0]
+    u = -np.sort(-v, axis=0)
+    css = np.cumsum(u, axis=0) - 1
+    positive = u - css / np.arange(1, n + 1)[:, None] > 0
+    rho = n - 1 - positive[::-1].argmax(axis=0)
+    theta = css[rho, np.arange(v.shape[1])] / (rho + 1)
+
+    return np.maximum(v - theta, 0)
+
+
+class PortfolioModel:
+    '''
+    What-if and optimization model of a set of tickers over one analysis period.
+
+    The growth of every ticker over the period (a month x ticker slice of the
+    ReturnsPanel) and the mean vector and covariance matrix of their monthly returns
+    are calculated once, so a matrix of candidate weights (ticker x candidate, like
+    the quantity matrices of returns_many()) is evaluated with one matrix product:
+
+    - evaluate() values each candidate like returns(): positions are bought at the
+      start of the period and held, and ann_ret, ann_sdev, beta and sharpe_port come
+      from period_stats(), so they match the report for the same holdings.
+    - moments() gives the expected measures of each candidate rebalanced monthly,
+      from the cached mean vector and covariance matrix (same beta and Sharpe
+      definitions), which is what min_variance() and frontier() optimize.
+
+    Param: panel (ReturnsPanel), period_length (int) in years, spy_join (S&P 500 monthly
+    returns, or a BenchmarkIndex), fred_join (monthly risk free rates), min_start and max_end
+    (Period or None for the months covered by every ticker), tickers (list or None for the
+    tickers held in the panel)
+
+    Example: model = PortfolioModel(panel, 3, spy_join, fred_join); model.evaluate(model.shift_weights(model.current_weights(), 'AZO', 'ABBV', [0.05, 0.1]))
+    '''
+
+    def __init__(self, panel, period_length, spy_join, fred_join, min_start=None, max_end=None, tickers=None):
+        with stage('portfolio model', years=period_length) as rec:
+            if tickers is None:
+                tickers = panel.tickers[panel.qty != 0]
+            self.tickers = pd.Index(tickers)
+            self.cols = panel.tickers.get_indexer(self.tickers)
+            if (self.cols < 0).any():
+                raise ValueError(f'No price data for: {", ".join(map(str, self.tickers[self.cols < 0]))}')
+
+            first, last = panel.window(np.isin(np.arange(len(panel.tickers)), self.cols)[:, None])
+            if min_start is None:
+                min_start = panel.months[first[0]]
+            if max_end is None:
+                max_end = panel.months[last[0]]
+
+            pd_start = max(max_end - (period_length * 12), min_start)
+            start = panel.month_index(pd_start)
+            end = panel.month_index(max_end)
+
+            self.panel = panel
+            self.start = start
+            self.months = panel.months[start + 1:end + 1]
+            self.period = {'years_tgt': period_length, 'st_date': pd_start.strftime('%Y-%m'),
+                           'end_date': max_end.strftime('%Y-%m')}
+
+            # Growth of 1 invested in each ticker at the start, and monthly returns
+            self.growth = panel.cumret[start + 1:end + 1, self.cols] / panel.cumret[start, self.cols]
+            previous = np.vstack([np.ones((1, len(self.cols))), self.growth[:-1]])
+            rets = self.growth / previous - 1
+
+            self.spret, self.rate, self.bench = benchmark_values(spy_join, fred_join, self.months)
+
+            # Cached moments (sample statistics, like nan_std() and nan_cov() in returns_engine)
+            self.mean = rets.mean(axis=0)
+            self.cov = np.cov(rets, rowvar=False).reshape(len(self.cols), len(self.cols))
+            self.cov_sp = nan_cov(rets, self.spret[:, None])
+            self.cov_rate = nan_cov(rets, self.rate[:, None])
+            self.var_sp = nan_cov(self.spret, self.spret)
+            self.mean_rate = np.nanmean(self.rate)
+            self.var_rate = nan_cov(self.rate, self.rate)
+            rec['rows'] = self.growth.size
+
+    def current_weights(self, qty=None):
+        '''
+        Returns: weights of the positions at the start of the period (array by ticker),
+        from share quantities (the panel quantities by default)
+        '''
+        if qty is None:
+            qty = self.panel.qty[self.cols]
+        start_val = np.nan_to_num(qty * self.panel.close[self.start, self.cols])
+
+        return start_val / start_val.sum()
+
+    def shift_weights(self, weights, from_ticker, to_ticker, amounts):
+        '''
+        Builds what-if candidates that move part of the portfolio from one ticker to
+        another (never more than the weight of from_ticker).
+
+        Param: weights (array by ticker), from_ticker (str), to_ticker (str), amounts (list of
+        portfolio fractions) like [0.05, 0.1]
+
+        Returns: ticker x candidate weights matrix
+        '''
+        i = self.tickers.get_loc(from_ticker)
+        j = self.tickers.get_loc(to_ticker)
+        moved = np.minimum(np.asarray(amounts, dtype='float64'), weights[i])
+
+        candidates = np.repeat(np.asarray(weights, dtype='float64')[:, None], len(moved), axis=1)
+        candidates[i] -= moved
+        candidates[j] += moved
+
+        return candidates
+
+    def evaluate(self, weights):
+        '''
+        Evaluates buy-and-hold candidates over the period with one matrix product,
+        using the same calculations as returns().
+
+        Param: weights (array by ticker, or ticker x candidate matrix)
+
+        Returns: DataFrame with one row of measures per candidate
+        '''
+        weights = np.asarray(weights, dtype='float64').reshape(len(self.cols), -1)
+        with stage('evaluate weights', candidates=weights.shape[1]) as rec:
+            stats = period_stats(weights.sum(axis=0), self.growth @ weights, self.spret, self.rate, self.bench)
+            results = pd.DataFrame({k: stats[k] for k in ['ann_ret', 'mon_sdev', 'ann_sdev', 'beta', 'sharpe_port']})
+            results.insert(1, 'mon_ret', stats['mon_ret_avg'])
+            rec['rows'] = self.growth.shape[0] * weights.shape[1]
+
+        return results
+
+    def moments(self, weights):
+        '''
+        Calculates the expected measures of monthly rebalanced candidates from the
+        cached mean vector and covariance matrix.
+
+        Param: weights (array by ticker, or ticker x candidate matrix)
+
+        Returns: DataFrame with one row of measures per candidate
+        '''
+        weights = np.asarray(weights, dtype='float64').reshape(len(self.cols), -1)
+        mon_ret = self.mean @ weights
+        mon_var = ((self.cov @ weights) * weights).sum(axis=0)
+        ex_var = mon_var - 2 * (self.cov_rate @ weights) + self.var_rate
+
+        return pd.DataFrame({'mon_ret': mon_ret, 'mon_sdev': np.sqrt(mon_var), 'ann_sdev': np.sqrt(mon_var * 12),
+                             'beta': (self.cov_sp @ weights) / self.var_sp,
+                             'sharpe_port': (mon_ret - self.mean_rate) / np.sqrt(ex_var) * (12 ** .5)})
+
+    def _solve(self, aversion, long_only, iterations=5000, tol=1e-10):
+        '''
+        Minimizes variance - (1 / aversion) x expected return for each aversion at once:
+        in closed form with short positions allowed, otherwise by accelerated projected
+        gradient descent over long-only weights.
+
+        Returns: ticker x aversion weights matrix
+        '''
+        n = len(self.cols)
+        tilt = np.where(np.isinf(aversion), 0.0, 1 / np.where(np.isinf(aversion), 1.0, aversion))
+
+        if not long_only:
+            inv = np.linalg.pinv(self.cov)
+            ones = np.ones(n)
+            min_var = inv @ ones / (ones @ inv @ ones)
+            excess = inv @ (self.mean - (ones @ inv @ self.mean) / (ones @ inv @ ones) * ones)
+            return min_var[:, None] + excess[:, None] * (tilt / 2)
+
+        step = 1 / (2 * max(np.linalg.eigvalsh(self.cov)[-1], 1e-18))
+        weights = np.full((n, len(tilt)), 1 / n)
+        momentum = weights
+        t = 1.0
+        for _ in range(iterations):
+            gradient = 2 * (self.cov @ momentum) - self.mean[:, None] * tilt
+            updated = project_simplex(momentum - step * gradient)
+            t_next = (1 + (1 + 4 * t * t) ** .5) / 2
+            momentum = updated + ((t - 1) / t_next) * (updated - weights)
+            done = np.abs(updated - weights).max() < tol
+            weights, t = updated, t_next
+            if done:
+                break
+
+        return weights
+
+    def min_variance(self, long_only=True):
+        '''
+        Returns: weights (array by ticker) of the minimum variance portfolio
+        '''
+        return self._solve(np.array([np.inf]), long_only)[:, 0]
+
+    def frontier(self, points=20, long_only=True):
+        '''
+        Traces the efficient frontier, from the minimum variance portfolio to the
+        highest expected return, for a range of risk aversions solved together.
+
+        Param: points (int), long_only (bool)
+
+        Returns: ticker x point weights matrix, ordered by expected return (points that
+        coincide are kept once)
+        '''
+        with stage('frontier', points=points, tickers=len(self.cols)) as rec:
+            spread = max(np.ptp(self.mean), 1e-12)
+            scale = 2 * max(np.diag(self.cov).max(), 1e-18) / spread
+            aversion = np.concatenate([[np.inf], scale * np.logspace(3, -2, points - 1)])
+            weights = self._solve(aversion, long_only)
+
+            order = np.argsort(self.mean @ weights, kind='stable')
+            weights = weights[:, order]
+            keep = np.concatenate([[True], np.abs(np.diff(weights, axis=1)).max(axis=0) > 1e-6])
+            rec['rows'] = int(keep.sum())
+
+        return weights[:, keep]
+
+    def weights_frame(self, weights):
+        '''
+        Returns: DataFrame of a ticker x candidate weights matrix, indexed by ticker
+        '''
+        return pd.DataFrame(np.asarray(weights).reshape(len(self.cols), -1), index=self.tickers)
+
+
+if __name__ == '__main__':
+
+    import sys
+    from app.store import store_read
+    from app.returns_engine import ReturnsPanel
+
+    # Optimizes the working portfolio saved by the last fetch (python -m app fetch) over
+    # the analysis period given on the command line (default 3 years)
+    sub = store_read('working_port')
+    spy_join = store_read('working_spy').set_index('month')
+    fred_join = store_read('working_fred').set_index('month')
+    panel = ReturnsPanel(sub)
+    years = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+
+    model = PortfolioModel(panel, years, spy_join, fred_join, sub['month'].min(), sub['month'].max())
+    current = model.current_weights()
+    min_var = model.min_variance()
+    frontier = model.frontier()
+    best = frontier[:, model.moments(frontier)['sharpe_port'].to_numpy().argmax()]
+
+    table = model.evaluate(np.column_stack([current, min_var, best]))
+    table.index = ['current', 'minimum variance', 'highest sharpe']
+    print(f"{model.period['st_date']} to {model.period['end_date']} (held from the start of the period):", flush=True)
+    print(table.round(4).to_string(), flush=True)
+    print(model.weights_frame(np.column_stack([current, min_var, best])).set_axis(table.index, axis=1).round(3).to_string(), flush=True)
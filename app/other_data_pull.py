@@ -1,57 +1,48 @@
 import requests
-import dotenv
-import json
-import datetime
-import csv
 import os
 from dotenv import load_dotenv
-import time
 import pandas as pd
+from app.store import store_write
+from app.port_data_pull import av_base_url, av_fetch
+from app.instrument import stage, counted
+from app.stream_json import fred_stream_frame
 
 # DEFINE FUNCTIONS ----------------------------------------------------------------------
 
-def spy_pull(api_key):
+def spy_request(api_key, session=requests):
+    '''
+    Requests monthly adjusted S&P 500 (SPY) data from the Alpha Vantage API.
+
+    Param: api_key (str), session (requests module or requests.Session)
 
+    Returns: DataFrame of typed S&P 500 data streamed from the response (see stream_json.py),
+    or the decoded response (dict) if it is an error or call limit response
+    '''
     print('--------------------------------------------------------')
     print('Downloading S&P 500 Data--------------------------------')
     print('--------------------------------------------------------')
 
-    spy_url = f"https://www.alphavantage.co/query?function=TIME_SERIES_MONTHLY_ADJUSTED&symbol=SPY&apikey={api_key}"
-    spy_response = requests.get(spy_url)
+    spy_url = f"{av_base_url()}/query?function=TIME_SERIES_MONTHLY_ADJUSTED&symbol=SPY&apikey={api_key}"
+    return av_fetch(spy_url, 'SPY', session)
 
-    parsed_spy = json.loads(spy_response.text)
+def spy_format(spy):
+    '''
+    Saves S&P 500 data to the columnar store and converts it to a monthly return series.
 
-    close_days = list(parsed_spy['Monthly Adjusted Time Series'].keys())
+    Param: spy (DataFrame) as returned by spy_request()
 
+    Returns: pandas Series of monthly S&P 500 returns indexed by month
+    '''
     print('--------------------------------------------------------')
-    print('Printing S&P 500 Data-----------------------------------')
+    print('Storing S&P 500 Data------------------------------------')
     print('--------------------------------------------------------')
 
-    spy_headers = ['timestamp', 'close',
-               'adj close', 'volume', 'div amt']
-
-    spy_filepath = os.path.join(os.path.dirname(os.path.abspath(
-        __file__)), '..', 'data', "SPY.csv")
-
-    with open(spy_filepath, 'w') as spy_file:
-        writer = csv.DictWriter(spy_file, fieldnames=spy_headers)
-        writer.writeheader()
-
-        for k in close_days:
-
-            writer.writerow({
-                'timestamp': k,
-                'close': parsed_spy['Monthly Adjusted Time Series'][k]['4. close'],
-                'adj close': parsed_spy['Monthly Adjusted Time Series'][k]['5. adjusted close'],
-                'volume': parsed_spy['Monthly Adjusted Time Series'][k]['6. volume'],
-                'div amt': parsed_spy['Monthly Adjusted Time Series'][k]['7. dividend amount']
-            })
+    store_write(spy, 'SPY')
 
     print('--------------------------------------------------------')
     print('Formatting S&P 500 Data---------------------------------')
     print('--------------------------------------------------------')
 
-    spy = pd.read_csv(spy_filepath, parse_dates=['timestamp'])
     spy_sort = spy.sort_values(by=['timestamp'])
     spy_sort['month'] = spy_sort['timestamp'].dt.to_period('M')
     spy_sort = spy_sort.set_index('month')
@@ -60,46 +51,60 @@ def spy_pull(api_key):
 
     return spy_ret
 
-def fred_pull(api_key):
-
-    print('--------------------------------------------------------')
-    print('Downloading 1-Year Treasury Bill Rates------------------')
-    print('--------------------------------------------------------')
+def spy_pull(api_key):
 
-    fred_url = f'https://api.stlouisfed.org/fred/series/observations?series_id=DGS1&api_key={api_key}&file_type=json'
-    fred_response = requests.get(fred_url)
+    return spy_format(spy_request(api_key))
 
-    parsed_fred = json.loads(fred_response.text)
+def fred_base_url():
+    '''
+    Returns the FRED API base URL (FRED_BASE_URL, default https://api.stlouisfed.org).
+    '''
+    return os.environ.get('FRED_BASE_URL', 'https://api.stlouisfed.org')
 
-    #fred_data = [{'date':x['date'], 'rate':x['value']} for x in parsed_fred['observations']]
+def fred_request(api_key, start=None, series_id='DGS1', session=requests):
+    '''
+    Requests daily 1-Year Treasury Bill rates (DGS1, or another FRED series) from the FRED API.
 
-    fred_filepath = os.path.join(os.path.dirname(os.path.abspath(
-        __file__)), '..', 'data', "FRED.csv")
+    Param: api_key (str), start (str or None) like '2020-11-01' to only request observations
+    from that date on, series_id (str) like 'DGS1', session (requests module or requests.Session)
 
+    Returns: DataFrame of typed rates streamed from the response (see stream_json.py),
+    or the decoded response (dict) if it is an error response
+    '''
     print('--------------------------------------------------------')
-    print('Printing 1-Year Treasury Bill Rates---------------------')
+    print('Downloading 1-Year Treasury Bill Rates------------------')
     print('--------------------------------------------------------')
 
-    fred_headers = ['date', 'rate']
+    fred_url = f'{fred_base_url()}/fred/series/observations?series_id={series_id}&api_key={api_key}&file_type=json'
+    if start is not None:
+        fred_url = f'{fred_url}&observation_start={start}'
+    with stage('http', source='fred', symbol=series_id):
+        fred_response = session.get(fred_url, timeout=30, stream=True)
+
+    with stage('parse', source='fred', symbol=series_id) as rec:
+        parsed = fred_stream_frame(counted(fred_response.iter_content(chunk_size=65536), rec))
+        rec['rows'] = len(parsed) if isinstance(parsed, pd.DataFrame) else 0
+
+    return parsed
 
-    with open(fred_filepath, 'w') as fred_file:
-        writer = csv.DictWriter(fred_file, fieldnames=fred_headers)
-        writer.writeheader()
+def fred_format(fred):
+    '''
+    Saves 1-Year Treasury Bill rates to the columnar store and converts them to monthly risk free rates.
 
-        for k in parsed_fred['observations']:
+    Param: fred (DataFrame) as returned by fred_request()
 
-            if k['value'] != '.':
+    Returns: pandas Series of monthly risk free rates indexed by month
+    '''
+    print('--------------------------------------------------------')
+    print('Storing 1-Year Treasury Bill Rates----------------------')
+    print('--------------------------------------------------------')
 
-                writer.writerow({
-                    'date': k['date'],
-                    'rate': k['value']
-                })
+    store_write(fred, 'FRED')
 
     print('--------------------------------------------------------')
     print('Formatting 1-Year Treasury Bill Rates-------------------')
     print('--------------------------------------------------------')
 
-    fred = pd.read_csv(fred_filepath, parse_dates=['date'])
     fred['month'] = fred['date'].dt.to_period('M')
     risk_free = fred.groupby('month')['rate'].mean()
     risk_free = (1 + risk_free / 200)**(1 / 6) - 1
@@ -107,6 +112,10 @@ def fred_pull(api_key):
 
     return risk_free
 
+def fred_pull(api_key):
+
+    return fred_format(fred_request(api_key))
+
 
 if __name__=='__main__':
 
@@ -117,7 +126,5 @@ if __name__=='__main__':
 
     spy_join=spy_pull(ap_api_key)
     fred_join=fred_pull(fred_api_key)
-    spy_join.to_csv(os.path.join(os.path.dirname(os.path.abspath(
-        __file__)), '..', 'data', "working_spy.csv"))
-    fred_join.to_csv(os.path.join(os.path.dirname(os.path.abspath(
-        __file__)), '..', 'data', "working_fred.csv"))
+    store_write(spy_join.reset_index(), 'working_spy')
+    store_write(fred_join.reset_index(), 'working_fred')
@@ -0,0 +1,305 @@
+# panel.py
+
+# IMPORT PACKAGES
+
+import os
+import numpy as np
+import pandas as pd
+
+# FUNCTIONS
+
+# Price columns of the portfolio dataset kept by CompactPanel
+PRICE_COLUMNS = ['close', 'adj close', 'volume', 'div amt']
+
+
+def panel_precision():
+    '''
+    Returns the float type of stored price columns: 'float64' (PANEL_PRECISION, the default)
+    or 'float32', which halves their size.  Calculations are always done in float64.
+    '''
+    precision = os.environ.get('PANEL_PRECISION', 'float64').lower()
+    if precision not in ('float64', 'float32'):
+        raise ValueError(f"PANEL_PRECISION must be 'float64' or 'float32', not {precision!r}")
+
+    return precision
+
+
+def month_ordinals(timestamps):
+    '''
+    Converts timestamps to monthly period ordinals (months since January 1970, the
+    ordinals pandas uses for monthly periods).
+
+    Param: timestamps (Series, DatetimeIndex or datetime64 array)
+
+    Returns: int64 numpy array
+    '''
+    return np.asarray(timestamps, dtype='datetime64[M]').astype('int64')
+
+
+def ffill_rows(x):
+    '''
+    Fills missing values down each column of a 2-D array from the previous row
+    (like DataFrame.ffill(); leading missing values stay missing).
+    '''
+    rows = np.where(np.isnan(x), 0, np.arange(len(x))[:, None])
+    rows = np.maximum.accumulate(rows, axis=0)
+
+    return np.take_along_axis(x, rows, axis=0)
+
+
+def dense_columns(ticker_codes, month_codes, n_months, n_tickers, values):
+    '''
+    Scatters long-format columns into month x ticker matrices with one allocation per column.
+
+    Param: ticker_codes and month_codes (int arrays of row positions), n_months (int),
+    n_tickers (int), values (dictionary of {name: array})
+
+    Returns: dictionary of {name: n_months x n_tickers float64 array} (nan where there is no row)
+    '''
+    dense = {}
+    for name, v in values.items():
+        m = np.full((n_months, n_tickers), np.nan)
+        m[month_codes, ticker_codes] = v
+        dense[name] = m
+
+    return dense
+
+
+def dataset_ordinals(dataset):
+    '''
+    Returns: month ordinals (int64 array) of a dataset's month column, which holds either
+    monthly Periods or the int32 ordinals of a compact frame
+    '''
+    month = dataset['month']
+    if isinstance(month.dtype, pd.PeriodDtype):
+        return month.array.asi8
+
+    return month.to_numpy(dtype='int64')
+
+
+def dense_from_dataset(dataset, columns=['close', 'adj close']):
+    '''
+    Builds month x ticker matrices from a long portfolio dataset (ticker and month
+    columns) or a CompactPanel without pivoting.  Months and tickers come out sorted,
+    like DataFrame.pivot().
+
+    Returns: months (PeriodIndex), tickers (Index), dictionary of {column: matrix}
+    '''
+    if not isinstance(dataset, CompactPanel):
+        dataset = CompactPanel.from_dataset(dataset, 'float64', columns)
+
+    return dataset.dense(columns)
+
+
+class CompactPanel:
+    '''
+    Portfolio dataset (one row per ticker and month) held in compact columns.
+
+    Tickers are int32 codes into a sorted ticker index and months are int32 period
+    ordinals.  Share quantities are kept once per ticker rather than once per row, and
+    price columns use the PANEL_PRECISION float type.  The timestamp and month Period
+    columns of the long dataset are not kept, and derived values (like monthly returns)
+    are calculated on demand.  A row takes 24 bytes with float32 prices, against more
+    than 60 in the long dataset.
+
+    frame() gives a compact DataFrame for the store and dataset() the long dataset used
+    by the rest of the app.  ReturnsPanel accepts either.
+
+    Param: tickers (Index), codes (int32 array of ticker positions), ordinals (int32 array
+    of months), qty (float64 array by ticker), columns (dictionary of {name: array})
+
+    Example: compact = CompactPanel.from_dataset(sub, 'float32'); ReturnsPanel(compact)
+    '''
+
+    def __init__(self, tickers, codes, ordinals, qty, columns):
+        self.tickers = tickers
+        self.codes = codes
+        self.ordinals = ordinals
+        self.qty = qty
+        self.columns = columns
+
+    @classmethod
+    def from_dataset(cls, dataset, precision=None, columns=None):
+        '''
+        Converts a long dataset, or a compact frame read back from the store.
+
+        Param: dataset (DataFrame), precision ('float64', 'float32' or None for PANEL_PRECISION),
+        columns (list or None for the price columns in the dataset)
+        '''
+        precision = precision or panel_precision()
+        if columns is None:
+            columns = [c for c in PRICE_COLUMNS if c in dataset]
+
+        codes, tickers = pd.factorize(dataset['ticker'], sort=True)
+        tickers = pd.Index(np.asarray(tickers, dtype=object), name='ticker')
+
+        qty = np.zeros(len(tickers))
+        if 'qty' in dataset:
+            qty[codes] = dataset['qty'].to_numpy(dtype='float64')
+
+        return cls(tickers, codes.astype('int32'), dataset_ordinals(dataset).astype('int32'), qty,
+                   {c: dataset[c].to_numpy(dtype=precision) for c in columns})
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self):
+        '''
+        Returns: bytes held by the arrays (not counting the ticker index)
+        '''
+        return self.codes.nbytes + self.ordinals.nbytes + self.qty.nbytes + sum(c.nbytes for c in self.columns.values())
+
+    def take(self, rows):
+        '''
+        Returns: CompactPanel of the given rows (an index or boolean array) with the same tickers
+        '''
+        return CompactPanel(self.tickers, self.codes[rows], self.ordinals[rows], self.qty,
+                            {c: v[rows] for c, v in self.columns.items()})
+
+    def dense(self, columns=['close', 'adj close']):
+        '''
+        Scatters columns into float64 month x ticker matrices (see dense_from_dataset()).
+        '''
+        ordinals, month_codes = np.unique(self.ordinals, return_inverse=True)
+        dense = dense_columns(self.codes, month_codes, len(ordinals), len(self.tickers),
+                              {c: self.columns[c] for c in columns})
+        months = pd.PeriodIndex.from_ordinals(ordinals.astype('int64'), freq='M', name='month')
+
+        return months, self.tickers, dense
+
+    def monthly_returns(self, column='adj close'):
+        '''
+        Calculates the return of every row over the previous month with data for the
+        same ticker (nan for the first month of a ticker).
+
+        Returns: float64 array in row order
+        '''
+        order = np.lexsort((self.ordinals, self.codes))
+        values = self.columns[column][order].astype('float64')
+        rets = np.full(len(values), np.nan)
+        rets[1:] = values[1:] / values[:-1] - 1
+        rets[1:][self.codes[order][1:] != self.codes[order][:-1]] = np.nan
+
+        result = np.empty_like(rets)
+        result[order] = rets
+
+        return result
+
+    def frame(self):
+        '''
+        Returns: compact DataFrame (categorical ticker, int32 month ordinals, qty and the
+        price columns in the stored precision) for the columnar store
+        '''
+        precision = next(iter(self.columns.values())).dtype if self.columns else 'float64'
+        compact = {'ticker': pd.Categorical.from_codes(self.codes, categories=self.tickers),
+                   'month': self.ordinals, 'qty': self.qty[self.codes].astype(precision)}
+        compact.update(self.columns)
+
+        return pd.DataFrame(compact)
+
+    def dataset(self, first=None, last=None):
+        '''
+        Expands the rows from month first to month last (Periods or None for all months)
+        to the long dataset, with a categorical ticker column, float64 columns and a
+        month Period column.
+
+        Returns: DataFrame with ticker, qty, price and month columns
+        '''
+        keep = np.ones(len(self), dtype=bool)
+        if first is not None:
+            keep &= self.ordinals >= first.ordinal
+        if last is not None:
+            keep &= self.ordinals <= last.ordinal
+        codes = self.codes[keep]
+
+        full = {'ticker': pd.Categorical.from_codes(codes, categories=self.tickers), 'qty': self.qty[codes]}
+        full.update({c: v[keep].astype('float64') for c, v in self.columns.items()})
+        full['month'] = pd.PeriodIndex.from_ordinals(self.ordinals[keep].astype('int64'), freq='M')
+
+        return pd.DataFrame(full)
+
+
+class PanelBuilder:
+    '''
+    Collects downloaded ticker series in memory and assembles the long portfolio
+    dataset in one pass.
+
+    Each series is added once.  Its first and last month are recorded as it is
+    added, so the common analysis window (the latest first month and the earliest
+    last month across tickers) is known without a groupby.  Columns are then
+    allocated once at their final size and filled ticker by ticker in sorted order,
+    instead of concatenating and sorting a growing frame.
+
+    Example: builder = PanelBuilder(); builder.add('AZO', frame, 10); builder.compact()
+    '''
+
+    def __init__(self):
+        self.series = {}
+        self.first = {}
+        self.last = {}
+        self.rows = 0
+
+    def add(self, tkr, frame, qty):
+        '''
+        Adds one ticker's price series.
+
+        Param: tkr (str), frame (DataFrame with timestamp, close, adj close, volume and
+        div amt columns, in any date order), qty (float) shares held
+
+        Raises: ValueError if the frame has no rows
+        '''
+        if len(frame) == 0:
+            raise ValueError(f'No price data for {tkr}')
+
+        ordinals = month_ordinals(frame['timestamp'])
+        order = np.argsort(ordinals, kind='stable')
+        if len(order) > 1 and not (np.diff(order) == 1).all():
+            frame = frame.iloc[order]
+            ordinals = ordinals[order]
+
+        self.series[tkr] = (frame, ordinals, float(qty))
+        self.first[tkr] = int(ordinals[0])
+        self.last[tkr] = int(ordinals[-1])
+        self.rows += len(frame)
+
+    def window(self):
+        '''
+        Returns: latest first month (maxomin) and earliest last month (minomax) across tickers, as Periods
+        '''
+        if not self.series:
+            return None, None
+        window = pd.PeriodIndex.from_ordinals([max(self.first.values()), min(self.last.values())], freq='M')
+
+        return window[0], window[1]
+
+    def compact(self, precision=None):
+        '''
+        Assembles the dataset, sorted by ticker and month, straight into compact columns
+        (no long frame is built).
+
+        Param: precision ('float64', 'float32' or None for PANEL_PRECISION)
+
+        Returns: CompactPanel
+        '''
+        precision = precision or panel_precision()
+        tickers = sorted(self.series)
+        data_cols = [c for c in PRICE_COLUMNS if c in self.series[tickers[0]][0]]
+
+        columns = {c: np.empty(self.rows, dtype=precision) for c in data_cols}
+        codes = np.empty(self.rows, dtype='int32')
+        ordinals = np.empty(self.rows, dtype='int32')
+        qty = np.empty(len(tickers), dtype='float64')
+
+        pos = 0
+        for i, tkr in enumerate(tickers):
+            frame, ords, q = self.series[tkr]
+            n = len(frame)
+            for c in data_cols:
+                columns[c][pos:pos + n] = frame[c].to_numpy()
+            codes[pos:pos + n] = i
+            ordinals[pos:pos + n] = ords
+            qty[i] = q
+            pos += n
+
+        return CompactPanel(pd.Index(tickers, dtype=object, name='ticker'), codes, ordinals, qty, columns)
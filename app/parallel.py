@@ -0,0 +1,206 @@
+# parallel.py
+
+# IMPORT PACKAGES
+
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+from app.returns_engine import ReturnsPanel, monthly_values
+from app.benchmark_index import BenchmarkIndex
+
+# FUNCTIONS
+
+# Panel, quantities and benchmark data attached by each worker process
+_WORKER = {}
+
+
+def analysis_workers():
+    '''
+    Returns the number of worker processes to use (ANALYSIS_WORKERS, default 1: the
+    analysis runs in the main process).  Starting a pool and sharing the panel costs
+    more than the four periods of one report, so a pool only pays off for large
+    batches or long simulations.
+    '''
+    return int(os.environ.get('ANALYSIS_WORKERS', 1))
+
+
+def share_array(arr):
+    '''
+    Copies a numpy array into a new shared memory block.
+
+    Returns: SharedMemory block, spec (name, shape, dtype) for attach_array()
+    '''
+    arr = np.ascontiguousarray(arr)
+    shm = SharedMemory(create=True, size=max(arr.nbytes, 1))
+    np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+
+    return shm, (shm.name, arr.shape, arr.dtype.str)
+
+
+def attach_array(spec):
+    '''
+    Attaches to an array created by share_array() in another process (no copy is made).
+
+    Returns: SharedMemory block, numpy array backed by the block
+    '''
+    name, shape, dtype = spec
+    shm = SharedMemory(name=name)
+
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _init_worker(specs, months, tickers, index_path=None):
+    arrays = {}
+    blocks = []
+    for key, spec in specs.items():
+        shm, arr = attach_array(spec)
+        blocks.append(shm)
+        arrays[key] = arr
+
+    _WORKER['blocks'] = blocks
+    _WORKER['panel'] = ReturnsPanel.from_arrays(months, tickers, arrays['close'], arrays['cumret'],
+                                                arrays['first'], arrays['last'], arrays['qty'][:, 0])
+    _WORKER['qty'] = arrays['qty']
+
+    # A saved benchmark index is memory-mapped by every worker instead of shared
+    if index_path is not None:
+        _WORKER['spy'] = BenchmarkIndex.read(path=index_path)
+        _WORKER['fred'] = None
+    else:
+        _WORKER['spy'] = pd.Series(arrays['spret'], index=months, name='spret')
+        _WORKER['fred'] = pd.Series(arrays['rate'], index=months, name='rate')
+
+
+def _run_job(job):
+    '''
+    Runs one (portfolio, period) job against the panel attached by this worker.
+    '''
+    p, period_length, min_start, max_end = job
+    panel = _WORKER['panel']
+
+    return panel.returns(period_length, _WORKER['spy'], _WORKER['fred'], min_start, max_end, _WORKER['qty'][:, p])
+
+
+def _run_many_job(job):
+    '''
+    Runs one (portfolio columns, period) batch job against the panel attached by this worker.
+    '''
+    cols, period_length = job
+    panel = _WORKER['panel']
+
+    return panel.returns_many(period_length, _WORKER['spy'], _WORKER['fred'], _WORKER['qty'][:, cols])
+
+
+class SharedPanel:
+    '''
+    Places a ReturnsPanel, a ticker x portfolio quantity matrix and the benchmark
+    series in shared memory so worker processes can use them without pickling.
+
+    Param: panel (ReturnsPanel), qty (ticker x portfolio matrix or None for the panel
+    quantities), spy_join, fred_join (or a saved BenchmarkIndex and None, which workers
+    open from its file)
+
+    Example: with SharedPanel(panel, None, spy_join, fred_join) as shared: shared.map(_run_job, jobs)
+    '''
+
+    def __init__(self, panel, qty, spy_join, fred_join):
+        if qty is None:
+            qty = panel.qty[:, None]
+
+        arrays = {'close': panel.close, 'cumret': panel.cumret, 'first': panel.first, 'last': panel.last,
+                  'qty': np.asarray(qty, dtype='float64')}
+
+        self.index_path = None
+        if isinstance(spy_join, BenchmarkIndex) and spy_join.path is not None:
+            self.index_path = spy_join.path
+        elif isinstance(spy_join, BenchmarkIndex):
+            arrays['spret'], arrays['rate'] = spy_join.values(panel.months)
+        else:
+            arrays['spret'] = monthly_values(spy_join, panel.months, 'spret')
+            arrays['rate'] = monthly_values(fred_join, panel.months, 'rate')
+
+        self.panel = panel
+        self.blocks = []
+        self.specs = {}
+        for key, arr in arrays.items():
+            shm, spec = share_array(arr)
+            self.blocks.append(shm)
+            self.specs[key] = spec
+
+    def map(self, func, jobs, workers=None):
+        '''
+        Runs func (a module level job function like _run_job) over jobs across a process pool.
+
+        Returns: list of job results in job order
+        '''
+        if workers is None:
+            workers = analysis_workers()
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(self.specs, self.panel.months, self.panel.tickers, self.index_path)) as executor:
+            return list(executor.map(func, jobs))
+
+    def close(self):
+        for shm in self.blocks:
+            shm.close()
+            shm.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def parallel_returns(panel, jobs, spy_join, fred_join, qty=None, workers=None):
+    '''
+    Evaluates (portfolio column, period length, min start, max end) jobs, in a process
+    pool when more than one worker is configured and sequentially otherwise.  Both
+    paths run the same ReturnsPanel.returns() code, so the results are identical.
+
+    Param: panel (ReturnsPanel), jobs (list of tuples), spy_join, fred_join, qty (ticker x
+    portfolio matrix or None for the panel quantities), workers (int or None)
+
+    Example: parallel_returns(panel, [(0, i, maxomin, minomax) for i in [1, 2, 3, 5]], spy_join, fred_join)
+
+    Returns: list of (results dictionary, cumulative returns dictionary, monthly DataFrame) in job order
+    '''
+    if workers is None:
+        workers = analysis_workers()
+
+    if workers <= 1 or len(jobs) <= 1:
+        qty_matrix = panel.qty[:, None] if qty is None else qty
+        return [panel.returns(i, spy_join, fred_join, min_start, max_end, qty_matrix[:, p])
+                for p, i, min_start, max_end in jobs]
+
+    with SharedPanel(panel, qty, spy_join, fred_join) as shared:
+        return shared.map(_run_job, jobs, min(workers, len(jobs)))
+
+
+def parallel_returns_many(panel, qty, periods, spy_join, fred_join, workers=None):
+    '''
+    Evaluates a batch of portfolios for several analysis periods, splitting the
+    portfolios into one chunk per worker for every period.
+
+    Param: panel (ReturnsPanel), qty (ticker x portfolio matrix), periods (list of years),
+    spy_join, fred_join, workers (int or None)
+
+    Returns: list of results DataFrames (see ReturnsPanel.returns_many), one per period
+    '''
+    if workers is None:
+        workers = analysis_workers()
+
+    if workers <= 1:
+        return [panel.returns_many(i, spy_join, fred_join, qty) for i in periods]
+
+    chunks = [c for c in np.array_split(np.arange(qty.shape[1]), workers) if len(c) > 0]
+    jobs = [(cols, i) for i in periods for cols in chunks]
+
+    with SharedPanel(panel, qty, spy_join, fred_join) as shared:
+        results = shared.map(_run_many_job, jobs, min(workers, len(jobs)))
+
+    return [pd.concat(results[k * len(chunks):(k + 1) * len(chunks)], ignore_index=True) for k in range(len(periods))]
@@ -1,198 +1,229 @@
 # IMPORT PACKAGES -----------------------------------------------------------------------
 
 import requests
-import dotenv
-import json
-import datetime
-import csv
 import os
+import sys
 from dotenv import load_dotenv
-import time
 import pandas as pd
-from app.portfolio_import import portfolio_import
+from app.portfolio_import import Holdings, portfolio_import
+from app.fetch_job import fetch_partial
+from app.rate_limit import TokenBucket, throttled_map
+from app.store import store_write
+from app.stream_json import av_stream_frame
+from app.instrument import stage, counted
+from app.panel import PanelBuilder
+from app.validate import validate_panel, print_validation
 
 # DEFINE FUNCTIONS ----------------------------------------------------------------------
 
-def num_suffix(num_for_suffix):
+def av_base_url():
     '''
-    Adds st, nd, rd, or th to the end of a day of the month.
+    Returns the Alpha Vantage base URL (ALPHAVANTAGE_BASE_URL, default https://www.alphavantage.co).
     '''
-    if 4 <= num_for_suffix <= 20 or 24 <= num_for_suffix <= 30:
-        suffix = 'th'
-    else:
-        suffix = ['st', 'nd', 'rd'][num_for_suffix % 10 - 1]
+    return os.environ.get('ALPHAVANTAGE_BASE_URL', 'https://www.alphavantage.co')
 
-    return suffix
+def av_fetch(url, symbol, session=requests, series_key='Monthly Adjusted Time Series'):
+    '''
+    Requests an Alpha Vantage time series and streams the response into typed columns,
+    tracing the HTTP request and the parse as separate stages (see instrument.py).
 
-def port_data_pull(portfolio,api_key):
+    Returns: DataFrame (see stream_json.av_stream_frame()) or the decoded error response (dict)
+    '''
+    with stage('http', source='alphavantage', symbol=symbol):
+        response = session.get(url, timeout=30, stream=True)
 
-    failed_tickers = []
+    with stage('parse', source='alphavantage', symbol=symbol) as rec:
+        parsed = av_stream_frame(counted(response.iter_content(chunk_size=65536), rec), series_key=series_key)
+        rec['rows'] = len(parsed) if isinstance(parsed, pd.DataFrame) else 0
 
-    tck_list = [p['tck'] for p in portfolio]
+    return parsed
 
-    batch = int(len(tck_list) / 5) + (len(tck_list) % 5 > 0)
+def av_monthly_request(tkr, api_key, session=requests):
+    '''
+    Requests monthly adjusted data for a single ticker from the Alpha Vantage API.
 
-    if len(tck_list) > 5:
-        print('-----------------------------------------------', flush=True)
-        print(f'WARNING! DUE TO NUMBER OF TICKERS IN YOUR PORTFOLIO,\nTHE DATA COLLECTION PROCESS MAY TAKE APPROXIMATELY {batch} MINUTES TO COMPLETE!', flush=True)
-        print('-----------------------------------------------', flush=True)
+    Param: tkr (str) like 'AZO', api_key (str), session (requests module or requests.Session)
 
-    for i in range(0,batch,1):
-        start = i * 5
-        end = min(len(tck_list), start + 5)
+    Returns: DataFrame of typed monthly data streamed from the response (see stream_json.py),
+    or the decoded response (dict) if it is an error or call limit response
+    '''
+    request_url = f"{av_base_url()}/query?function=TIME_SERIES_MONTHLY_ADJUSTED&symbol={tkr}&apikey={api_key}"
+    return av_fetch(request_url, tkr, session)
 
-        # Wait 1 minute and 10 seconds to avoid hitting 5 call per minute API limit
-        time.sleep(70)
+def av_daily_request(tkr, api_key, session=requests):
+    '''
+    Requests the full history of daily adjusted data for a single ticker from the Alpha Vantage API.
 
-        for tkr in tck_list[start:end]:
+    Param: tkr (str) like 'AZO', api_key (str), session (requests module or requests.Session)
 
-            request_url = f"https://www.alphavantage.co/query?function=TIME_SERIES_MONTHLY_ADJUSTED&symbol={tkr}&apikey={api_key}"
-            response = requests.get(request_url)
+    Returns: DataFrame of typed daily data streamed from the response (see stream_json.py),
+    or the decoded response (dict) if it is an error or call limit response
+    '''
+    request_url = f"{av_base_url()}/query?function=TIME_SERIES_DAILY_ADJUSTED&symbol={tkr}&outputsize=full&apikey={api_key}"
+    return av_fetch(request_url, tkr, session, series_key='Time Series (Daily)')
 
-            # PARSE API DATA -----------------------------------------------------------------------
+def av_throttled(parsed_response):
+    '''
+    Checks whether an Alpha Vantage response is a "Note" (call limit exceeded) response.
+    '''
+    return isinstance(parsed_response, dict) and 'Note' in parsed_response
 
-            #print(response.text)
-            parsed_response = json.loads(response.text)
+def av_bucket():
+    '''
+    Builds the Alpha Vantage token bucket from the ALPHAVANTAGE_CALLS_PER_MINUTE and
+    ALPHAVANTAGE_CALLS_PER_DAY environment variables (defaults: 5 and 500).
+    '''
+    per_minute = int(os.environ.get('ALPHAVANTAGE_CALLS_PER_MINUTE', 5))
+    per_day = int(os.environ.get('ALPHAVANTAGE_CALLS_PER_DAY', 500))
 
-            error_check_list = list(parsed_response.keys())
-            error_check = error_check_list[0]
+    return TokenBucket(per_minute, per_day)
 
-            if error_check == 'Meta Data':  # IF TICKER IS ABLE TO PULL ACTUAL DATA
+def port_data_pull(portfolio,api_key,bucket=None,partial=None):
 
-                quant=[q['qty'] for q in portfolio if q['tck']==tkr][0]
+    tck_list = [p['tck'] for p in portfolio]
 
-                ## PULL LATEST CLOSE FROM DATA ------------------------------------------------------------
+    if bucket is None:
+        bucket = av_bucket()
 
-                close_days = list(parsed_response['Monthly Adjusted Time Series'].keys())
+    wait_min = int((len(tck_list) - 1) / bucket.per_minute) if len(tck_list) > 0 else 0
 
-                ## WRITE CSV DATA ------------------------------------------------------------------------
+    if wait_min > 0:
+        print('-----------------------------------------------', flush=True)
+        print(f'WARNING! DUE TO NUMBER OF TICKERS IN YOUR PORTFOLIO,\nTHE DATA COLLECTION PROCESS MAY TAKE APPROXIMATELY {wait_min} MINUTES TO COMPLETE!', flush=True)
+        print('-----------------------------------------------', flush=True)
 
-                headers = ['ticker', 'qty', 'timestamp', 'close', 'adj close', 'volume', 'div amt']
+    # Requests are sent as soon as the token bucket allows (ALPHAVANTAGE_CALLS_PER_MINUTE
+    # and ALPHAVANTAGE_CALLS_PER_DAY), and retried with a backoff on "Note" responses
+    responses = throttled_map(lambda t: av_monthly_request(t, api_key), tck_list, bucket, is_throttled=av_throttled)
 
-                csv_filepath = os.path.join(os.path.dirname(os.path.abspath(
-                    __file__)), '..', 'data', f"{tkr}.csv")
+    sub, minomax, maxomin, compact = port_data_compile(portfolio, responses, bucket, partial)
 
-                with open(csv_filepath, 'w') as csv_file:
-                    writer = csv.DictWriter(csv_file, fieldnames=headers)
-                    writer.writeheader()
+    return sub, minomax, maxomin
 
-                    for k in close_days:
+def port_data_compile(portfolio, responses, bucket, partial=None):
+    '''
+    Assembles downloaded ticker data into the portfolio dataset and saves the full
+    ticker x month panel to the columnar store.
 
-                        writer.writerow({
-                            'ticker': tkr,
-                            'qty': quant,
-                            'timestamp': k,
-                            'close': parsed_response['Monthly Adjusted Time Series'][k]['4. close'],
-                            'adj close': parsed_response['Monthly Adjusted Time Series'][k]['5. adjusted close'],
-                            'volume': parsed_response['Monthly Adjusted Time Series'][k]['6. volume'],
-                            'div amt': parsed_response['Monthly Adjusted Time Series'][k]['7. dividend amount']
-                        })
+    If some tickers could not be downloaded the program stops, unless partial (default:
+    FETCH_PARTIAL) is set: the dataset is then assembled from the other tickers and the
+    excluded ones are listed in sub.attrs['excluded'].
 
-                # PRINT STATUS ---------------------------------------------------------------------
+    Param: portfolio (list of dict), responses (dict of {ticker: DataFrame or error response}),
+    bucket (TokenBucket, used for the call limit message), partial (bool or None)
 
-                print('-----------------------------------------------', flush=True)
-                print(f"DOWNLOADING DATA FOR: {tkr}", flush=True)
-                print(f'DATA FROM {close_days[-1]} TO {close_days[0]}')
-                print(f"WRITING DATA TO CSV: {os.path.abspath(csv_filepath)}", flush=True)
-                print('-----------------------------------------------', flush=True)
+    Returns: portfolio dataset (DataFrame), last common month, first common month, full
+    panel of every ticker (CompactPanel, the one saved as port_panel)
+    '''
+    failed_tickers = []
+    builder = PanelBuilder()
 
-            else:  # IF TICKER NOT FOUND ON API
+    # One position per ticker, with its quantity looked up by ticker (see portfolio_import.py)
+    holdings = Holdings.from_portfolio(portfolio)
+    tck_list = holdings.tickers
 
-                if error_check == "Error Message":
-                    failed_tickers.append(
-                        {'ticker': tkr, 'err_type': 'Invalid API Call'})
+    for tkr in tck_list:
 
-                elif error_check == "Note":
-                    failed_tickers.append(
-                        {'ticker': tkr, 'err_type': 'Exceeds API Call Limit (5 per minute and 500 per day)'})
+        # PARSE API DATA -----------------------------------------------------------------------
 
-                else:
-                    failed_tickers.append({'ticker': tkr, 'err_type': 'Other'})
+        parsed_response = responses[tkr]
 
-        if i < (batch - 1):
-            print('-----------------------------------------------',flush=True)
-            print(f'The {i+1}{num_suffix(i+1)} Batch of Downloads is Complete!', flush=True)
-            print('Waiting 1 minute to download next batch of data', flush=True)
-            print(f'Estimated remaining download time is approximately {batch-i-1} minutes.', flush=True)
-            print('-----------------------------------------------', flush=True)
+        if isinstance(parsed_response, pd.DataFrame) and len(parsed_response) > 0:  # IF TICKER IS ABLE TO PULL ACTUAL DATA
 
-        else:
-            print('-----------------------------------------------', flush=True)
-            print('Data download complete.  Compiling portfolio dataset now.', flush=True)
-            print('-----------------------------------------------', flush=True)
+            quant = holdings.quantity(tkr)
 
-    # ERROR SUMMARY -----------------------------------------------------------------
-    if len(failed_tickers) > 0:
-        if len(failed_tickers) == len(tck_list):
-            print("-------------------------")
-            print("UNABLE TO GENERATE REPORT FOR THE SPECIFIED TICKER(S).\nSEE ERROR SUMMARY")
-            print("-------------------------")
+            ## ADD POSITION TO PANEL -----------------------------------------------------------
 
-        print("-------------------------")
-        print("ERROR SUMMARY:")
-        print("The program was unable to pull data from the API for the following ticker(s):")
-        for t in failed_tickers:
-            print(f"----{t['ticker']}: {t['err_type']}")
-        print("Please check the accuracy of the ticker(s) and try again.")
-
-        return exit()
+            tkr_data = parsed_response
+            builder.add(tkr, tkr_data, float(quant))
 
-    else:
-
-        start_path = os.path.join(os.path.dirname(os.path.abspath(
-            __file__)), '..', 'data', f"{tck_list[0]}.csv")
+            # PRINT STATUS ---------------------------------------------------------------------
 
+            print('-----------------------------------------------', flush=True)
+            print(f"DOWNLOADING DATA FOR: {tkr}", flush=True)
+            print(f"DATA FROM {tkr_data['timestamp'].min():%Y-%m-%d} TO {tkr_data['timestamp'].max():%Y-%m-%d}")
+            print('-----------------------------------------------', flush=True)
 
-        full = pd.read_csv(start_path, parse_dates=['timestamp'])
+        elif isinstance(parsed_response, pd.DataFrame):  # IF THE API RETURNED NO MONTHS
 
+            failed_tickers.append({'ticker': tkr, 'err_type': 'No Price Data'})
 
-        if len(tck_list) == 2:
+        else:  # IF TICKER NOT FOUND ON API
 
-            next_path = os.path.join(os.path.dirname(os.path.abspath(
-                __file__)), '..', 'data', f"{tck_list[1]}.csv")
+            error_check = list(parsed_response.keys())[0]
 
-            temp_data = pd.read_csv(next_path, parse_dates=['timestamp'])
+            if error_check == "Error Message":
+                failed_tickers.append(
+                    {'ticker': tkr, 'err_type': 'Invalid API Call'})
 
-            full = full.append(temp_data)
+            elif error_check == "Note":
+                failed_tickers.append(
+                    {'ticker': tkr, 'err_type': f'Exceeds API Call Limit ({bucket.per_minute} per minute and {bucket.per_day} per day)'})
 
-        else:
+            elif error_check == "Error":
+                failed_tickers.append({'ticker': tkr, 'err_type': f'Request Failed ({parsed_response["Error"]})'})
 
-            for t in tck_list[1:len(tck_list)]:
+            else:
+                failed_tickers.append({'ticker': tkr, 'err_type': 'Other'})
 
-                temp_path = os.path.join(os.path.dirname(os.path.abspath(
-                    __file__)), '..', 'data', f"{t}.csv")
+    print('-----------------------------------------------', flush=True)
+    print('Data download complete.  Compiling portfolio dataset now.', flush=True)
+    print('-----------------------------------------------', flush=True)
 
-                temp_data = pd.read_csv(temp_path, parse_dates=['timestamp'])
-                #print(temp_data)
+    # ERROR SUMMARY -----------------------------------------------------------------
+    if partial is None:
+        partial = fetch_partial()
 
-                full = full.append(temp_data)
+    if len(failed_tickers) > 0 and partial and len(failed_tickers) < len(tck_list):
+        print("-------------------------")
+        print("WARNING! THE FOLLOWING POSITION(S) ARE EXCLUDED FROM THE ANALYSIS:")
+        for t in failed_tickers:
+            print(f"----{t['ticker']} ({holdings.quantity(t['ticker']):,.2f} shares): {t['err_type']}")
+        print("Results cover the remaining positions only.")
+        print("-------------------------")
 
+    if len(failed_tickers) > 0 and not (partial and len(failed_tickers) < len(tck_list)):
+        if len(failed_tickers) == len(tck_list):
+            print("-------------------------")
+            print("UNABLE TO GENERATE REPORT FOR THE SPECIFIED TICKER(S).\nSEE ERROR SUMMARY")
+            print("-------------------------")
 
-        full_sort = full.sort_values(by=['ticker', 'timestamp'])
+        print("-------------------------")
+        print("ERROR SUMMARY:")
+        print("The program was unable to pull data from the API for the following ticker(s):")
+        for t in failed_tickers:
+            print(f"----{t['ticker']}: {t['err_type']}")
+        print("Please check the accuracy of the ticker(s) and try again.")
+        print("To analyze the remaining positions instead, set FETCH_PARTIAL='on'.")
 
-        # CREATE MONTH VARIABLE
-        # SOURCE: https://stackoverflow.com/questions/45304531/extracting-the-first-day-of-month-of-a-datetime-type-column-in-pandas
-        full_sort['month'] = full_sort['timestamp'].dt.to_period('M')
+        sys.exit(1)
 
-        # Resize data for consistent periods (data/API limitation) ----------------------------
+    else:
 
-        maxomin = full_sort.groupby('ticker')['month'].min()
-        #print(maxomin)
-        maxomin = maxomin.max()
-        #print(maxomin)
+        # Assemble the panel in one pass (see panel.py).  The common window
+        # (latest first month to earliest last month) is tracked as tickers are added.
+        # The full panel is kept in compact columns (PANEL_PRECISION, see CompactPanel)
+        # and only the common window is expanded to the long dataset.
+        with stage('assemble', tickers=len(builder.series)) as rec:
+            compact = builder.compact()
+            maxomin, minomax = builder.window()
 
-        minomax = full_sort.groupby('ticker')['month'].max()
-        #print(minomax)
-        minomax = minomax.min()
-        #print(minomax)
+            # Check every ticker-month for gaps, duplicates, bad prices and unadjusted
+            # splits (and repair them if VALIDATE_REPAIR is set, see validate.py)
+            compact, anomalies = validate_panel(compact)
 
-        # SUBSET DATA FOR FIRST/LAST MONTH
-        sub = full_sort.loc[(full_sort['month'] <= minomax) &
-                            (full_sort['month'] >= maxomin)]
+            # SUBSET DATA FOR FIRST/LAST MONTH
+            sub = compact.dataset(maxomin, minomax)
+            rec['rows'] = len(compact)
+            rec['bytes'] = compact.nbytes
 
-        sub = sub.sort_values(by=['ticker', 'month'])
+        store_write(compact.frame(), 'port_panel')
+        if len(anomalies) > 0:
+            print_validation(anomalies)
+            store_write(anomalies, 'validation_report')
+        sub.attrs['excluded'] = [t['ticker'] for t in failed_tickers]
 
-        return sub, minomax, maxomin
+        return sub, minomax, maxomin, compact
 
 
 if __name__=='__main__':
@@ -216,5 +247,4 @@ if __name__=='__main__':
     print(pull)
     print(f'minomax: {minomax}')
     print(f'maxomin: {maxomin}')
-    pull.to_csv(os.path.join(os.path.dirname(os.path.abspath(
-        __file__)), '..', 'data', "working_port.csv"),index=False)
+    store_write(pull, 'working_port')
@@ -3,37 +3,232 @@
 # IMPORT PACKAGES
 
 import csv
+import math
 import os
+import re
+from array import array
 from dotenv import load_dotenv
 
 # FUNTIONS
 
-#TODO: hasnum function for later when I add input data validations
-#def hasnum(ticker_input_str):
-#    '''
-#    Checks string for presence of numeric character
-#    '''
-#    return any(char.isdigit() for char in ticker_input_str)
+INPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'input')
+
+# Accepted column names (case-insensitive) of position files.  Extra columns, like
+# id, account, lot or date columns of brokerage exports, are ignored.
+TICKER_COLUMNS = ['tck', 'ticker', 'symbol']
+QTY_COLUMNS = ['qty', 'quantity', 'shares']
+ACCOUNT_COLUMNS = ['account', 'account_id', 'acct']
+
+# One to six letters or digits starting with a letter, with an optional share class
+# suffix like BRK.B or BF-B
+TICKER_PATTERN = re.compile(r'^[A-Z][A-Z0-9]{0,5}([.-][A-Z0-9]{1,2})?$')
+
+# Invalid rows listed by portfolio_import() before the rest are summarized
+MAX_LISTED_ERRORS = 10
+
+
+def normalize_ticker(value):
+    '''
+    Normalizes a ticker from a position file.
+
+    Param: value (str) like ' brk/b '
+
+    Example: normalize_ticker(' brk/b ')
+
+    Returns: BRK.B, or None if the value is not a valid ticker
+    '''
+    tkr = value.strip().upper().lstrip('$').replace('/', '.')
+
+    return tkr if TICKER_PATTERN.match(tkr) else None
+
+
+def parse_qty(value):
+    '''
+    Parses a share quantity from a position file (thousands separators and accounting
+    style negatives are accepted).
+
+    Param: value (str) like '1,250.5' or '(10)'
+
+    Returns: float, or None if the value is not a finite number
+    '''
+    text = value.strip().replace(',', '')
+    if text.startswith('(') and text.endswith(')'):
+        text = f'-{text[1:-1]}'
+    try:
+        qty = float(text)
+    except ValueError:
+        return None
+
+    return qty if math.isfinite(qty) else None
+
+
+class Holdings:
+    '''
+    Share quantities by ticker, with every row of a position file merged into one
+    position per ticker.
+
+    Tickers are numbered in the order they first appear: index maps a ticker to its
+    position (an O(1) lookup), tickers lists them by position and qty holds their
+    quantities in a typed float array.  Rows are added one at a time, so a file is
+    never held in memory, only one entry per ticker.
+
+    Example: holdings = load_holdings('sample.csv'); holdings.quantity('AZO')
+    '''
+
+    def __init__(self):
+        self.index = {}
+        self.tickers = []
+        self.qty = array('d')
+        self.accounts = set()
+        self.rows = 0
+        self.errors = []
+
+    @classmethod
+    def from_portfolio(cls, portfolio):
+        '''
+        Merges a portfolio (list of dict with tck and qty keys) into holdings (tickers are used as they are).
+        '''
+        holdings = cls()
+        for p in portfolio:
+            holdings.add(p['tck'], float(p['qty']))
+
+        return holdings
+
+    def add(self, tkr, qty):
+        pos = self.index.get(tkr)
+        if pos is None:
+            pos = self.index[tkr] = len(self.tickers)
+            self.tickers.append(tkr)
+            self.qty.append(0.0)
+        self.qty[pos] += qty
+        self.rows += 1
+
+    def quantity(self, tkr):
+        '''
+        Returns: total share quantity of a ticker (0 if it is not held)
+        '''
+        pos = self.index.get(tkr)
+
+        return 0.0 if pos is None else self.qty[pos]
+
+    def to_numpy(self):
+        '''
+        Returns: tickers (numpy str array) and quantities (numpy float64 array, a view of qty)
+        '''
+        import numpy as np
+
+        return np.array(self.tickers, dtype=str), np.frombuffer(self.qty, dtype='float64')
+
+    def portfolio(self):
+        '''
+        Returns: one dictionary with tck and qty keys per position (positions that net
+        to zero shares are left out)
+        '''
+        return [{'tck': t, 'qty': q} for t, q in zip(self.tickers, self.qty) if q != 0]
+
+    def __len__(self):
+        return len(self.tickers)
+
+
+def _find_column(header, names):
+    for i, column in enumerate(header):
+        if column.strip().lower() in names:
+            return i
+    return None
+
+
+def load_holdings(file_name):
+    '''
+    Streams a position file from the input folder into Holdings.
+
+    The file needs a ticker column (tck, ticker or symbol) and a quantity column
+    (qty, quantity or shares).  Files may hold several rows per ticker, for example
+    one per account or tax lot; their quantities are added up.  Rows with an invalid
+    ticker or quantity are skipped and recorded in holdings.errors as (line, message).
+
+    Param: file_name (str) like 'sample.csv', relative to the input folder
+
+    Returns: Holdings
+    '''
+    filepath = os.path.join(INPUT_DIR, file_name)
+    holdings = Holdings()
+
+    with open(filepath, 'r', newline='', encoding='utf-8-sig') as csv_file:
+        reader = csv.reader(csv_file)
+        header = next(reader, [])
+        tck_col = _find_column(header, TICKER_COLUMNS)
+        qty_col = _find_column(header, QTY_COLUMNS)
+        account_col = _find_column(header, ACCOUNT_COLUMNS)
+
+        if tck_col is None or qty_col is None:
+            raise ValueError(f'{file_name} needs a ticker column ({", ".join(TICKER_COLUMNS)}) '
+                             f'and a quantity column ({", ".join(QTY_COLUMNS)})')
+
+        # Position files repeat the same tickers, so each spelling is normalized once
+        normalized = {}
+        min_len = max(tck_col, qty_col) + 1
+
+        for line, row in enumerate(reader, start=2):
+            if len(row) < min_len:
+                if any(value.strip() for value in row):
+                    holdings.errors.append((line, 'missing values'))
+                continue
+
+            raw = row[tck_col]
+            tkr = normalized.get(raw, '')
+            if tkr == '':
+                tkr = normalized[raw] = normalize_ticker(raw)
+            try:
+                qty = float(row[qty_col])
+                if not math.isfinite(qty):
+                    qty = None
+            except ValueError:
+                qty = parse_qty(row[qty_col])
+
+            if tkr is None and qty is None and not any(value.strip() for value in row):
+                continue
+            if tkr is None:
+                holdings.errors.append((line, f'invalid ticker {row[tck_col]!r}'))
+            elif qty is None:
+                holdings.errors.append((line, f'invalid quantity {row[qty_col]!r} for {tkr}'))
+            else:
+                holdings.add(tkr, qty)
+                if account_col is not None and account_col < len(row):
+                    holdings.accounts.add(row[account_col].strip())
+
+    return holdings
 
 
 def portfolio_import(file_name):
+    '''
+    Imports a portfolio from a position file in the input folder (see load_holdings()),
+    with one position per ticker.
 
-    filepath = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'input', file_name)
+    Param: file_name (str) like 'sample.csv'
 
-    port_import = []
+    Example: portfolio_import('sample.csv')
 
-    with open(filepath, 'r') as csv_file:
-        reader = csv.DictReader(csv_file)
-        for row in reader:
-            port_import.append(dict(row))
+    Returns: list of dict with tck (str) and qty (float) keys
+    '''
+    holdings = load_holdings(file_name)
 
-    #TODO: Data validation on input data
+    if len(holdings.errors) > 0:
+        print('-----------------------------------------------', flush=True)
+        print(f'WARNING! SKIPPED {len(holdings.errors)} INVALID ROW(S) IN {file_name}:', flush=True)
+        for line, message in holdings.errors[:MAX_LISTED_ERRORS]:
+            print(f'----line {line}: {message}', flush=True)
+        if len(holdings.errors) > MAX_LISTED_ERRORS:
+            print(f'----and {len(holdings.errors) - MAX_LISTED_ERRORS} more', flush=True)
+        print('-----------------------------------------------', flush=True)
 
-    return port_import
+    return holdings.portfolio()
 
 
 if __name__ == '__main__':
 
+    load_dotenv()
     file_name = os.getenv('PORTFOLIO_FILE_NAME', default='sample.csv')
 
-    portfolio_import(file_name)
+    holdings = load_holdings(file_name)
+    print(f'{holdings.rows} row(s), {len(holdings)} position(s), {len(holdings.accounts)} account(s), '
+          f'{len(holdings.errors)} invalid row(s)', flush=True)
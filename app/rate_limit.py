@@ -0,0 +1,111 @@
+# rate_limit.py
+
+# IMPORT PACKAGES
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# FUNCTIONS
+
+class TokenBucket:
+    '''
+    Thread-safe token bucket enforcing a per-minute and a per-day call quota.
+
+    Each token is handed back to the bucket one minute (or one day) after it is
+    spent, so the bucket never allows more than per_minute calls in any rolling
+    60 second window.  Calls go out as soon as a token is available instead of
+    waiting for a fixed batch delay.
+
+    Param: per_minute (int) like 5, per_day (int) like 500
+
+    Example: bucket = TokenBucket(5, 500); bucket.acquire()
+    '''
+
+    def __init__(self, per_minute=5, per_day=500):
+        self.per_minute = per_minute
+        self.per_day = per_day
+        self.minute_calls = deque()
+        self.day_calls = deque()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def _wait_time(self, now):
+        '''
+        Returns the number of seconds until a token is available (0 if one is available now).
+        '''
+        while self.minute_calls and now - self.minute_calls[0] >= 60:
+            self.minute_calls.popleft()
+        while self.day_calls and now - self.day_calls[0] >= 86400:
+            self.day_calls.popleft()
+
+        wait = max(self.blocked_until - now, 0)
+        if len(self.minute_calls) >= self.per_minute:
+            wait = max(wait, self.minute_calls[0] + 60 - now)
+        if len(self.day_calls) >= self.per_day:
+            wait = max(wait, self.day_calls[0] + 86400 - now)
+
+        return wait
+
+    def acquire(self):
+        '''
+        Blocks until a token is available and then spends it.
+        '''
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                wait = self._wait_time(now)
+                if wait <= 0:
+                    self.minute_calls.append(now)
+                    self.day_calls.append(now)
+                    return
+            time.sleep(wait)
+
+    def backoff(self, seconds):
+        '''
+        Stops handing out tokens for the given number of seconds (used when the API
+        reports that the quota has been exceeded).
+        '''
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+def throttled_map(fetch, keys, bucket, is_throttled=None, max_workers=None, max_retries=3, backoff=60):
+    '''
+    Runs fetch(key) for every key concurrently, spending one bucket token per call.
+
+    If is_throttled(result) is True the bucket backs off (doubling the delay on
+    each retry) and the key is retried, up to max_retries times.  The last
+    result is kept when the retries are exhausted so the caller can report it.
+
+    Param: fetch (function), keys (list), bucket (TokenBucket), is_throttled (function or None)
+
+    Example: throttled_map(get_ticker, ['AZO', 'HD'], TokenBucket(5, 500))
+
+    Returns: dictionary of {key: result}
+    '''
+    if max_workers is None:
+        max_workers = max(1, min(len(keys), bucket.per_minute))
+
+    def run(key):
+        delay = backoff
+        for attempt in range(max_retries + 1):
+            bucket.acquire()
+            result = fetch(key)
+            if is_throttled is None or not is_throttled(result) or attempt == max_retries:
+                return result
+            bucket.backoff(delay)
+            delay = delay * 2
+        return result
+
+    results = {}
+    if len(keys) == 0:
+        return results
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(run, key): key for key in keys}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+
+    return results
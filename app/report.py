@@ -0,0 +1,261 @@
+# report.py
+
+# IMPORT PACKAGES
+
+import os
+import webbrowser
+from concurrent.futures import ProcessPoolExecutor
+import plotly.io as pio
+import plotly.graph_objects as go
+from plotly.offline import get_plotlyjs
+from plotly.subplots import make_subplots
+
+from app.instrument import stage
+
+# FUNCTIONS
+
+REPORT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'reports')
+
+AXIS_FONT = dict(size=16, family='Times New Roman')
+TICK_FONT = dict(size=12, family='Times New Roman')
+
+
+def report_format():
+    '''
+    Returns the report output (REPORT_FORMAT): 'html' (default), 'png' or 'browser'
+    (html files opened in the browser once written).
+    '''
+    fmt = os.environ.get('REPORT_FORMAT', 'html').lower()
+    if fmt not in ('html', 'png', 'browser'):
+        raise ValueError(f"REPORT_FORMAT must be 'html', 'png' or 'browser', not '{fmt}'")
+
+    return fmt
+
+
+def report_workers():
+    '''
+    Returns the number of background rendering processes (REPORT_WORKERS, default 2;
+    0 renders in the main process).
+    '''
+    return int(os.environ.get('REPORT_WORKERS', 2))
+
+
+def to_pct(dec):
+    '''
+    Converts a numeric value to formatted string for printing and display purposes.
+
+    Param: dec (int or float) like 0.403321
+
+    Example: to_pct(0.403321)
+
+    Returns: 40.33%
+    '''
+    return f'{dec:.2%}'
+
+
+def two_dec(dec):
+    '''
+    Converts a numeric value to formatted string for printing and display purposes.
+
+    Param: dec (int or float) like 4000.444444
+
+    Example: two_dec(4000.444444)
+
+    Returns: 4,000.44
+    '''
+    return f'{dec:,.2f}'
+
+
+def pd_describe(mon_len):
+    '''
+    Converts a specified number of months to a text description of years and months.
+
+    Param: mon_len (int) like 17
+
+    Example: mon_len(17)
+
+    Returns: 1 Year and 5 Months
+    '''
+    full_years = int(mon_len / 12)
+    resid_months = mon_len % 12
+
+    if (full_years > 0 and resid_months > 0):
+        join_str = ' and '
+    else:
+        join_str = ''
+
+    if full_years == 0:
+        yr_str = ''
+    elif full_years == 1:
+        yr_str = f'{full_years} Year'
+    else:
+        yr_str = f'{full_years} Years'
+
+    if resid_months == 0:
+        mon_str = ''
+    elif resid_months == 1:
+        mon_str = f'{resid_months} Month'
+    else:
+        mon_str=f'{resid_months} Months'
+
+    pd_detail=f'{yr_str}{join_str}{mon_str}'
+
+    return pd_detail
+
+
+def report_template():
+    '''
+    Builds the report figure layout without data: a results table above a chart of
+    portfolio and S&P 500 cumulative returns.  Fill it with fill_report().
+
+    Returns: plotly Figure (traces 0 and 1 are the return lines, trace 2 the table)
+    '''
+    fig = make_subplots(rows=2, cols=1, vertical_spacing=0.03, row_width=[0.75,0.25], specs=[[{'type':'table'}], [{'type':'scatter'}]])
+    fig.add_trace(go.Scatter(x=[], y=[], name='Portfolio Cumulative Return', line=dict(color='firebrick', width=4)), row=2, col=1)
+    fig.add_trace(go.Scatter(x=[], y=[], name='S&P 500 Cumulative Return', line=dict(color='royalblue', width=4)), row=2, col=1)
+    fig.add_trace(go.Table(header=dict(values=['Statistic', 'Portfolio', 'S&P 500']), cells=dict(values=[[], [], []])), row=1, col=1)
+
+    fig.update_layout(title=dict(font=dict(family='Times New Roman', size=20)))
+    fig.update_layout(xaxis=dict(title=dict(text='Month', font=AXIS_FONT), ticks='outside', tickfont=TICK_FONT))
+    fig.update_layout(yaxis=dict(title=dict(text='Cumulative Monthly Returns (%)', font=AXIS_FONT), ticks='outside', tickfont=TICK_FONT, tickformat='.1%'))
+    fig.update_layout(legend=dict(orientation='h', font=AXIS_FONT))
+
+    return fig
+
+
+def fill_report(fig, ret_calc, tot_ret_dict):
+    '''
+    Replaces the data of a report_template() figure in place (the layout is kept).
+
+    Param: fig (plotly Figure), ret_calc (dict) and tot_ret_dict (dict) as returned by returns()
+
+    Returns: the same plotly Figure
+    '''
+    with stage('figure', years=ret_calc['years_tgt']) as rec:
+        col1 = ['Avg. Annual Return', 'Std. Dev. (Ann.)', 'Sharpe Ratio', 'Beta']
+        col2 = [to_pct(ret_calc['ann_ret']), to_pct(ret_calc['ann_sdev']), two_dec(ret_calc['sharpe_port']), two_dec(ret_calc['beta'])]
+        col3 = [to_pct(ret_calc['ann_spret']), to_pct(ret_calc['ann_sp_sdev']), two_dec(ret_calc['sharpe_sp']), two_dec(1.00)]
+
+        with fig.batch_update():
+            fig.data[0].update(x=tot_ret_dict['month'], y=tot_ret_dict['cum ret'])
+            fig.data[1].update(x=tot_ret_dict['month'], y=tot_ret_dict['cum spret'])
+            fig.data[2].cells.values = [col1, col2, col3]
+            fig.layout.title.text = f'Portfolio Performance Report: Monthly Returns over Last {pd_describe(ret_calc["months_act"])}'
+        rec['rows'] = len(tot_ret_dict['month'])
+
+    return fig
+
+
+def period_figure(ret_calc, tot_ret_dict):
+    '''
+    Builds the report figure for one analysis period.
+
+    Param: ret_calc (dict) and tot_ret_dict (dict) as returned by returns()
+
+    Returns: plotly Figure
+    '''
+    return fill_report(report_template(), ret_calc, tot_ret_dict)
+
+
+def write_plotlyjs(output_dir):
+    '''
+    Writes the plotly.js bundle shared by the html reports of a directory (once).
+    '''
+    bundle_path = os.path.join(output_dir, 'plotly.min.js')
+    if not os.path.exists(bundle_path):
+        with open(f'{bundle_path}.tmp', 'w', encoding='utf-8') as bundle_file:
+            bundle_file.write(get_plotlyjs())
+        os.replace(f'{bundle_path}.tmp', bundle_path)
+
+
+def render_file(fig_dict, path, fmt):
+    '''
+    Writes one report figure (as a dictionary, see Figure.to_dict()) to an html or png file.
+
+    Returns: path of the written file
+    '''
+    with stage('figure render', file=os.path.basename(path)) as rec:
+        if fmt == 'png':
+            pio.write_image(fig_dict, path, format='png', width=1200, height=900, validate=False)
+        else:
+            # The plotly.js bundle is referenced from the report directory (see write_plotlyjs)
+            pio.write_html(fig_dict, path, include_plotlyjs='directory', validate=False, auto_open=False)
+        rec['bytes'] = os.path.getsize(path)
+
+    return path
+
+
+class ReportRenderer:
+    '''
+    Writes report figures to files in the background.
+
+    One figure template is kept and its data are replaced for every report, so the
+    layout is built once.  Each filled figure is handed to a pool of rendering
+    processes as a dictionary, and the next portfolio or period can be calculated
+    while earlier reports are written.  Html reports share one plotly.js bundle in
+    the report directory.  Png reports need the optional kaleido package.
+
+    Param: output_dir (str or None for data/reports), fmt ('html', 'png', 'browser' or None
+    for REPORT_FORMAT), workers (int or None for REPORT_WORKERS)
+
+    Example: with ReportRenderer() as renderer: renderer.submit(ret_calc, tot_ret_dict, 'sample-1y')
+    '''
+
+    def __init__(self, output_dir=None, fmt=None, workers=None):
+        self.output_dir = output_dir or REPORT_DIR
+        self.fmt = fmt or report_format()
+        self.workers = report_workers() if workers is None else workers
+
+        if self.fmt == 'png':
+            try:
+                import kaleido  # noqa: F401
+            except ImportError:
+                raise ValueError('Png reports need the kaleido package (pip install kaleido)')
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        if self.fmt != 'png':
+            write_plotlyjs(self.output_dir)
+
+        self.template = report_template()
+        self.executor = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 0 else None
+        self.pending = []
+
+    def submit(self, ret_calc, tot_ret_dict, name):
+        '''
+        Fills the template for one analysis period and queues it for rendering.
+
+        Param: ret_calc (dict) and tot_ret_dict (dict) as returned by returns(), name (str)
+        file name without extension like 'sample-1y'
+        '''
+        extension = 'png' if self.fmt == 'png' else 'html'
+        path = os.path.join(self.output_dir, f'{name}.{extension}')
+        fig_dict = fill_report(self.template, ret_calc, tot_ret_dict).to_dict()
+
+        if self.executor is None:
+            self.pending.append(render_file(fig_dict, path, self.fmt))
+        else:
+            self.pending.append(self.executor.submit(render_file, fig_dict, path, self.fmt))
+
+    def close(self):
+        '''
+        Waits for the queued reports (and opens them in the browser in 'browser' format).
+
+        Returns: list of written file paths in submission order
+        '''
+        paths = [p if isinstance(p, str) else p.result() for p in self.pending]
+        self.pending = []
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+        if self.fmt == 'browser':
+            for path in paths:
+                webbrowser.open(f'file://{os.path.abspath(path)}')
+
+        return paths
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
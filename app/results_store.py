@@ -0,0 +1,295 @@
+# results_store.py
+
+# IMPORT PACKAGES
+
+import json
+import math
+import os
+import sys
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+from app.returns_engine import ReturnsPanel, monthly_values
+from app.ingest import ingest
+from app.store import store_read
+from app.portfolio_import import portfolio_import
+from app import APP_ENV
+
+# FUNCTIONS
+
+STATE_VERSION = 1
+
+STATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'state')
+
+# Running sums kept for each analysis period: portfolio (r), S&P 500 (s) and risk
+# free (f) monthly returns, their squares and cross products, and log growth
+SUM_KEYS = ['r', 's', 'f', 'rr', 'ss', 'ff', 'rs', 'rf', 'sf', 'log_r', 'log_s']
+
+
+def _terms(r, s, f):
+    return {'r': r, 's': s, 'f': f, 'rr': r * r, 'ss': s * s, 'ff': f * f, 'rs': r * s, 'rf': r * f, 'sf': s * f,
+            'log_r': math.log1p(r), 'log_s': math.log1p(s)}
+
+
+def _sdev(n, total, squares):
+    if n < 2:
+        return float('nan')
+    return math.sqrt(max(squares - total * total / n, 0) / (n - 1))
+
+
+def _cov(n, total_x, total_y, products):
+    if n < 2:
+        return float('nan')
+    return (products - total_x * total_y / n) / (n - 1)
+
+
+def _mean(n, total):
+    if n < 1:
+        return float('nan')
+    return total / n
+
+
+def _growth_rate(cum, periods):
+    if periods <= 0:
+        return float('nan')
+    return cum**(1 / periods) - 1
+
+
+def _last_month(panel, qty, spy_join, fred_join):
+    '''
+    Position of the latest month with portfolio, S&P 500 and risk free data, so a
+    month that has only partly arrived is never added to the running sums.
+    '''
+    first, last = panel.window(qty[:, None])
+    months = panel.months[:int(last[0]) + 1]
+    known = np.isfinite(monthly_values(spy_join, months, 'spret')) & np.isfinite(monthly_values(fred_join, months, 'rate'))
+    known[:int(first[0]) + 1] = True
+
+    return int(np.flatnonzero(known)[-1]) if known.all() else int(np.flatnonzero(~known)[0]) - 1
+
+
+def new_state(panel, qty, spy_join, fred_join, periods=[1, 2, 3, 5]):
+    '''
+    Builds the incremental results state of one portfolio.
+
+    Each analysis period keeps its trailing window of monthly (portfolio, S&P 500,
+    risk free) returns together with running sums, products (as log sums), sums of
+    squares and cross products, plus the current value of every position.  The
+    window of each period starts where the full report would start it today.
+
+    Param: panel (ReturnsPanel), qty (array of share quantities by ticker), spy_join,
+    fred_join, periods (list of years)
+
+    Returns: state (dict)
+    '''
+    first = int(panel.window(qty[:, None])[0][0])
+    last = _last_month(panel, qty, spy_join, fred_join)
+
+    state = {'version': STATE_VERSION, 'tickers': list(panel.tickers), 'qty': list(qty),
+             'last_month': str(panel.months[last]), 'periods': []}
+
+    for years in periods:
+        start = max(last - years * 12, first)
+        pos_val = np.nan_to_num(qty * panel.close[start])
+        state['periods'].append({'years_tgt': years, 'anchor': str(panel.months[start]), 'pos_val': list(pos_val),
+                                 'value': float(pos_val.sum()), 'window': [],
+                                 'sums': {k: 0.0 for k in SUM_KEYS}})
+
+    # Feed the months of each period's window in through the same update step
+    for p in state['periods']:
+        _advance(p, panel, spy_join, fred_join, panel.month_index(_period(p['anchor'], panel)), last)
+
+    return state
+
+
+def _period(month_str, panel):
+    return panel.months[panel.months.astype(str).get_loc(month_str)]
+
+
+def _advance(p, panel, spy_join, fred_join, start, end):
+    '''
+    Adds the months after position start up to end to one period's state (O(1) per month).
+    '''
+    months = panel.months[start + 1:end + 1]
+    spret = monthly_values(spy_join, months, 'spret')
+    rate = monthly_values(fred_join, months, 'rate')
+    growth = panel.cumret[start + 1:end + 1] / panel.cumret[start:end]
+
+    pos_val = np.array(p['pos_val'])
+    window = p['window']
+    sums = p['sums']
+    size = p['years_tgt'] * 12
+
+    for t in range(len(months)):
+        pos_val = pos_val * growth[t]
+        value = float(pos_val.sum())
+        r = value / p['value'] - 1
+        p['value'] = value
+
+        # Add the new month and drop the oldest one once the window is full
+        for k, v in _terms(r, float(spret[t]), float(rate[t])).items():
+            sums[k] += v
+        window.append([str(months[t]), r, float(spret[t]), float(rate[t])])
+
+        if len(window) > size:
+            old = window.pop(0)
+            for k, v in _terms(old[1], old[2], old[3]).items():
+                sums[k] -= v
+
+    p['pos_val'] = list(pos_val)
+
+
+def update_state(state, panel, spy_join, fred_join):
+    '''
+    Adds the months that arrived since the state was last updated.  Only the new
+    months are read from the panel, and each one costs the same whatever the
+    length of the history.
+
+    Windows slide by chain-linking monthly returns, while the full report values
+    the holdings at the close price of the new start month and grows them with
+    adjusted closes.  The two drift apart through dividends and splits in the
+    dropped months (the start values then use prices on another share basis);
+    verify_state() measures the difference.
+
+    Returns: number of months added
+    '''
+    last_month = _period(state['last_month'], panel)
+    start = panel.month_index(last_month)
+    end = _last_month(panel, np.array(state['qty']), spy_join, fred_join)
+    if end <= start:
+        return 0
+
+    for p in state['periods']:
+        _advance(p, panel, spy_join, fred_join, start, end)
+    state['last_month'] = str(panel.months[end])
+
+    return end - start
+
+
+def state_results(state):
+    '''
+    Calculates the performance measures of every analysis period from the running sums.
+
+    Returns: list of results dictionaries (same keys as ReturnsPanel.returns())
+    '''
+    results = []
+    for p in state['periods']:
+        sums = p['sums']
+        n = len(p['window'])
+        years = n / 12
+        cum_ret = math.exp(sums['log_r'])
+        cum_spret = math.exp(sums['log_s'])
+
+        # Like ReturnsPanel.returns(), measures that need more months than the window has are nan
+        mon_sdev = _sdev(n, sums['r'], sums['rr'])
+        mon_sp_sdev = _sdev(n, sums['s'], sums['ss'])
+        var_s = _cov(n, sums['s'], sums['s'], sums['ss'])
+        cov_rs = _cov(n, sums['r'], sums['s'], sums['rs'])
+
+        # Excess returns over the risk free rate: (r - f) and (s - f)
+        ex = sums['r'] - sums['f']
+        ex2 = sums['rr'] - 2 * sums['rf'] + sums['ff']
+        exs = sums['s'] - sums['f']
+        exs2 = sums['ss'] - 2 * sums['sf'] + sums['ff']
+
+        # The window holds returns, so the analysis period starts the month before the first one
+        # (an empty window is a period that starts and ends at its anchor month)
+        if n > 0:
+            st_date, end_date = str(pd.Period(p['window'][0][0], 'M') - 1), p['window'][-1][0]
+        else:
+            st_date, end_date = p['anchor'], p['anchor']
+
+        results.append({'years_tgt': p['years_tgt'], 'years_act': years, 'months_act': n,
+                        'st_date': st_date, 'end_date': end_date,
+                        'ann_ret': _growth_rate(cum_ret, years), 'mon_ret': _growth_rate(cum_ret, n),
+                        'ann_sdev': mon_sdev * (12 ** .5), 'mon_sdev': mon_sdev,
+                        'ann_spret': _growth_rate(cum_spret, years), 'mon_spret': _growth_rate(cum_spret, n),
+                        'ann_sp_sdev': mon_sp_sdev * (12 ** .5), 'mon_sp_sdev': mon_sp_sdev,
+                        'beta': cov_rs / var_s,
+                        'sharpe_port': _mean(n, ex) / _sdev(n, ex, ex2) * (12 ** .5),
+                        'sharpe_sp': _mean(n, exs) / _sdev(n, exs, exs2) * (12 ** .5)})
+
+    return results
+
+
+def verify_state(state, panel, spy_join, fred_join):
+    '''
+    Full recompute (verification mode): calculates every period with
+    ReturnsPanel.returns() over the window held in the state and compares the
+    results with the running state.
+
+    Returns: largest absolute difference across all performance measures
+    '''
+    qty = np.array(state['qty'])
+    end = _period(state['last_month'], panel)
+
+    diff = 0.0
+    for p, a in zip(state['periods'], state_results(state)):
+        b, _, _ = panel.returns(p['years_tgt'], spy_join, fred_join, pd.Period(a['st_date'], 'M'), end, qty)
+        for k, v in a.items():
+            if isinstance(v, float) and not (math.isnan(v) and math.isnan(b[k])):
+                diff = max(diff, abs(v - b[k]))
+
+    return diff
+
+
+def state_path(name):
+    return os.path.join(STATE_DIR, f'{name}.json')
+
+
+def save_state(state, name):
+    os.makedirs(STATE_DIR, exist_ok=True)
+    with open(f'{state_path(name)}.tmp', 'w') as state_file:
+        json.dump(state, state_file)
+    os.replace(f'{state_path(name)}.tmp', state_path(name))
+
+
+def load_state(name):
+    '''
+    Returns: saved state (dict) or None if there is none (or it has another version)
+    '''
+    if not os.path.exists(state_path(name)):
+        return None
+    with open(state_path(name), 'r') as state_file:
+        state = json.load(state_file)
+    return state if state.get('version') == STATE_VERSION else None
+
+
+if __name__ == '__main__':
+
+    # Load environment variables
+    load_dotenv()
+    port_file_name = os.environ.get('PORTFOLIO_FILE_NAME')
+    ap_api_key = os.environ.get('ALPHAVANTAGE_API_KEY')
+    fred_api_key = os.environ.get('FRED_API_KEY')
+    name = os.path.splitext(port_file_name)[0]
+    verify = 'verify' in sys.argv[1:]
+
+    if APP_ENV == 'development':
+        sub = store_read('working_port')
+        spy_join = store_read('working_spy').set_index('month')
+        fred_join = store_read('working_fred').set_index('month')
+
+    else:
+        # Cached series are only downloaded again once they are stale (see cache.py)
+        spy_join, fred_join, sub, minomax, maxomin = ingest(portfolio_import(port_file_name), ap_api_key, fred_api_key)
+
+    panel = ReturnsPanel(sub)
+
+    state = load_state(name)
+    if state is None or state['tickers'] != list(panel.tickers) or state['qty'] != [float(q) for q in panel.qty]:
+        state = new_state(panel, panel.qty, spy_join, fred_join)
+        print(f'Built results state for {name} through {state["last_month"]}.', flush=True)
+    else:
+        added = update_state(state, panel, spy_join, fred_join)
+        print(f'Added {added} month(s) to the results state for {name} (now through {state["last_month"]}).', flush=True)
+
+    save_state(state, name)
+
+    for r in state_results(state):
+        print(f"{r['years_tgt']}Y ({r['st_date']} to {r['end_date']}): return {r['ann_ret']:.2%}, "
+              f"std. dev. {r['ann_sdev']:.2%}, sharpe {r['sharpe_port']:.2f}, beta {r['beta']:.2f}", flush=True)
+
+    if verify:
+        print(f'Verification (full recompute) max difference: {verify_state(state, panel, spy_join, fred_join):.3g}', flush=True)
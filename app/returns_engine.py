@@ -0,0 +1,380 @@
+# returns_engine.py
+
+# IMPORT PACKAGES
+
+import numpy as np
+import pandas as pd
+
+from app.instrument import stage
+from app.panel import CompactPanel, ffill_rows
+from app.benchmark_index import BenchmarkIndex
+
+# FUNCTIONS
+
+def nan_std(x):
+    '''
+    Sample standard deviation down each column, ignoring missing values (same as
+    pandas Series.std()).  Columns with fewer than two values give nan.
+    '''
+    keep = np.isfinite(x)
+    n = keep.sum(axis=0)
+    mean = np.where(keep, x, 0).sum(axis=0) / np.maximum(n, 1)
+    ss = np.where(keep, (x - mean)**2, 0).sum(axis=0)
+    return np.where(n > 1, np.sqrt(ss / np.maximum(n - 1, 1)), np.nan)[()]
+
+
+def nan_mean(x):
+    '''
+    Mean down each column, ignoring missing values.
+    '''
+    keep = np.isfinite(x)
+    n = keep.sum(axis=0)
+    return np.where(n > 0, np.where(keep, x, 0).sum(axis=0) / np.maximum(n, 1), np.nan)[()]
+
+
+def nan_cov(x, y):
+    '''
+    Sample covariance down each column over the months where both series have values
+    (same as the pairwise covariance of pandas DataFrame.cov()).
+    '''
+    x, y = np.broadcast_arrays(x, y)
+    keep = np.isfinite(x) & np.isfinite(y)
+    n = keep.sum(axis=0)
+    x_mean = np.where(keep, x, 0).sum(axis=0) / np.maximum(n, 1)
+    y_mean = np.where(keep, y, 0).sum(axis=0) / np.maximum(n, 1)
+    cp = np.where(keep, (x - x_mean) * (y - y_mean), 0).sum(axis=0)
+    return np.where(n > 1, cp / np.maximum(n - 1, 1), np.nan)[()]
+
+
+def period_stats(start_val, mon_val, spret, rate, bench=None):
+    '''
+    Calculates portfolio and S&P 500 performance measures for one analysis period.
+
+    Works on several portfolios at once: each column of mon_val is one portfolio.
+
+    Param: start_val (array of P starting values), mon_val (months x P array of portfolio
+    values), spret (array of S&P 500 monthly returns), rate (array of monthly risk free rates),
+    bench (dictionary of precomputed S&P 500 measures from BenchmarkIndex.stats() with a
+    cum_spret array, or None to calculate them from spret and rate)
+
+    Returns: dictionary of monthly arrays and performance measures (arrays of P values
+    for portfolio measures, floats for S&P 500 measures)
+    '''
+    # Calculate monthly returns on the total portfolio over time
+    cum_ret = mon_val / start_val
+    mon_ret = np.empty_like(mon_val)
+    mon_ret[0] = cum_ret[0] - 1
+    mon_ret[1:] = mon_val[1:] / mon_val[:-1] - 1
+
+    # Calculate S&P 500 cumulative return over analysis period
+    if bench is not None:
+        cum_spret = bench['cum_spret']
+    else:
+        cum_spret = np.cumprod(np.nan_to_num(spret, nan=0.0) + 1)
+        cum_spret[np.isnan(spret)] = np.nan
+
+    # Calculate portfolio and S&P 500 excess returns over risk free rate
+    exret = mon_ret - rate[:, None]
+    exspret = spret - rate
+
+    # Calculate average annual and monthly returns
+    months = len(mon_val)
+    years = months / 12
+
+    # Calculate return standard deviations
+    mon_sdev = nan_std(mon_ret)
+
+    if bench is None:
+        mon_sp_sdev = nan_std(spret)
+        bench = {'ann_spret': cum_spret[-1]**(1 / years) - 1, 'mon_spret': cum_spret[-1]**(1 / months) - 1,
+                 'ann_sp_sdev': mon_sp_sdev * (12 ** .5), 'mon_sp_sdev': mon_sp_sdev, 'var_s': nan_cov(spret, spret),
+                 'sharpe_sp': (nan_mean(exspret) / nan_std(exspret)) * (12 ** .5)}
+
+    return {'cum_ret': cum_ret, 'mon_ret': mon_ret, 'cum_spret': cum_spret, 'exret': exret, 'exspret': exspret,
+            'years_act': years, 'months_act': months,
+            'ann_ret': cum_ret[-1]**(1 / years) - 1, 'mon_ret_avg': cum_ret[-1]**(1 / months) - 1,
+            'ann_sdev': mon_sdev * (12 ** .5), 'mon_sdev': mon_sdev,
+            'ann_spret': bench['ann_spret'], 'mon_spret': bench['mon_spret'],
+            'ann_sp_sdev': bench['ann_sp_sdev'], 'mon_sp_sdev': bench['mon_sp_sdev'],
+            # Portfolio beta (covariance of portfolio and S&P 500 divided by volatility of S&P 500)
+            'beta': nan_cov(mon_ret, spret[:, None]) / bench['var_s'],
+            # Sharpe ratios
+            'sharpe_port': (nan_mean(exret) / nan_std(exret)) * (12 ** .5),
+            'sharpe_sp': bench['sharpe_sp']}
+
+
+def benchmark_stats(mon_ret, bench_ret, rate):
+    '''
+    Compares one portfolio with N benchmarks over an analysis period in one pass.
+
+    Param: mon_ret (array of portfolio monthly returns), bench_ret (months x N array of
+    benchmark monthly returns), rate (array of monthly risk free rates)
+
+    Returns: dictionary of arrays with one value per benchmark
+    '''
+    months = len(mon_ret)
+    years = months / 12
+
+    # Like the S&P 500 measures, no cumulative return when the last month is missing
+    cum_bench = np.nancumprod(bench_ret + 1, axis=0)[-1]
+    cum_bench[np.isnan(bench_ret[-1])] = np.nan
+    exbench = bench_ret - rate[:, None]
+    active = mon_ret[:, None] - bench_ret
+    mon_bench_sdev = nan_std(bench_ret)
+
+    return {'ann_bench_ret': cum_bench**(1 / years) - 1, 'ann_bench_sdev': mon_bench_sdev * (12 ** .5),
+            # Portfolio beta against each benchmark
+            'beta': nan_cov(mon_ret[:, None], bench_ret) / nan_cov(bench_ret, bench_ret),
+            'sharpe_bench': (nan_mean(exbench) / nan_std(exbench)) * (12 ** .5),
+            # Average monthly return over each benchmark (annualized) and its volatility
+            'excess_ret': nan_mean(active) * 12, 'tracking_error': nan_std(active) * (12 ** .5)}
+
+
+def json_value(value):
+    '''
+    Converts numpy values (like the measures returned by returns()) to JSON values
+    (missing values become null).
+    '''
+    if isinstance(value, (np.floating, float)):
+        return float(value) if np.isfinite(value) else None
+    if isinstance(value, np.integer):
+        return int(value)
+    return value
+
+
+def monthly_values(series, months, name):
+    '''
+    Aligns a month-indexed Series (or single column DataFrame) to the given months.
+
+    Returns: numpy array with one value per month (nan where the month is missing)
+    '''
+    if isinstance(series, pd.DataFrame):
+        series = series[name]
+    return series.reindex(months).to_numpy(dtype='float64')
+
+
+def benchmark_values(spy_join, fred_join, months):
+    '''
+    Aligns S&P 500 returns and risk free rates to the months of an analysis period.
+
+    spy_join can also be a BenchmarkIndex (see benchmark_index.py), which holds both
+    series: values are then looked up by month position and the S&P 500 measures
+    come from its running sums (fred_join is not used).
+
+    Returns: S&P 500 returns (array), risk free rates (array), precomputed S&P 500
+    measures for period_stats() (dict or None)
+    '''
+    if isinstance(spy_join, BenchmarkIndex):
+        spret, rate = spy_join.values(months)
+        bench = spy_join.stats(months)
+        if bench is not None:
+            bench['cum_spret'] = spy_join.cum_growth(months)
+        return spret, rate, bench
+
+    return monthly_values(spy_join, months, 'spret'), monthly_values(fred_join, months, 'rate'), None
+
+
+class ReturnsPanel:
+    '''
+    Dense month x ticker price matrices built once from the long portfolio dataset.
+
+    Position returns and their cumulative product are computed once for the whole
+    history, so every analysis period is a slice of the precomputed arrays rather
+    than a new groupby/join pipeline.  The input dataset is never modified.
+
+    Param: dataset (DataFrame) like the one returned by port_data_pull, with ticker,
+    qty, close, adj close and month columns (or a CompactPanel, or its compact frame
+    as saved in the store), dividends (bool) to also keep the dividends per share of
+    each month from the div amt column (self.div, used by the ledger)
+
+    Example: panel = ReturnsPanel(sub); panel.returns(3, spy_join, fred_join)
+    '''
+
+    def __init__(self, dataset, dividends=False):
+        with stage('panel build') as rec:
+            # Scatter the dataset straight into month x ticker arrays (see panel.py)
+            columns = ['close', 'adj close', 'div amt'] if dividends else ['close', 'adj close']
+            if not isinstance(dataset, CompactPanel):
+                dataset = CompactPanel.from_dataset(dataset, 'float64', columns)
+            months, tickers, dense = dataset.dense(columns)
+
+            # First and last month with data for each position
+            has_data = ~np.isnan(dense['adj close'])
+            self.first = has_data.argmax(axis=0)
+            self.last = len(has_data) - 1 - has_data[::-1].argmax(axis=0)
+
+            # Fill months missing for a position from the previous month, so the return
+            # over a gap is booked in the month the position reappears
+            self.months = months
+            self.tickers = tickers
+            self.close = ffill_rows(dense['close'])
+            adj = ffill_rows(dense['adj close'])
+
+            self.qty = dataset.qty.copy()
+            self.div = np.nan_to_num(dense['div amt']) if dividends else None
+
+            # Cumulative growth of each position since the first month
+            mretp1 = np.ones_like(adj)
+            mretp1[1:] = adj[1:] / adj[:-1]
+            mretp1[~np.isfinite(mretp1)] = 1
+            self.cumret = np.cumprod(mretp1, axis=0)
+            rec['rows'] = len(dataset)
+
+    @classmethod
+    def from_arrays(cls, months, tickers, close, cumret, first, last, qty):
+        '''
+        Rebuilds a panel from its arrays (for example arrays attached from shared memory
+        in a worker process) without pivoting a dataset again.
+        '''
+        panel = cls.__new__(cls)
+        panel.months = months
+        panel.tickers = tickers
+        panel.close = close
+        panel.cumret = cumret
+        panel.first = first
+        panel.last = last
+        panel.qty = qty
+        panel.div = None
+
+        return panel
+
+    def month_index(self, month):
+        return self.months.get_loc(month)
+
+    def values(self, start, end, qty=None):
+        '''
+        Calculates starting and monthly portfolio values for the months after start up to end.
+
+        Param: start (int) and end (int) positions in self.months, qty (array or None) of
+        share quantities by ticker (defaults to the dataset quantities), or a ticker x
+        portfolio matrix to value several portfolios at once
+
+        Returns: starting portfolio value(s), monthly portfolio values (months x portfolios)
+        '''
+        if qty is None:
+            qty = self.qty
+
+        price = self.close[start] if qty.ndim == 1 else self.close[start][:, None]
+        start_val = np.nan_to_num(qty * price)
+        growth = self.cumret[start + 1:end + 1] / self.cumret[start]
+
+        return start_val.sum(axis=0), growth @ start_val
+
+    def window(self, qty):
+        '''
+        Finds the months covered by every position held in each portfolio (the
+        latest first month and the earliest last month of the held tickers).
+
+        Param: qty (ticker x portfolio matrix of share quantities)
+
+        Returns: arrays of first and last month positions, one per portfolio
+        '''
+        held = qty != 0
+        first = np.where(held, self.first[:, None], 0).max(axis=0)
+        last = np.where(held, self.last[:, None], len(self.months) - 1).min(axis=0)
+
+        return first, last
+
+    def returns(self, period_length, spy_join, fred_join, min_start=None, max_end=None, qty=None, bench_join=None):
+        '''
+        Calculates various portfolio performance measures and prepares data for data visualization.
+
+        With bench_join, the portfolio is also compared with every benchmark in it: each
+        benchmark is one column of a month x benchmark matrix, so adding a benchmark adds
+        a column to the same vectorized calculation (see benchmark_stats()).
+
+        Param: period_length (int) in years like 3, spy_join (S&P 500 monthly returns, or a
+        BenchmarkIndex), fred_join (monthly risk free rates), min_start and max_end (Period or None) to
+        limit the analysis window, qty (array or None) of share quantities by ticker, bench_join
+        (DataFrame of monthly benchmark returns indexed by month, one column per benchmark, or None)
+
+        Returns: results dictionary (with a benchmarks DataFrame of one row of measures per
+        benchmark when bench_join is given), cumulative returns dictionary for charting, monthly DataFrame
+        '''
+        with stage('returns', years=period_length) as rec:
+            if min_start is None:
+                min_start = self.months[0]
+            if max_end is None:
+                max_end = self.months[-1]
+
+            # Define analysis period length.  The most recent first monthly data point for a
+            # given stock in the portfolio becomes the earliest possible analysis start date.
+            pd_len = period_length
+            pd_end = max_end
+            pd_start = max(max_end - (pd_len * 12), min_start)
+
+            start = self.month_index(pd_start)
+            end = self.month_index(pd_end)
+            months = self.months[start + 1:end + 1]
+
+            start_val, mon_val = self.values(start, end, qty)
+
+            # S&P 500 and 1Y constant maturity treasury data from other_data_pull module
+            spret, rate, bench = benchmark_values(spy_join, fred_join, months)
+
+            stats = period_stats(np.atleast_1d(start_val), mon_val.reshape(len(months), -1), spret, rate, bench)
+            cum_ret = stats['cum_ret'][:, 0]
+            mon_ret = stats['mon_ret'][:, 0]
+            exret = stats['exret'][:, 0]
+            cum_spret = stats['cum_spret']
+            exspret = stats['exspret']
+
+            # Assemble dictionary of calculation results
+            ret_calc = {'years_tgt': pd_len, 'years_act': stats['years_act'], 'months_act': stats['months_act'], 'st_date': pd_start.strftime('%Y-%m'),
+                        'end_date': pd_end.strftime('%Y-%m'), 'ann_ret': stats['ann_ret'][0], 'mon_ret': stats['mon_ret_avg'][0], 'ann_sdev': stats['ann_sdev'][0], 'mon_sdev': stats['mon_sdev'][0], 'ann_spret': stats['ann_spret'], 'mon_spret': stats['mon_spret'], 'ann_sp_sdev': stats['ann_sp_sdev'], 'mon_sp_sdev': stats['mon_sp_sdev'], 'beta': stats['beta'][0], 'sharpe_port': stats['sharpe_port'][0], 'sharpe_sp': stats['sharpe_sp']}
+
+            if bench_join is not None:
+                bench_ret = bench_join.reindex(months).to_numpy(dtype='float64')
+                ret_calc['benchmarks'] = pd.DataFrame(benchmark_stats(mon_ret, bench_ret, rate),
+                                                      index=pd.Index(bench_join.columns, name='benchmark'))
+
+            port_ret = pd.DataFrame({'start val': start_val, 'mon val': mon_val, 'cum ret': cum_ret, 'mon ret': mon_ret,
+                                     'spret': spret, 'rate': rate, 'cum spret': cum_spret, 'exret': exret, 'exspret': exspret},
+                                    index=months)
+
+            # Create total (cumulative) returns dataset for data visualization, starting
+            # from 0 in the analysis period start month
+            tot_ret_dict = {'month': [str(pd_start)] + [str(m) for m in months],
+                            'cum ret': [0.0] + list(cum_ret - 1),
+                            'cum spret': [0.0] + list(cum_spret - 1)}
+            rec['rows'] = len(months)
+
+        return ret_calc, tot_ret_dict, port_ret
+
+    def returns_many(self, period_length, spy_join, fred_join, qty):
+        '''
+        Calculates performance measures for many portfolios over one analysis period.
+
+        Each portfolio is analyzed over its own window (see window()).  Portfolios
+        that share a window are valued together with one matrix product.
+
+        Param: period_length (int) in years like 3, spy_join (S&P 500 monthly returns),
+        fred_join (monthly risk free rates), qty (ticker x portfolio matrix of share quantities)
+
+        Returns: DataFrame with one row of results per portfolio (in the column order of qty)
+        '''
+        with stage('returns many', years=period_length, portfolios=qty.shape[1]) as rec:
+            first, last = self.window(qty)
+            start = np.maximum(last - period_length * 12, first)
+
+            rows = [None] * qty.shape[1]
+            for st, en in set(zip(start, last)):
+                cols = np.flatnonzero((start == st) & (last == en))
+                months = self.months[st + 1:en + 1]
+                if len(months) == 0:
+                    continue
+
+                start_val, mon_val = self.values(st, en, qty[:, cols])
+                spret, rate, bench = benchmark_values(spy_join, fred_join, months)
+                stats = period_stats(start_val, mon_val, spret, rate, bench)
+
+                for j, c in enumerate(cols):
+                    rows[c] = {'years_tgt': period_length, 'years_act': stats['years_act'], 'months_act': stats['months_act'],
+                               'st_date': self.months[st].strftime('%Y-%m'), 'end_date': self.months[en].strftime('%Y-%m'),
+                               'ann_ret': stats['ann_ret'][j], 'mon_ret': stats['mon_ret_avg'][j], 'ann_sdev': stats['ann_sdev'][j],
+                               'mon_sdev': stats['mon_sdev'][j], 'ann_spret': stats['ann_spret'], 'mon_spret': stats['mon_spret'],
+                               'ann_sp_sdev': stats['ann_sp_sdev'], 'mon_sp_sdev': stats['mon_sp_sdev'], 'beta': stats['beta'][j],
+                               'sharpe_port': stats['sharpe_port'][j], 'sharpe_sp': stats['sharpe_sp']}
+            rec['rows'] = qty.shape[0] * len(self.months)
+
+        return pd.DataFrame([r if r is not None else {'years_tgt': period_length} for r in rows])
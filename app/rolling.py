@@ -0,0 +1,113 @@
+# rolling.py
+
+# IMPORT PACKAGES
+
+from collections import deque
+import numpy as np
+
+# FUNCTIONS
+
+def window_sums(x, window):
+    '''
+    Sums of x over every trailing window, from one prefix sum (O(1) per step).
+
+    Param: x (array of n values, or n x k array), window (int) like 252
+
+    Returns: array of n - window + 1 window sums (the first one ends at x[window - 1])
+    '''
+    prefix = np.concatenate([np.zeros((1,) + x.shape[1:]), np.cumsum(x, axis=0)])
+
+    return prefix[window:] - prefix[:-window]
+
+
+def rolling_moments(x, y, window):
+    '''
+    Rolling means, sample variances and covariance of two return series.
+
+    Each statistic comes from running sums of x, y, x^2, y^2 and x*y, so every
+    step costs the same no matter how long the window is.  The series are
+    centered first to limit rounding error in the running sums of squares.
+    Days where either series is missing are skipped: the sums and the count of
+    days they cover only include days where both have values.
+
+    Param: x (array), y (array), window (int)
+
+    Returns: dictionary of arrays (mean_x, mean_y, var_x, var_y, cov), one value per
+    window (nan for means with no days and for the others with fewer than two)
+    '''
+    keep = np.isfinite(x) & np.isfinite(y)
+    cx = x[keep].mean() if keep.any() else 0.0
+    cy = y[keep].mean() if keep.any() else 0.0
+    dx = np.where(keep, x - cx, 0.0)
+    dy = np.where(keep, y - cy, 0.0)
+
+    n = window_sums(keep.astype('float64'), window)
+    sx = window_sums(dx, window)
+    sy = window_sums(dy, window)
+    sxx = window_sums(dx * dx, window)
+    syy = window_sums(dy * dy, window)
+    sxy = window_sums(dx * dy, window)
+
+    n1 = np.maximum(n, 1)
+    n2 = np.maximum(n - 1, 1)
+    return {'mean_x': np.where(n > 0, sx / n1 + cx, np.nan), 'mean_y': np.where(n > 0, sy / n1 + cy, np.nan),
+            'var_x': np.where(n > 1, (sxx - sx * sx / n1) / n2, np.nan),
+            'var_y': np.where(n > 1, (syy - sy * sy / n1) / n2, np.nan),
+            'cov': np.where(n > 1, (sxy - sx * sy / n1) / n2, np.nan)}
+
+
+def rolling_peak(values, window):
+    '''
+    Highest value over every trailing window, using a monotonic queue (amortized O(1) per step).
+
+    Param: values (array), window (int)
+
+    Returns: array of the same length as values (windows are shorter at the start)
+    '''
+    peak = np.empty_like(values)
+    queue = deque()
+
+    for t, v in enumerate(values):
+        while queue and values[queue[-1]] <= v:
+            queue.pop()
+        queue.append(t)
+        if queue[0] <= t - window:
+            queue.popleft()
+        peak[t] = values[queue[0]]
+
+    return peak
+
+
+def rolling_stats(port_ret, bench_ret, rate, window, periods_per_year=252):
+    '''
+    Rolling volatility, beta, Sharpe ratios and drawdown of a portfolio.
+
+    Param: port_ret, bench_ret and rate (arrays of periodic portfolio returns, benchmark
+    returns and risk free rates; days with a missing value are left out of the windows
+    that cover them), window (int) number of periods like 252, periods_per_year (int)
+    like 252 for daily data
+
+    Returns: dictionary of arrays, each with one value per period (nan until the
+    first full window)
+    '''
+    n = len(port_ret)
+    out = {k: np.full(n, np.nan) for k in ['vol', 'bench_vol', 'beta', 'sharpe', 'bench_sharpe', 'drawdown', 'max_drawdown']}
+
+    if n >= window:
+        scale = periods_per_year ** .5
+        ret = rolling_moments(port_ret, bench_ret, window)
+        exret = rolling_moments(port_ret - rate, bench_ret - rate, window)
+
+        out['vol'][window - 1:] = np.sqrt(ret['var_x']) * scale
+        out['bench_vol'][window - 1:] = np.sqrt(ret['var_y']) * scale
+        out['beta'][window - 1:] = ret['cov'] / ret['var_y']
+        out['sharpe'][window - 1:] = exret['mean_x'] / np.sqrt(exret['var_x']) * scale
+        out['bench_sharpe'][window - 1:] = exret['mean_y'] / np.sqrt(exret['var_y']) * scale
+
+    # Drawdown from the highest portfolio value within the trailing window, and the
+    # deepest drawdown since the start of the data
+    value = np.cumprod(1 + np.nan_to_num(port_ret))
+    out['drawdown'] = value / rolling_peak(value, window) - 1
+    out['max_drawdown'] = np.minimum.accumulate(value / np.maximum.accumulate(value) - 1)
+
+    return out
@@ -0,0 +1,297 @@
+# service.py
+
+# IMPORT PACKAGES
+
+import datetime
+import json
+import os
+import threading
+import numpy as np
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from dotenv import load_dotenv
+
+from app.ingest import Ingestor
+from app.store import store_read
+from app.returns_engine import ReturnsPanel, json_value
+from app.benchmark_index import BenchmarkIndex
+from app.portfolio_import import portfolio_import
+from app.instrument import stage
+from app import APP_ENV
+
+# FUNCTIONS
+
+def service_address():
+    '''
+    Returns the host and port the service listens on (SERVICE_HOST, default 127.0.0.1,
+    and SERVICE_PORT, default 8765).
+    '''
+    return os.environ.get('SERVICE_HOST', '127.0.0.1'), int(os.environ.get('SERVICE_PORT', 8765))
+
+
+def refresh_minutes():
+    '''
+    Returns the minutes between background data refreshes (SERVICE_REFRESH_MINUTES, default 60).
+    '''
+    return float(os.environ.get('SERVICE_REFRESH_MINUTES', 60))
+
+
+class AnalysisService:
+    '''
+    Keeps the price panel, S&P 500 returns and risk free rates in memory and
+    analyzes holdings lists against them.
+
+    The data are loaded once at start-up and refreshed by a background thread.  A
+    refresh builds a new panel and benchmark index and then swaps them in, so
+    requests never wait for a download and always see one consistent snapshot.
+    Tickers that are not in the panel are reported as missing and added to the
+    tickers downloaded by the next refresh.  The ones that refresh cannot download
+    are dropped again, while the rest of the data are still refreshed.
+
+    Param: ap_api_key (str), fred_api_key (str), tickers (list of str) downloaded on every
+    refresh in production
+
+    Example: service = AnalysisService(ap_api_key, fred_api_key, ['AZO']); service.refresh(); service.analyze(holdings)
+    '''
+
+    def __init__(self, ap_api_key=None, fred_api_key=None, tickers=[]):
+        self.ap_api_key = ap_api_key
+        self.fred_api_key = fred_api_key
+        self.tickers = set(tickers)
+        self.requested = set()
+        self.snapshot = None
+        self.refreshed = None
+        self.refresh_error = None
+        self.excluded = []
+        self.lock = threading.Lock()
+        self.refreshing = threading.Lock()
+        self.stopped = threading.Event()
+
+    def load(self, requested=set()):
+        '''
+        Loads market data: the stored datasets in the development environment,
+        otherwise a download of every ticker the service knows about plus the
+        requested ones.  Tickers that cannot be downloaded are left out of the panel.
+
+        Returns: ReturnsPanel, BenchmarkIndex, list of tickers left out
+        '''
+        excluded = []
+        if APP_ENV == 'development':
+            spy_join = store_read('working_spy').set_index('month')
+            fred_join = store_read('working_fred').set_index('month')
+            compact = store_read('port_panel')
+
+        else:
+            with self.lock:
+                universe = [{'tck': t, 'qty': 0} for t in sorted(self.tickers | requested)]
+            if len(universe) == 0:
+                raise ValueError('No tickers to download yet (analyze a holdings list to add some)')
+            ingestor = Ingestor()
+            spy_join, fred_join, sub, minomax, maxomin = ingestor.run(universe, self.ap_api_key, self.fred_api_key, partial=True)
+            excluded = sub.attrs.get('excluded', [])
+            # The full (untrimmed) panel of every ticker from this download
+            compact = ingestor.panel
+
+        return ReturnsPanel(compact), BenchmarkIndex.build(spy_join, fred_join), excluded
+
+    def refresh(self):
+        '''
+        Reloads market data and swaps the new snapshot in.  A failed refresh keeps the
+        previous snapshot.
+
+        Requested tickers that could not be downloaded may be misspelled, so they are
+        not retried (tickers requested while the refresh runs wait for the next one).
+
+        Returns: True if the data were refreshed
+        '''
+        with self.refreshing, stage('service refresh') as rec:
+            with self.lock:
+                requested = set(self.requested)
+            try:
+                panel, index, excluded = self.load(requested)
+            except (Exception, SystemExit) as err:
+                # Nothing could be downloaded (port_data_compile exits when every ticker fails)
+                with self.lock:
+                    self.refresh_error = repr(err)
+                    self.requested -= requested
+                print(f'WARNING! SERVICE REFRESH FAILED: {err!r}', flush=True)
+                return False
+
+            with self.lock:
+                self.snapshot = (panel, index)
+                self.refreshed = datetime.datetime.now().isoformat(timespec='seconds')
+                self.refresh_error = None
+                self.excluded = sorted(excluded)
+                self.tickers.update(requested - set(excluded))
+                self.requested -= requested
+            rec['rows'] = panel.close.size
+
+        return True
+
+    def refresh_loop(self, minutes):
+        while not self.stopped.wait(minutes * 60):
+            self.refresh()
+
+    def start(self, minutes=None):
+        '''
+        Starts the background refresh thread.
+        '''
+        minutes = refresh_minutes() if minutes is None else minutes
+        thread = threading.Thread(target=self.refresh_loop, args=(minutes,), daemon=True)
+        thread.start()
+
+        return thread
+
+    def stop(self):
+        self.stopped.set()
+
+    def status(self):
+        '''
+        Returns: dictionary describing the loaded data
+        '''
+        with self.lock:
+            panel = self.snapshot[0] if self.snapshot else None
+            return {'ready': panel is not None, 'refreshed': self.refreshed, 'refresh_error': self.refresh_error,
+                    'excluded': self.excluded,
+                    'tickers': 0 if panel is None else len(panel.tickers),
+                    'first_month': None if panel is None else str(panel.months[0]),
+                    'last_month': None if panel is None else str(panel.months[-1])}
+
+    def analyze(self, holdings, periods=[1, 2, 3, 5], chart=False):
+        '''
+        Analyzes a holdings list on the loaded data.
+
+        Like the portfolio report, the longer periods are skipped once the data no
+        longer cover the full length of the previous period.
+
+        Param: holdings (list of dict) with tck and qty keys like portfolio_import() rows,
+        periods (list of years), chart (bool) to include the cumulative returns
+
+        Returns: dictionary with results (list of dict, one per period), missing tickers
+        and the month of the latest data
+        '''
+        tickers = [str(h['tck']).strip().upper() for h in holdings]
+
+        with self.lock:
+            if self.snapshot is None:
+                # Downloaded by the next refresh
+                self.requested.update(tickers)
+                raise ValueError('Market data are not loaded yet')
+            panel, index = self.snapshot
+
+        with stage('service analyze', holdings=len(holdings)) as rec:
+            positions = {str(t): i for i, t in enumerate(panel.tickers)}
+            qty = np.zeros(len(panel.tickers))
+            missing = []
+            for tkr, h in zip(tickers, holdings):
+                if tkr in positions:
+                    qty[positions[tkr]] += float(h['qty'])
+                else:
+                    missing.append(tkr)
+
+            if missing:
+                with self.lock:
+                    self.requested.update(missing)
+            if not qty.any():
+                raise ValueError('None of the holdings are in the loaded market data')
+
+            first, last = panel.window(qty[:, None])
+            min_start = panel.months[first[0]]
+            max_end = panel.months[last[0]]
+
+            results = []
+            for i in periods:
+                ret_calc, tot_ret_dict, _ = panel.returns(i, index, None, min_start, max_end, qty)
+                result = {k: json_value(v) for k, v in ret_calc.items()}
+                if chart:
+                    result['chart'] = {k: [json_value(v) for v in values] for k, values in tot_ret_dict.items()}
+                results.append(result)
+
+                if ret_calc['years_tgt'] != ret_calc['years_act']:
+                    break
+            rec['rows'] = len(results)
+
+        return {'results': results, 'missing': missing, 'data_end': str(panel.months[-1])}
+
+
+def service_handler(service):
+    '''
+    Returns: request handler class answering for an AnalysisService
+
+    GET /status returns the status of the loaded data.  POST /analyze takes a JSON body
+    like {"holdings": [{"tck": "AZO", "qty": 10}], "periods": [1, 2, 3, 5], "chart": false}.
+    POST /refresh reloads the market data.
+    '''
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def reply(self, code, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/status':
+                self.reply(200, service.status())
+            else:
+                self.reply(404, {'error': f'Unknown path {self.path}'})
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            try:
+                body = json.loads(self.rfile.read(length) or b'{}')
+                if self.path == '/analyze':
+                    self.reply(200, service.analyze(body['holdings'], body.get('periods', [1, 2, 3, 5]),
+                                                    bool(body.get('chart', False))))
+                elif self.path == '/refresh':
+                    self.reply(200, {'refreshed': service.refresh(), **service.status()})
+                else:
+                    self.reply(404, {'error': f'Unknown path {self.path}'})
+            except (ValueError, KeyError, TypeError) as err:
+                self.reply(400, {'error': str(err)})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(service, host='127.0.0.1', port=8765):
+    '''
+    Loads the market data, starts the background refresh and answers requests until interrupted.
+    '''
+    service.refresh()
+    service.start()
+
+    server = ThreadingHTTPServer((host, port), service_handler(service))
+    server.daemon_threads = True
+    print('-----------------------------------------------', flush=True)
+    print(f'ANALYSIS SERVICE LISTENING ON http://{host}:{server.server_address[1]}', flush=True)
+    print('-----------------------------------------------', flush=True)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+        server.server_close()
+
+
+if __name__ == '__main__':
+
+    # Load environment variables
+    load_dotenv()
+    port_file_name = os.environ.get('PORTFOLIO_FILE_NAME')
+    ap_api_key = os.environ.get('ALPHAVANTAGE_API_KEY')
+    fred_api_key = os.environ.get('FRED_API_KEY')
+
+    # Start with the tickers of the configured portfolio (and SERVICE_TICKERS, comma separated)
+    tickers = [p['tck'] for p in portfolio_import(port_file_name)] if port_file_name else []
+    tickers += [t.strip().upper() for t in os.environ.get('SERVICE_TICKERS', '').split(',') if t.strip()]
+
+    host, port = service_address()
+    serve(AnalysisService(ap_api_key, fred_api_key, tickers), host, port)
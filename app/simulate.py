@@ -0,0 +1,258 @@
+# simulate.py
+
+# IMPORT PACKAGES
+
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from app.instrument import stage
+
+# FUNCTIONS
+
+# Percentiles reported for the simulated drawdowns
+DRAWDOWN_PERCENTILES = [5, 25, 50, 75, 95]
+
+
+def simulation_paths():
+    '''
+    Returns the number of simulated paths (SIMULATION_PATHS, default 10000).
+    '''
+    return int(os.environ.get('SIMULATION_PATHS', 10000))
+
+
+def simulation_method():
+    '''
+    Returns the simulation method (SIMULATION_METHOD): 'bootstrap' (default) resamples
+    blocks of historical months, 'normal' draws from a multivariate normal distribution
+    fitted to them.
+    '''
+    method = os.environ.get('SIMULATION_METHOD', 'bootstrap').lower()
+    if method not in ('bootstrap', 'normal'):
+        raise ValueError(f"SIMULATION_METHOD must be 'bootstrap' or 'normal', not {method!r}")
+
+    return method
+
+
+def simulation_seed():
+    '''
+    Returns the random seed (SIMULATION_SEED, default 0), so repeated runs give the same results.
+    '''
+    return int(os.environ.get('SIMULATION_SEED', 0))
+
+
+def simulation_chunk():
+    '''
+    Returns the number of paths simulated at once (SIMULATION_CHUNK, default 5000), which bounds memory use.
+    '''
+    return int(os.environ.get('SIMULATION_CHUNK', 5000))
+
+
+def simulation_workers():
+    '''
+    Returns the number of worker processes (SIMULATION_WORKERS, default: ANALYSIS_WORKERS).
+    '''
+    from app.parallel import analysis_workers
+
+    return int(os.environ.get('SIMULATION_WORKERS', analysis_workers()))
+
+
+def simulation_history(port_ret):
+    '''
+    Collects the monthly history to resample from a monthly DataFrame of returns().
+
+    Param: port_ret (DataFrame) with mon ret, spret and rate columns
+
+    Returns: months x 3 array of portfolio returns, S&P 500 returns and risk free rates
+    (months with a missing value are left out)
+    '''
+    history = port_ret[['mon ret', 'spret', 'rate']].to_numpy(dtype='float64')
+
+    return history[np.isfinite(history).all(axis=1)]
+
+
+def bootstrap_draws(rng, history, months, paths, block):
+    '''
+    Resamples months of history in blocks of consecutive months (a circular block
+    bootstrap), which keeps the portfolio, S&P 500 and rate of each month together
+    and some of the dependence between neighbouring months.
+
+    Returns: paths x months x 3 array
+    '''
+    n = len(history)
+    block = max(1, min(block, n))
+    blocks = -(-months // block)
+    starts = rng.integers(0, n, size=(paths, blocks, 1))
+    rows = ((starts + np.arange(block)) % n).reshape(paths, blocks * block)[:, :months]
+
+    return history[rows]
+
+
+def normal_draws(rng, history, months, paths):
+    '''
+    Draws months from a multivariate normal distribution with the mean and covariance
+    of the history.
+
+    Returns: paths x months x 3 array
+    '''
+    mean = history.mean(axis=0)
+    cov = np.cov(history, rowvar=False)
+    chol = np.linalg.cholesky(cov + np.eye(len(mean)) * 1e-12)
+
+    return mean + rng.standard_normal((paths, months, len(mean))) @ chol.T
+
+
+def path_stats(draws, horizon):
+    '''
+    Calculates the measures of every simulated path at once (down axis 1).
+
+    Param: draws (paths x months x 3 array), horizon (int) months for the horizon return
+
+    Returns: dictionary of arrays with one value per path
+    '''
+    port = draws[:, :, 0]
+    spret = draws[:, :, 1]
+    exret = port - draws[:, :, 2]
+    months = port.shape[1]
+
+    cum = np.cumprod(port + 1, axis=1)
+    peak = np.maximum(np.maximum.accumulate(cum, axis=1), 1.0)
+
+    port_dev = port - port.mean(axis=1, keepdims=True)
+    sp_dev = spret - spret.mean(axis=1, keepdims=True)
+
+    return {'horizon_ret': cum[:, horizon - 1] - 1,
+            'month_ret': port[:, 0],
+            'ann_ret': cum[:, -1]**(12 / months) - 1,
+            'max_drawdown': (cum / peak - 1).min(axis=1),
+            'sharpe': exret.mean(axis=1) / exret.std(axis=1, ddof=1) * (12 ** .5),
+            'beta': (port_dev * sp_dev).sum(axis=1) / (sp_dev * sp_dev).sum(axis=1)}
+
+
+def simulate_chunk(job):
+    '''
+    Simulates one chunk of paths (a module level function so process pools can run it).
+
+    Param: job (tuple of history, method, months, horizon, paths, block, SeedSequence)
+
+    Returns: dictionary of per path arrays (see path_stats())
+    '''
+    history, method, months, horizon, paths, block, seed = job
+    rng = np.random.default_rng(seed)
+
+    if method == 'normal':
+        draws = normal_draws(rng, history, months, paths)
+    else:
+        draws = bootstrap_draws(rng, history, months, paths, block)
+
+    return path_stats(draws, horizon)
+
+
+def simulation_summary(sims, confidence=0.95):
+    '''
+    Summarizes simulated paths.
+
+    VaR is the loss (as a positive return) not exceeded with the given confidence and
+    CVaR is the average loss beyond it, both over one month and over the horizon.
+    Intervals are the central confidence intervals of the simulated values.
+
+    Param: sims (dictionary from simulate_chunk()), confidence (float) like 0.95
+
+    Returns: dictionary of results
+    '''
+    tail = 1 - confidence
+
+    def var_cvar(ret):
+        cutoff = np.quantile(ret, tail)
+        return -cutoff, -ret[ret <= cutoff].mean()
+
+    def interval(x):
+        x = x[np.isfinite(x)]
+        return [np.quantile(x, tail / 2), np.median(x), np.quantile(x, 1 - tail / 2)] if len(x) else [np.nan] * 3
+
+    month_var, month_cvar = var_cvar(sims['month_ret'])
+    horizon_var, horizon_cvar = var_cvar(sims['horizon_ret'])
+    drawdowns = np.percentile(sims['max_drawdown'], DRAWDOWN_PERCENTILES)
+
+    return {'paths': len(sims['ann_ret']), 'confidence': confidence,
+            'var_1m': month_var, 'cvar_1m': month_cvar,
+            'var_horizon': horizon_var, 'cvar_horizon': horizon_cvar,
+            'ann_ret_ci': interval(sims['ann_ret']),
+            'sharpe_ci': interval(sims['sharpe']),
+            'beta_ci': interval(sims['beta']),
+            'max_drawdown_mean': sims['max_drawdown'].mean(),
+            'max_drawdown_pct': dict(zip(DRAWDOWN_PERCENTILES, drawdowns))}
+
+
+def simulate(port_ret, paths=None, method=None, horizon=12, block=6, seed=None, confidence=0.95,
+             chunk=None, workers=None):
+    '''
+    Simulates the portfolio and S&P 500 from the monthly history of an analysis period.
+
+    Paths are as long as the history and are generated in chunks of batched arrays,
+    so memory use depends on the chunk size, not on the number of paths.  Chunks run
+    across a process pool when more than one worker is configured.  Every chunk gets
+    its own seed spawned from one seed, so the results do not depend on the number
+    of workers.
+
+    Param: port_ret (monthly DataFrame from returns()), paths (int), method ('bootstrap' or
+    'normal'), horizon (int) months for VaR and CVaR, block (int) months per bootstrap
+    block, seed (int), confidence (float), chunk (int) paths per chunk, workers (int)
+    (None uses the SIMULATION_* settings)
+
+    Example: ret_calc, tot_ret_dict, port_ret = panel.returns(5, spy_join, fred_join); simulate(port_ret)
+
+    Returns: summary dictionary (see simulation_summary()), dictionary of per path arrays
+    '''
+    paths = simulation_paths() if paths is None else paths
+    method = simulation_method() if method is None else method
+    seed = simulation_seed() if seed is None else seed
+    chunk = simulation_chunk() if chunk is None else chunk
+    workers = simulation_workers() if workers is None else workers
+
+    history = simulation_history(port_ret)
+    months = len(history)
+    if months < 3:
+        raise ValueError('At least 3 months of history are needed to simulate')
+    horizon = min(horizon, months)
+
+    with stage('simulate', paths=paths, method=method) as rec:
+        sizes = [min(chunk, paths - k) for k in range(0, paths, chunk)]
+        seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+        jobs = [(history, method, months, horizon, n, block, s) for n, s in zip(sizes, seeds)]
+
+        if workers <= 1 or len(jobs) <= 1:
+            parts = [simulate_chunk(job) for job in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+                parts = list(executor.map(simulate_chunk, jobs))
+
+        sims = {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
+        summary = simulation_summary(sims, confidence)
+        summary.update({'method': method, 'months': months, 'horizon': horizon})
+        rec['rows'] = paths * months
+
+    return summary, sims
+
+
+if __name__ == '__main__':
+
+    from app.store import store_read
+    from app.returns_engine import ReturnsPanel
+
+    # Simulates the working portfolio saved by the last fetch (python -m app fetch)
+    sub = store_read('working_port')
+    spy_join = store_read('working_spy').set_index('month')
+    fred_join = store_read('working_fred').set_index('month')
+    panel = ReturnsPanel(sub)
+
+    for i in [1, 2, 3, 5]:
+        ret_calc, _, port_ret = panel.returns(i, spy_join, fred_join, sub['month'].min(), sub['month'].max())
+        s, _ = simulate(port_ret)
+        print(f"{i}Y ({s['months']} months, {s['paths']} {s['method']} paths): "
+              f"1M VaR {s['var_1m']:.2%}, CVaR {s['cvar_1m']:.2%}; {s['horizon']}M VaR {s['var_horizon']:.2%}, "
+              f"CVaR {s['cvar_horizon']:.2%}; median max drawdown {s['max_drawdown_pct'][50]:.2%}; "
+              f"sharpe {s['sharpe_ci'][0]:.2f} to {s['sharpe_ci'][2]:.2f}; beta {s['beta_ci'][0]:.2f} to {s['beta_ci'][2]:.2f}",
+              flush=True)
+        if ret_calc['years_tgt'] != ret_calc['years_act']:
+            break
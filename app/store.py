@@ -0,0 +1,63 @@
+# store.py
+
+# IMPORT PACKAGES
+
+import os
+
+from app.instrument import stage
+
+# FUNCTIONS
+
+STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+
+def store_path(name):
+    '''
+    Builds the path of a dataset in the columnar store.
+
+    Example: store_path('port_panel')
+
+    Returns: data/port_panel.feather
+    '''
+    return os.path.join(STORE_DIR, f'{name}.feather')
+
+
+def store_write(df, name):
+    '''
+    Writes a DataFrame to the columnar store as an uncompressed Feather (Arrow IPC)
+    file.  Column types (datetimes, monthly periods, floats) are kept, so reading
+    the file back needs no parsing, and uncompressed files can be memory-mapped.
+    The file is written next to the dataset and then moved over it, so readers (and
+    memory maps of the previous file) never see a half-written file.
+
+    Param: df (DataFrame), name (str) like 'port_panel'
+
+    Returns: path of the written file
+    '''
+    filepath = store_path(name)
+    with stage('store write', dataset=name) as rec:
+        df.reset_index(drop=True).to_feather(f'{filepath}.tmp', compression='uncompressed')
+        os.replace(f'{filepath}.tmp', filepath)
+        rec['rows'] = len(df)
+        rec['bytes'] = os.path.getsize(filepath)
+
+    return filepath
+
+
+def store_read(name, columns=None):
+    '''
+    Reads a dataset from the columnar store through a memory map.
+
+    Param: name (str) like 'port_panel', columns (list or None) to only read some columns
+
+    Returns: DataFrame
+    '''
+    # Imported here so that modules only building store paths start quickly
+    from pyarrow import feather
+
+    with stage('store read', dataset=name) as rec:
+        df = feather.read_table(store_path(name), columns=columns, memory_map=True).to_pandas()
+        rec['rows'] = len(df)
+        rec['bytes'] = os.path.getsize(store_path(name))
+
+    return df
@@ -0,0 +1,211 @@
+# stream_json.py
+
+# IMPORT PACKAGES
+
+import codecs
+import json
+from array import array
+import numpy as np
+import pandas as pd
+
+# FUNCTIONS
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+
+
+class JsonStream:
+    '''
+    Incremental reader over a JSON document arriving in chunks (for example from
+    requests' response.iter_content()).  Values are decoded one at a time with
+    json.JSONDecoder.raw_decode, and consumed text is dropped from the buffer, so
+    only the value being decoded is held in memory.
+
+    Param: chunks (iterable of bytes or str)
+    '''
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buf = ''
+        self.pos = 0
+
+    def _more(self):
+        '''
+        Appends the next chunk to the buffer.  Returns False at the end of the document.
+        '''
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            return False
+        if isinstance(chunk, bytes):
+            chunk = self.decoder.decode(chunk)
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        '''
+        Returns the next non-whitespace character ('' at the end of the document).
+        '''
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._more():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f'Expected {char!r} in JSON stream')
+        self.pos += 1
+
+    def value(self):
+        '''
+        Decodes the next complete JSON value.
+        '''
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._more():
+                    raise
+                continue
+
+            # A number at the end of the buffer may continue in the next chunk
+            if end == len(self.buf) and isinstance(value, (int, float)) and self._more():
+                continue
+
+            self.pos = end
+            return value
+
+    def members(self):
+        '''
+        Iterates over the (key, value) pairs of the JSON object starting at the current position.
+        '''
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key, self
+
+            if self.peek() == ',':
+                self.pos += 1
+            else:
+                self.expect('}')
+                return
+
+    def items(self):
+        '''
+        Iterates over the elements of the JSON array starting at the current position.
+        '''
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+
+            if self.peek() == ',':
+                self.pos += 1
+            else:
+                self.expect(']')
+                return
+
+    def rest(self):
+        '''
+        Decodes the remainder of the current object (after some members were read) into a dictionary.
+        '''
+        rest = {}
+        while True:
+            if self.peek() == ',':
+                self.pos += 1
+            if self.peek() in ('}', ''):
+                return rest
+            key = self.value()
+            self.expect(':')
+            rest[key] = self.value()
+
+
+def av_stream_frame(chunks, series_key='Monthly Adjusted Time Series'):
+    '''
+    Streams an Alpha Vantage time series response into typed columns.
+
+    Param: chunks (iterable of bytes), series_key (str) like 'Monthly Adjusted Time Series'
+
+    Returns: DataFrame with timestamp, close, adj close, volume and div amt columns, or the
+    decoded response (dict) if it is an error or call limit ("Note") response
+    '''
+    stream = JsonStream(chunks)
+    dates = []
+    close = array('d')
+    adj_close = array('d')
+    volume = array('q')
+    div_amt = array('d')
+    found = False
+
+    for key, member in stream.members():
+        if key != series_key:
+            value = member.value()
+            if key != 'Meta Data':
+                # Error and "Note" responses are small; return them as decoded
+                response = {key: value}
+                response.update(member.rest())
+                return response
+            continue
+
+        found = True
+        for day, _ in member.members():
+            row = member.value()
+            dates.append(day)
+            close.append(float(row['4. close']))
+            adj_close.append(float(row['5. adjusted close']))
+            volume.append(int(row['6. volume']))
+            div_amt.append(float(row['7. dividend amount']))
+
+    if not found:
+        return {'Other': None}
+
+    return pd.DataFrame({
+        'timestamp': pd.to_datetime(dates, format='%Y-%m-%d'),
+        'close': np.frombuffer(close, dtype='float64'),
+        'adj close': np.frombuffer(adj_close, dtype='float64'),
+        'volume': np.frombuffer(volume, dtype='int64'),
+        'div amt': np.frombuffer(div_amt, dtype='float64')
+    })
+
+
+def fred_stream_frame(chunks):
+    '''
+    Streams a FRED observations response into typed columns, skipping missing ('.') values.
+
+    Param: chunks (iterable of bytes)
+
+    Returns: DataFrame with date and rate columns, or the decoded response (dict) if it
+    has no observations (for example an error response)
+    '''
+    stream = JsonStream(chunks)
+    dates = []
+    rates = array('d')
+    response = {}
+
+    for key, member in stream.members():
+        if key != 'observations':
+            response[key] = member.value()
+            continue
+
+        for obs in member.items():
+            if obs['value'] != '.':
+                dates.append(obs['date'])
+                rates.append(float(obs['value']))
+
+        return pd.DataFrame({
+            'date': pd.to_datetime(dates, format='%Y-%m-%d'),
+            'rate': np.frombuffer(rates, dtype='float64')
+        })
+
+    return response
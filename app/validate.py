@@ -0,0 +1,253 @@
+# validate.py
+
+# IMPORT PACKAGES
+
+import os
+import numpy as np
+import pandas as pd
+
+from app.instrument import stage
+
+# FUNCTIONS
+
+# Share ratios of the splits (and reverse splits) looked for in adjusted prices
+SPLIT_RATIOS = [2, 3, 4, 5, 10, 1.5]
+
+# Largest gap between a price move and a split ratio for the move to count as that split
+SPLIT_TOLERANCE = 0.03
+
+# Anomalies listed by print_validation() before the rest are summarized
+MAX_LISTED_ANOMALIES = 10
+
+
+def validate_repair():
+    '''
+    Returns whether anomalies are repaired (VALIDATE_REPAIR='on') or only reported (the default).
+    '''
+    return os.environ.get('VALIDATE_REPAIR', 'off').lower() == 'on'
+
+
+def validate_fill_gaps():
+    '''
+    Returns whether missing months are filled from the previous month (VALIDATE_FILL_GAPS='on').
+    '''
+    return os.environ.get('VALIDATE_FILL_GAPS', 'off').lower() == 'on'
+
+
+def max_move():
+    '''
+    Returns the largest monthly move of adjusted prices not reported as a jump
+    (VALIDATE_MAX_MOVE, default 1.0: prices doubling or halving are reported).
+    '''
+    return float(os.environ.get('VALIDATE_MAX_MOVE', 1.0))
+
+
+def split_factors(ratio, volume_ratio):
+    '''
+    Matches monthly adjusted price ratios to split ratios.  A move counts as a split
+    that was not adjusted for when the price ratio is within SPLIT_TOLERANCE of one
+    over a split ratio and volume rose by at least the square root of that ratio (or
+    the reverse for reverse splits), since a split changes the number of shares traded.
+
+    Param: ratio (array of price ratios), volume_ratio (array of volume ratios)
+
+    Returns: array of split factors by which the price moved (nan where there is no split)
+    '''
+    factors = np.array([1 / r for r in SPLIT_RATIOS] + list(SPLIT_RATIOS))
+    distance = np.abs(np.log(ratio)[:, None] - np.log(factors))
+    best = distance.argmin(axis=1)
+    factor = factors[best]
+
+    near = distance[np.arange(len(ratio)), best] < np.log1p(SPLIT_TOLERANCE)
+    traded = np.where(factor < 1, volume_ratio >= factor ** -.5, volume_ratio <= factor ** -.5)
+
+    return np.where(near & traded, factor, np.nan)
+
+
+def validate_panel(compact, repair=None, fill_gaps=None):
+    '''
+    Checks every ticker-month of a CompactPanel in one column-wise pass.
+
+    Rows are compared with the previous row of the same ticker (rows sorted by ticker
+    and month), so each check is one vectorized comparison over the whole panel:
+
+    - duplicate: a second row for the same month (the last one is kept when repairing)
+    - gap: months missing before the row (value is the number of months)
+    - bad price: a close or adjusted close that is missing, zero or negative (blanked
+      when repairing, so the previous month's price is used)
+    - bad volume / bad dividend: negative volume or dividend (set to 0 when repairing)
+    - split: an adjusted close move that matches a split (value is the price ratio).
+      When repairing, adjusted prices before the split are rescaled.
+    - jump: an adjusted close move beyond VALIDATE_MAX_MOVE that is not a split (only reported)
+
+    Param: compact (CompactPanel), repair (bool or None for VALIDATE_REPAIR), fill_gaps (bool
+    or None for VALIDATE_FILL_GAPS) to add the missing months with the previous month's prices
+
+    Example: compact, anomalies = validate_panel(builder.compact())
+
+    Returns: CompactPanel (repaired, or the input itself if nothing was changed), DataFrame of
+    anomalies with ticker, month, check, value and repaired columns
+    '''
+    repair = validate_repair() if repair is None else repair
+    fill_gaps = validate_fill_gaps() if fill_gaps is None else fill_gaps
+
+    with stage('validate', rows=len(compact)) as rec:
+        key = (compact.codes.astype('int64') << 32) | compact.ordinals.astype('int64')
+        if len(key) > 1 and (np.diff(key) < 0).any():
+            compact = compact.take(np.argsort(key, kind='stable'))
+
+        codes = compact.codes
+        cols = compact.columns
+        close = np.asarray(cols['close'], dtype='float64')
+        adj = np.asarray(cols['adj close'], dtype='float64')
+        volume = np.asarray(cols['volume'], dtype='float64') if 'volume' in cols else np.zeros(len(codes))
+        div = np.asarray(cols['div amt'], dtype='float64') if 'div amt' in cols else np.zeros(len(codes))
+
+        # Each row against the previous row of the same ticker
+        same = np.zeros(len(codes), dtype=bool)
+        same[1:] = codes[1:] == codes[:-1]
+        step = np.zeros(len(codes), dtype='int64')
+        step[1:] = np.diff(compact.ordinals.astype('int64'))
+
+        duplicate = same & (step == 0)
+        gap = same & (step > 1)
+        bad_price = ~(close > 0) | ~(adj > 0)
+        bad_volume = volume < 0
+        bad_div = div < 0
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.full(len(codes), np.nan)
+            ratio[1:] = adj[1:] / adj[:-1]
+            volume_ratio = np.full(len(codes), np.nan)
+            volume_ratio[1:] = volume[1:] / volume[:-1]
+        moved = same & (step > 0) & ~bad_price & np.roll(~bad_price, 1) & np.isfinite(ratio)
+        move = np.abs(np.log(np.where(moved, ratio, 1.0)))
+
+        # Only moves at least as large as the smallest split are matched to split ratios
+        split = np.full(len(codes), np.nan)
+        candidates = np.flatnonzero(move >= np.log(min(SPLIT_RATIOS)) - np.log1p(SPLIT_TOLERANCE))
+        split[candidates] = split_factors(ratio[candidates], volume_ratio[candidates])
+        is_split = np.isfinite(split)
+        jump = moved & ~is_split & (move >= np.log1p(max_move()))
+
+        checks = [('duplicate', duplicate, np.ones(len(codes)), repair),
+                  ('gap', gap, step - 1.0, fill_gaps),
+                  ('bad price', bad_price, np.where(close > 0, adj, close), repair),
+                  ('bad volume', bad_volume, volume, repair),
+                  ('bad dividend', bad_div, div, repair),
+                  ('split', is_split, ratio, repair),
+                  ('jump', jump, ratio, False)]
+
+        frames = []
+        for name, flagged, value, repaired in checks:
+            rows = np.flatnonzero(flagged)
+            if len(rows) > 0:
+                frames.append(pd.DataFrame({'row': rows, 'check': name, 'value': value[rows], 'repaired': repaired}))
+
+        if len(frames) == 0:
+            rec['anomalies'] = 0
+            return compact, pd.DataFrame(columns=['ticker', 'month', 'check', 'value', 'repaired'])
+
+        found = pd.concat(frames, ignore_index=True).sort_values(['row', 'check'], kind='stable')
+        rows = found.pop('row').to_numpy()
+        found.insert(0, 'ticker', np.asarray(compact.tickers)[codes[rows]])
+        found.insert(1, 'month', pd.PeriodIndex.from_ordinals(compact.ordinals[rows].astype('int64'), freq='M'))
+        anomalies = found.reset_index(drop=True)
+        rec['anomalies'] = len(anomalies)
+
+        if repair and (duplicate.any() or bad_price.any() or bad_volume.any() or bad_div.any() or is_split.any()):
+            compact = repair_panel(compact, duplicate, bad_price, bad_volume | bad_div, split)
+        if fill_gaps and gap.any():
+            compact = fill_panel_gaps(compact)
+
+    return compact, anomalies
+
+
+def repair_panel(compact, duplicate, bad_price, negative, split):
+    '''
+    Repairs a sorted CompactPanel (see validate_panel()): blanks bad prices, zeroes negative
+    volumes and dividends, rescales adjusted prices before unadjusted splits and drops
+    all but the last row of duplicated months.
+
+    Returns: repaired CompactPanel (a copy)
+    '''
+    columns = {c: v.copy() for c, v in compact.columns.items()}
+    columns['close'][bad_price] = np.nan
+    columns['adj close'][bad_price] = np.nan
+    for c in ['volume', 'div amt']:
+        if c in columns:
+            columns[c][negative & (columns[c] < 0)] = 0
+
+    # Adjusted prices before a split are multiplied by the price ratio of every later
+    # split of the same ticker: a sum of log ratios over the rows after each row,
+    # up to the ticker's last row
+    log_factor = np.log(np.where(np.isfinite(split), split, 1.0))
+    after = np.r_[np.cumsum(log_factor[::-1])[::-1], 0.0]
+    ends = np.flatnonzero(np.r_[compact.codes[1:] != compact.codes[:-1], True])
+    ticker_end = np.repeat(ends, np.diff(np.r_[-1, ends]))
+    scale = np.exp(after[1:] - after[ticker_end + 1])
+    columns['adj close'] = (columns['adj close'] * scale).astype(columns['adj close'].dtype)
+
+    # Of duplicated months, the row that arrived last is kept
+    last_of_month = np.ones(len(duplicate), dtype=bool)
+    last_of_month[:-1] = ~duplicate[1:]
+
+    repaired = type(compact)(compact.tickers, compact.codes, compact.ordinals, compact.qty, columns)
+
+    return repaired.take(last_of_month)
+
+
+def fill_panel_gaps(compact):
+    '''
+    Adds the months missing inside each ticker's history of a sorted CompactPanel,
+    with the previous month's prices and no volume or dividend.
+
+    Returns: CompactPanel (a copy)
+    '''
+    ordinals = compact.ordinals.astype('int64')
+    missing = np.zeros(len(ordinals), dtype='int64')
+    same_next = compact.codes[1:] == compact.codes[:-1]
+    missing[:-1] = np.where(same_next, np.maximum(ordinals[1:] - ordinals[:-1] - 1, 0), 0)
+
+    # Each row is repeated once plus once per missing month after it
+    rows = np.repeat(np.arange(len(ordinals)), missing + 1)
+    first = np.r_[0, np.cumsum(missing + 1)[:-1]]
+    added = np.arange(len(rows)) - np.repeat(first, missing + 1)
+
+    filled = compact.take(rows)
+    filled.ordinals = (ordinals[rows] + added).astype('int32')
+    for c in ['volume', 'div amt']:
+        if c in filled.columns:
+            filled.columns[c][added > 0] = 0
+
+    return filled
+
+
+def print_validation(anomalies):
+    '''
+    Prints a summary of the anomalies found by validate_panel().
+    '''
+    if len(anomalies) == 0:
+        return
+
+    counts = anomalies.groupby('check', sort=False).size()
+    print('-----------------------------------------------', flush=True)
+    print(f"WARNING! FOUND {len(anomalies)} DATA ANOMALIES IN {anomalies['ticker'].nunique()} TICKER(S): "
+          f"{', '.join(f'{n} {c}' for c, n in counts.items())}", flush=True)
+    for row in anomalies.head(MAX_LISTED_ANOMALIES).itertuples():
+        print(f"----{row.ticker} {row.month}: {row.check} ({row.value:.4g}){' - repaired' if row.repaired else ''}", flush=True)
+    if len(anomalies) > MAX_LISTED_ANOMALIES:
+        print(f'----and {len(anomalies) - MAX_LISTED_ANOMALIES} more (see data/validation_report.feather)', flush=True)
+    print('-----------------------------------------------', flush=True)
+
+
+if __name__ == '__main__':
+
+    from app.store import store_read
+    from app.panel import CompactPanel
+
+    # Validates the full price panel saved by the last download
+    compact, anomalies = validate_panel(CompactPanel.from_dataset(store_read('port_panel')), repair=False, fill_gaps=False)
+    print_validation(anomalies)
+    if len(anomalies) == 0:
+        print(f'No anomalies in {len(compact)} ticker-month(s) of {len(compact.tickers)} ticker(s).', flush=True)
@@ -0,0 +1,192 @@
+# run.py
+
+# IMPORT PACKAGES
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from benchmarks.synthetic import synthetic_portfolio, synthetic_prices, synthetic_rates, av_json, fred_json
+from benchmarks.stand_in import StandIn
+
+import app.cache
+import app.store
+from app.cache import cache_update
+from app.ingest import Ingestor, HOST_LIMITS
+from app.rate_limit import TokenBucket
+from app.port_data_pull import av_base_url, port_data_compile
+from app.other_data_pull import fred_base_url
+from app.stream_json import av_stream_frame, fred_stream_frame
+from app.returns_engine import ReturnsPanel
+from app.report import period_figure
+
+# FUNCTIONS
+
+# Stage timings shorter than this are too noisy to flag as regressions
+NOISE_FLOOR = 0.05
+
+
+def _chunks(body, size=65536):
+    return (body[i:i + size] for i in range(0, len(body), size))
+
+
+def _fetch_all(urls, workers):
+    session = requests.Session()
+    session.mount('http://', HTTPAdapter(pool_maxsize=workers))
+
+    def fetch(url):
+        return session.get(url, timeout=30).content
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        bodies = list(executor.map(fetch, urls))
+    session.close()
+
+    return bodies
+
+
+def bench_case(n_tickers, years, latency=0.0, per_minute=None, seed=0):
+    '''
+    Runs every stage once for a synthetic portfolio against the local API stand-in.
+
+    Param: n_tickers (int), years (int), latency (float) seconds per request,
+    per_minute (int or None) stand-in Alpha Vantage call limit, seed (int)
+
+    Returns: list of dict (one per stage) with seconds, rows and bytes
+    '''
+    portfolio = synthetic_portfolio(n_tickers, seed)
+    tickers = [p['tck'] for p in portfolio]
+    prices = synthetic_prices(['SPY'] + tickers, years, seed)
+    rates = synthetic_rates(years, seed)
+    bodies = {s: av_json(f, symbol=s) for s, f in prices.items()}
+    fred_body = fred_json(rates)
+
+    timings = []
+
+    def record(stage, start, rows, n_bytes=0):
+        timings.append({'stage': stage, 'seconds': time.perf_counter() - start, 'rows': int(rows), 'bytes': int(n_bytes)})
+
+    with StandIn(bodies, fred_body, latency, per_minute) as stand_in, tempfile.TemporaryDirectory() as tmp:
+        os.environ['ALPHAVANTAGE_BASE_URL'] = stand_in.base_url
+        os.environ['FRED_BASE_URL'] = stand_in.base_url
+        app.store.STORE_DIR = tmp
+        app.cache.CACHE_DIR = os.path.join(tmp, 'cache')
+
+        # Raw HTTP round trips only (the call limit only applies to the ingest stage)
+        stand_in.per_minute = None
+        start = time.perf_counter()
+        urls = [f'{av_base_url()}/query?function=TIME_SERIES_MONTHLY_ADJUSTED&symbol={t}&apikey=bench' for t in tickers]
+        urls.append(f'{fred_base_url()}/fred/series/observations?series_id=DGS1&api_key=bench&file_type=json')
+        raw = _fetch_all(urls, HOST_LIMITS['www.alphavantage.co'])
+        record('fetch', start, len(raw), sum(len(b) for b in raw))
+        stand_in.per_minute = per_minute
+
+        # Streaming JSON parse of the downloaded bodies
+        start = time.perf_counter()
+        frames = {t: av_stream_frame(_chunks(b)) for t, b in zip(tickers, raw[:-1])}
+        fred = fred_stream_frame(_chunks(raw[-1]))
+        record('parse', start, sum(len(f) for f in frames.values()) + len(fred), sum(len(b) for b in raw))
+
+        # Market data cache writes
+        start = time.perf_counter()
+        for t, f in frames.items():
+            cache_update(None, 'alphavantage', t, 'monthly_adjusted', f, 'timestamp', 'M')
+        cache_update(None, 'fred', 'DGS1', 'observations', fred, 'date')
+        record('persist', start, sum(len(f) for f in frames.values()) + len(fred))
+
+        # End to end download through the app's downloader (concurrency limits,
+        # token bucket and throttle retries), without the cache
+        bucket = TokenBucket(per_minute=per_minute or 10**9, per_day=10**9)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            spy_join, fred_join, sub, minomax, maxomin = Ingestor(bucket=bucket, use_cache=False, throttle_delay=1).run(portfolio, 'bench', 'bench')
+        record('ingest', start, len(sub), stand_in.bytes_sent - sum(len(b) for b in raw))
+
+        # Portfolio dataset assembly (port_data_pull)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            sub, minomax, maxomin, compact = port_data_compile(portfolio, frames, bucket)
+        record('assembly', start, len(sub))
+
+        # Returns for the 1, 2, 3 and 5 year analysis periods
+        start = time.perf_counter()
+        panel = ReturnsPanel(sub)
+        period_returns = [panel.returns(i, spy_join, fred_join, maxomin, minomax) for i in [1, 2, 3, 5]]
+        record('returns', start, len(panel.months) * len(panel.tickers))
+
+        start = time.perf_counter()
+        figs = [period_figure(r, tot) for r, tot, _ in period_returns]
+        record('figures', start, len(figs))
+
+    for t in timings:
+        t.update({'tickers': n_tickers, 'years': years, 'latency': latency, 'per_minute': per_minute})
+
+    return timings
+
+
+def regressions(timings, baseline, tolerance):
+    '''
+    Compares stage timings with a baseline results file.
+
+    Returns: list of (case, stage, baseline seconds, seconds) slower than (1 + tolerance) times the baseline
+    '''
+    def key(t):
+        return (t['tickers'], t['years'], t['latency'], t['per_minute'], t['stage'])
+
+    with open(baseline, 'r') as base_file:
+        base = {key(t): t['seconds'] for t in map(json.loads, base_file) if 'stage' in t}
+
+    slow = []
+    for t in timings:
+        b = base.get(key(t))
+        if b is not None and t['seconds'] > b * (1 + tolerance) and t['seconds'] - b > NOISE_FLOOR:
+            slow.append((f"{t['tickers']} tickers x {t['years']} years", t['stage'], b, t['seconds']))
+
+    return slow
+
+
+def _ints(text):
+    return [int(x) for x in text.split(',')]
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Times each stage of the app on synthetic portfolios served by a local API stand-in.')
+    parser.add_argument('--tickers', type=_ints, default=[10, 100], help='comma separated portfolio sizes (10 to 5000)')
+    parser.add_argument('--years', type=_ints, default=[5, 20], help='comma separated history lengths in years (5 to 50)')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds the stand-in waits before answering each request')
+    parser.add_argument('--per-minute', type=int, default=None, help='stand-in Alpha Vantage calls per minute before "Note" responses')
+    parser.add_argument('--output', default=os.path.join('data', 'benchmarks.jsonl'), help='JSON lines results file')
+    parser.add_argument('--baseline', default=None, help='earlier results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown against the baseline (0.25 = 25%%)')
+    args = parser.parse_args()
+
+    run = {'run': datetime.datetime.now().isoformat(timespec='seconds'), 'python': sys.version.split()[0]}
+    timings = []
+    for n in args.tickers:
+        for y in args.years:
+            case = bench_case(n, y, args.latency, args.per_minute)
+            timings.extend(case)
+            print(f'{n:>5} tickers x {y:>2} years: ' + ', '.join(f"{t['stage']} {t['seconds']:.3f}s" for t in case), flush=True)
+
+    with open(args.output, 'w') as out_file:
+        out_file.write(json.dumps(run) + '\n')
+        for t in timings:
+            out_file.write(json.dumps(dict(run, **t)) + '\n')
+    print(f'Results written to {args.output}', flush=True)
+
+    if args.baseline is not None:
+        slow = regressions(timings, args.baseline, args.tolerance)
+        for case, stage, b, s in slow:
+            print(f'REGRESSION: {case} {stage}: {b:.3f}s -> {s:.3f}s', flush=True)
+        if len(slow) > 0:
+            sys.exit(1)
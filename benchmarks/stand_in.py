@@ -0,0 +1,119 @@
+# stand_in.py
+
+# IMPORT PACKAGES
+
+import threading
+import time
+import json
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# FUNCTIONS
+
+THROTTLE_NOTE = {'Note': 'Thank you for using Alpha Vantage! Our standard API call frequency is 5 calls per minute and 500 calls per day.'}
+
+
+class StandIn:
+    '''
+    Local HTTP server answering like the Alpha Vantage and FRED APIs from prepared
+    response bodies, so that downloads can be benchmarked without API keys.
+
+    Every request waits `latency` seconds before it is answered.  If per_minute is
+    set, Alpha Vantage calls beyond that many in any rolling 60 seconds get a "Note"
+    (call limit exceeded) response, like the real API.  Unknown symbols get an
+    "Error Message" response.
+
+    Point the app at the stand-in with ALPHAVANTAGE_BASE_URL and FRED_BASE_URL
+    set to stand_in.base_url.
+
+    Param: av_bodies (dict of {symbol: bytes}), fred_body (bytes), latency (float)
+    in seconds, per_minute (int or None)
+
+    Example: with StandIn(bodies, fred_body, latency=0.05) as stand_in: ...
+    '''
+
+    def __init__(self, av_bodies, fred_body, latency=0.0, per_minute=None):
+        self.av_bodies = av_bodies
+        self.fred_body = fred_body
+        self.latency = latency
+        self.per_minute = per_minute
+        self.calls = deque()
+        self.requests = 0
+        self.throttled = 0
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                body = stand_in.respond(self.path)
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.base_url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def _throttle(self):
+        if self.per_minute is None:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            while self.calls and now - self.calls[0] >= 60:
+                self.calls.popleft()
+            if len(self.calls) >= self.per_minute:
+                self.throttled += 1
+                return True
+            self.calls.append(now)
+            return False
+
+    def respond(self, path):
+        '''
+        Returns the response body for a request path.
+        '''
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        url = urlparse(path)
+        query = parse_qs(url.query)
+
+        if url.path.startswith('/fred/'):
+            body = self.fred_body
+        elif self._throttle():
+            body = json.dumps(THROTTLE_NOTE).encode('utf-8')
+        else:
+            symbol = query.get('symbol', [''])[0]
+            body = self.av_bodies.get(symbol)
+            if body is None:
+                body = json.dumps({'Error Message': 'Invalid API call. Please retry or visit the documentation.'}).encode('utf-8')
+
+        with self.lock:
+            self.requests += 1
+            self.bytes_sent += len(body)
+
+        return body
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
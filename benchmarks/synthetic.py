@@ -0,0 +1,124 @@
+# synthetic.py
+
+# IMPORT PACKAGES
+
+import json
+import numpy as np
+import pandas as pd
+
+# FUNCTIONS
+
+def synthetic_tickers(n_tickers):
+    '''
+    Builds n_tickers unique made-up ticker symbols.
+
+    Example: synthetic_tickers(3)
+
+    Returns: ['TA', 'TB', 'TC']
+    '''
+    letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    tickers = []
+    for i in range(n_tickers):
+        name = ''
+        while True:
+            name = letters[i % 26] + name
+            i = i // 26 - 1
+            if i < 0:
+                break
+        tickers.append(f'T{name}')
+
+    return tickers
+
+
+def synthetic_portfolio(n_tickers, seed=0):
+    '''
+    Builds a portfolio in the same format as portfolio_import() (string values).
+
+    Param: n_tickers (int) like 100, seed (int)
+
+    Returns: list of dict with id, tck and qty keys
+    '''
+    rng = np.random.default_rng(seed)
+    qty = rng.integers(1, 500, n_tickers)
+
+    return [{'id': str(i + 1), 'tck': t, 'qty': str(q)} for i, (t, q) in enumerate(zip(synthetic_tickers(n_tickers), qty))]
+
+
+def synthetic_prices(symbols, years, seed=0, end='2020-12-31'):
+    '''
+    Generates monthly price histories shaped like Alpha Vantage monthly adjusted data.
+
+    Each symbol gets random monthly returns, a quarterly dividend and a history
+    covering between half and all of the requested years (at least two years),
+    so that the common analysis window is shorter than the longest history.
+
+    Param: symbols (list of str), years (int) like 20, seed (int), end (str) last month end
+
+    Returns: dictionary of {symbol: DataFrame with timestamp, close, adj close, volume and div amt columns}
+    '''
+    rng = np.random.default_rng(seed)
+    n_months = years * 12
+    dates = pd.date_range(end=end, periods=n_months, freq='ME')
+    frames = {}
+
+    for s in symbols:
+        length = int(rng.integers(min(24, n_months), n_months + 1)) if s != 'SPY' else n_months
+        length = max(length, n_months // 2)
+        ret = rng.normal(0.006, 0.06, length)
+        close = 50 * np.exp(np.cumsum(ret))
+        div = np.where(np.arange(length) % 3 == 2, np.round(close * 0.005, 4), 0.0)
+
+        # Adjusted close: later dividends scale earlier prices down (as Alpha Vantage does)
+        factor = np.ones(length)
+        factor[:-1] = np.cumprod((1 - div[1:] / close[:-1])[::-1])[::-1]
+
+        frames[s] = pd.DataFrame({'timestamp': dates[-length:], 'close': np.round(close, 4),
+                                  'adj close': np.round(close * factor, 4),
+                                  'volume': rng.integers(10**5, 10**8, length), 'div amt': div})
+
+    return frames
+
+
+def synthetic_rates(years, seed=0, end='2020-12-31'):
+    '''
+    Generates daily 1-Year Treasury Bill rates (business days, with some missing values).
+
+    Returns: DataFrame with date and rate columns (rate is nan where FRED reports '.')
+    '''
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(end=end, periods=years * 261)
+    rate = np.clip(2 + np.cumsum(rng.normal(0, 0.02, len(dates))), 0.05, None)
+    rate[rng.random(len(dates)) < 0.03] = np.nan
+
+    return pd.DataFrame({'date': dates, 'rate': np.round(rate, 2)})
+
+
+def av_json(frame, series_key='Monthly Adjusted Time Series', symbol='SPY'):
+    '''
+    Serializes a price history as an Alpha Vantage JSON response (newest month first).
+
+    Returns: bytes
+    '''
+    series = {}
+    for row in frame.iloc[::-1].itertuples(index=False):
+        series[f'{row.timestamp:%Y-%m-%d}'] = {
+            '1. open': f'{row.close:.4f}', '2. high': f'{row.close:.4f}', '3. low': f'{row.close:.4f}',
+            '4. close': f'{row.close:.4f}', '5. adjusted close': f'{row[2]:.4f}',
+            '6. volume': str(row.volume), '7. dividend amount': f'{row[4]:.4f}'}
+
+    return json.dumps({'Meta Data': {'1. Information': 'Monthly Adjusted Prices and Volumes', '2. Symbol': symbol},
+                       series_key: series}, indent=4).encode('utf-8')
+
+
+def fred_json(frame):
+    '''
+    Serializes daily rates as a FRED observations JSON response.
+
+    Returns: bytes
+    '''
+    observations = [{'realtime_start': '2020-12-31', 'realtime_end': '2020-12-31', 'date': f'{d:%Y-%m-%d}',
+                     'value': '.' if np.isnan(r) else f'{r:.2f}'}
+                    for d, r in zip(frame['date'], frame['rate'])]
+
+    return json.dumps({'realtime_start': '2020-12-31', 'realtime_end': '2020-12-31', 'units': 'lin',
+                       'count': len(observations), 'observations': observations}).encode('utf-8')
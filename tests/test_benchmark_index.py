@@ -0,0 +1,72 @@
+# test_benchmark_index.py
+
+# IMPORT PACKAGES
+
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+import app.store
+from app.benchmark_index import BenchmarkIndex, benchmark_index
+
+# TESTS
+
+@pytest.fixture(autouse=True)
+def store_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(app.store, 'STORE_DIR', str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def series():
+    months = pd.period_range('2020-01', '2020-12', freq='M', name='month')
+    spy_join = pd.Series(np.linspace(-0.02, 0.03, 12), index=months, name='spret')
+    spy_join.iloc[0] = np.nan
+    fred_join = pd.Series(np.full(12, 0.001), index=months, name='rate')
+    return spy_join, fred_join
+
+
+def test_index_is_reused_for_the_same_series(series, store_dir):
+    spy_join, fred_join = series
+
+    first = benchmark_index(spy_join, fred_join)
+    written = os.stat(first.path).st_mtime_ns
+    again = benchmark_index(spy_join.to_frame(), fred_join.to_frame())
+
+    assert again.source == first.source
+    assert os.stat(again.path).st_mtime_ns == written
+
+
+def test_index_is_rebuilt_when_the_series_change(series):
+    spy_join, fred_join = series
+    benchmark_index(spy_join, fred_join)
+
+    changed = spy_join.copy()
+    changed.iloc[-1] = 0.05
+    index = benchmark_index(changed, fred_join)
+
+    assert index.values(changed.index[-1:])[0].tolist() == [0.05]
+    assert BenchmarkIndex.read().source == index.source
+
+
+def test_cum_growth_outside_the_index_is_nan(series):
+    index = BenchmarkIndex.build(*series)
+
+    before = pd.period_range('2019-11', '2020-02', freq='M')
+    after = pd.period_range('2020-12', '2021-02', freq='M')
+
+    assert np.isnan(index.cum_growth(before)).all()
+    growth = index.cum_growth(after)
+    assert growth[0] == pytest.approx(1.03)
+    assert np.isnan(growth[1:]).all()
+    assert len(index.cum_growth(before[:0])) == 0
+
+
+def test_cum_growth_compounds_from_the_month_before(series):
+    spy_join, fred_join = series
+    index = BenchmarkIndex.build(spy_join, fred_join)
+
+    months = spy_join.index[3:6]
+
+    np.testing.assert_allclose(index.cum_growth(months), np.cumprod(1 + spy_join.iloc[3:6].to_numpy()))
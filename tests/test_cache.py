@@ -0,0 +1,114 @@
+# test_cache.py
+
+# IMPORT PACKAGES
+
+import json
+import pandas as pd
+import pytest
+
+import app.cache
+import app.store
+from app.cache import cache_update, cache_read, cache_meta, cache_path, cache_fresh
+
+# TESTS
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(app.cache, 'CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(app.store, 'STORE_DIR', str(tmp_path))
+    return tmp_path
+
+
+def prices(dates, adj):
+    return pd.DataFrame({'timestamp': pd.to_datetime(dates), 'close': adj, 'adj close': adj,
+                         'volume': [100] * len(dates), 'div amt': [0.0] * len(dates)})
+
+
+def test_redated_month_replaces_cached_row():
+    entry = cache_update(None, 'alphavantage', 'SPY', 'monthly_adjusted',
+                         prices(['2024-01-31', '2024-02-15'], [100.0, 101.0]), 'timestamp', 'M')
+    entry = cache_update(entry, 'alphavantage', 'SPY', 'monthly_adjusted',
+                         prices(['2024-01-31', '2024-02-29'], [100.0, 103.0]), 'timestamp', 'M')
+
+    data = cache_read('alphavantage', 'SPY', 'monthly_adjusted')['data']
+    assert data['timestamp'].dt.strftime('%Y-%m-%d').tolist() == ['2024-01-31', '2024-02-29']
+    assert data['adj close'].tolist() == [100.0, 103.0]
+    assert data['timestamp'].dt.to_period('M').is_unique
+    assert entry['last_changed'] == 1
+    assert entry['last_obs'] == '2024-02-29'
+
+
+def test_redated_month_gives_one_monthly_return():
+    from app.other_data_pull import spy_format
+
+    entry = cache_update(None, 'alphavantage', 'SPY', 'monthly_adjusted',
+                         prices(['2024-01-31', '2024-02-15'], [100.0, 101.0]), 'timestamp', 'M')
+    entry = cache_update(entry, 'alphavantage', 'SPY', 'monthly_adjusted',
+                         prices(['2024-01-31', '2024-02-29'], [100.0, 103.0]), 'timestamp', 'M')
+
+    spy_join = spy_format(entry['data'].copy())
+    assert spy_join.index.is_unique
+    assert spy_join.loc[pd.Period('2024-02', 'M')] == pytest.approx(0.03)
+
+
+def test_daily_rows_are_matched_on_the_date():
+    entry = cache_update(None, 'fred', 'DGS1', 'observations',
+                         pd.DataFrame({'date': pd.to_datetime(['2024-02-01', '2024-02-02']), 'rate': [5.0, 5.1]}), 'date')
+    entry = cache_update(entry, 'fred', 'DGS1', 'observations',
+                         pd.DataFrame({'date': pd.to_datetime(['2024-02-02', '2024-02-05']), 'rate': [5.2, 5.3]}), 'date')
+
+    assert entry['data']['date'].dt.strftime('%Y-%m-%d').tolist() == ['2024-02-01', '2024-02-02', '2024-02-05']
+    assert entry['data']['rate'].tolist() == [5.0, 5.2, 5.3]
+    assert entry['last_changed'] == 2
+
+
+def test_incremental_update_keeps_older_rows_and_counts_changes():
+    entry = cache_update(None, 'alphavantage', 'AZO', 'monthly_adjusted',
+                         prices(['2023-11-30', '2023-12-29', '2024-01-31'], [10.0, 11.0, 12.0]), 'timestamp', 'M')
+    assert entry['last_changed'] == 3
+
+    entry = cache_update(entry, 'alphavantage', 'AZO', 'monthly_adjusted',
+                         prices(['2024-01-31', '2024-02-29'], [12.0, 13.0]), 'timestamp', 'M')
+
+    assert entry['data']['adj close'].tolist() == [10.0, 11.0, 12.0, 13.0]
+    assert entry['last_changed'] == 1
+
+
+def test_entries_of_other_cache_versions_are_ignored():
+    cache_update(None, 'alphavantage', 'AZO', 'monthly_adjusted', prices(['2024-01-31'], [10.0]), 'timestamp', 'M')
+    assert cache_fresh(cache_meta('alphavantage', 'AZO', 'monthly_adjusted'))
+
+    filepath = cache_path('alphavantage', 'AZO', 'monthly_adjusted')
+    with open(f'{filepath}.json', 'r') as meta_file:
+        meta = json.load(meta_file)
+    meta['version'] = app.cache.CACHE_VERSION - 1
+    with open(f'{filepath}.json', 'w') as meta_file:
+        json.dump(meta, meta_file)
+
+    assert cache_read('alphavantage', 'AZO', 'monthly_adjusted') is None
+    assert not cache_fresh(cache_meta('alphavantage', 'AZO', 'monthly_adjusted'))
+
+
+def test_unchanged_download_counts_no_changes_and_reads_back_typed():
+    data = prices(['2023-12-29', '2024-01-31'], [11.0, 12.0])
+    entry = cache_update(None, 'alphavantage', 'AZO', 'monthly_adjusted', data, 'timestamp', 'M')
+    entry = cache_update(entry, 'alphavantage', 'AZO', 'monthly_adjusted', data, 'timestamp', 'M')
+
+    assert entry['last_changed'] == 0
+    pd.testing.assert_frame_equal(cache_read('alphavantage', 'AZO', 'monthly_adjusted')['data'], entry['data'])
+    assert entry['data'].dtypes.equals(data.dtypes)
+
+
+def test_revised_and_back_filled_rows_are_merged_in_date_order():
+    entry = cache_update(None, 'fred', 'DGS1', 'observations',
+                         pd.DataFrame({'date': pd.to_datetime(['2024-01-02', '2024-01-04', '2024-01-05']),
+                                       'rate': [4.8, 4.9, 5.0]}), 'date')
+    # An incremental request starting before the last observation revises one rate and fills a missing day
+    entry = cache_update(entry, 'fred', 'DGS1', 'observations',
+                         pd.DataFrame({'date': pd.to_datetime(['2024-01-05', '2024-01-03', '2024-01-04']),
+                                       'rate': [5.05, 4.85, 4.9]}), 'date')
+
+    assert entry['data']['date'].dt.strftime('%Y-%m-%d').tolist() == ['2024-01-02', '2024-01-03', '2024-01-04', '2024-01-05']
+    assert entry['data']['rate'].tolist() == [4.8, 4.85, 4.9, 5.05]
+    assert entry['last_changed'] == 2
+    assert entry['last_obs'] == '2024-01-05'
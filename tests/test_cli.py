@@ -0,0 +1,35 @@
+# test_cli.py
+
+# IMPORT PACKAGES
+
+import subprocess
+import sys
+import pytest
+
+import app.cli
+import app.store
+from app.cli import main
+
+# TESTS
+
+def test_analyze_without_working_data_asks_for_fetch(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(app.store, 'STORE_DIR', str(tmp_path))
+    monkeypatch.setattr(app.cli, 'RESULTS_PATH', str(tmp_path / 'analysis_results.json'))
+
+    with pytest.raises(SystemExit) as exit_info:
+        main(['analyze'])
+
+    assert exit_info.value.code == 1
+    out = capsys.readouterr().out
+    assert 'working_port, working_spy, working_fred not found' in out
+    assert "python -m app fetch" in out
+
+
+def test_analyze_imports_leave_out_the_download_and_service_modules():
+    code = ('import sys, app.cli, app.returns_engine, app.parallel, app.benchmark_index; '
+            'from app.returns_engine import json_value; '
+            'print(sorted(m for m in ["requests", "http.server", "app.ingest", "app.service"] if m in sys.modules))')
+
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+
+    assert out.strip() == '[]'
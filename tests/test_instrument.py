@@ -0,0 +1,75 @@
+# test_instrument.py
+
+# IMPORT PACKAGES
+
+import json
+import threading
+import tracemalloc
+import pytest
+
+from app.instrument import stage
+
+# TESTS
+
+@pytest.fixture
+def trace(tmp_path, monkeypatch):
+    path = tmp_path / 'trace.jsonl'
+    monkeypatch.setenv('PIPELINE_TRACE', str(path))
+    monkeypatch.setenv('PIPELINE_PROFILE', 'tracemalloc')
+    yield lambda: {r['stage']: r for r in map(json.loads, path.read_text().splitlines())}
+    tracemalloc.stop()
+
+
+def test_nested_stage_does_not_lower_the_parent_peak(trace):
+    with stage('parent'):
+        block = bytearray(20_000_000)
+        del block
+        with stage('child'):
+            small = bytearray(1_000_000)
+            del small
+
+    records = trace()
+    assert records['child']['parent'] == 'parent'
+    assert records['child']['peak_mem'] < 10_000_000
+    assert records['parent']['peak_mem'] >= 20_000_000
+
+
+def test_child_peak_counts_in_the_parent(trace):
+    with stage('parent'):
+        with stage('child'):
+            block = bytearray(20_000_000)
+            del block
+
+    records = trace()
+    assert records['child']['peak_mem'] >= 20_000_000
+    assert records['parent']['peak_mem'] >= 20_000_000
+
+
+def test_concurrent_stage_does_not_lower_the_other_peak(trace):
+    started = threading.Event()
+    release = threading.Event()
+
+    def worker():
+        with stage('worker'):
+            started.set()
+            release.wait()
+
+    with stage('main'):
+        block = bytearray(20_000_000)
+        del block
+        thread = threading.Thread(target=worker)
+        thread.start()
+        started.wait()
+        release.set()
+        thread.join()
+
+    assert trace()['main']['peak_mem'] >= 20_000_000
+
+
+def test_no_record_without_a_trace_file(monkeypatch):
+    monkeypatch.delenv('PIPELINE_TRACE', raising=False)
+
+    with stage('quiet') as rec:
+        rec['rows'] = 3
+
+    assert rec == {'rows': 3, 'bytes': None}
@@ -0,0 +1,131 @@
+# test_ledger.py
+
+# IMPORT PACKAGES
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import app.ledger
+from app.returns_engine import ReturnsPanel
+from app.ledger import load_ledger, ledger_positions, ledger_returns, money_weighted_rate
+
+# TESTS
+
+def price_panel(months, close, adj=None, div=0.0):
+    months = pd.PeriodIndex(months, freq='M')
+    return ReturnsPanel(pd.DataFrame({'ticker': 'TA', 'qty': 0.0, 'close': close, 'adj close': close if adj is None else adj,
+                                      'div amt': div, 'month': months}), dividends=True)
+
+
+def trades(rows):
+    return pd.DataFrame(rows, columns=['date', 'ticker', 'qty', 'price']).assign(date=lambda d: pd.to_datetime(d['date']))
+
+
+def test_buy_and_hold_twr_and_mwr_equal_the_price_return():
+    panel = price_panel(['2020-01', '2020-02', '2020-03'], [100.0, 110.0, 121.0])
+    ledger = trades([('2019-12-15', 'TA', 10.0, 90.0)])
+
+    ret_calc, port_ret = ledger_returns(panel, ledger, 1)
+
+    assert ret_calc['start_val'] == 1000.0
+    assert ret_calc['end_val'] == pytest.approx(1210.0)
+    assert port_ret['mon ret'].tolist() == pytest.approx([0.1, 0.1])
+    assert ret_calc['cum_twr'] == pytest.approx(0.21)
+    assert ret_calc['ann_twr'] == pytest.approx(1.21 ** 6 - 1)
+    assert ret_calc['mon_mwr'] == pytest.approx(0.1)
+    # The opening trade is before the period, so it is not a flow of the period
+    assert ret_calc['net_flows'] == 0
+
+
+def test_month_start_purchase_is_weighted_for_the_whole_month():
+    panel = price_panel(['2020-01', '2020-02', '2020-03'], [100.0, 110.0, 121.0])
+    ledger = trades([('2019-12-15', 'TA', 10.0, 90.0), ('2020-02-01', 'TA', 10.0, 100.0)])
+
+    ret_calc, port_ret = ledger_returns(panel, ledger, 1)
+
+    # February: (2200 - 1000 - 1000) / (1000 + 1000)
+    assert port_ret['mon ret'].tolist() == pytest.approx([0.1, 0.1])
+    assert port_ret['flow'].tolist() == [1000.0, 0.0]
+    assert ret_calc['cum_twr'] == pytest.approx(0.21)
+    # 2000 invested at the start grows to 2420 over two months
+    assert ret_calc['mon_mwr'] == pytest.approx(0.1)
+
+
+def test_mid_month_purchase_uses_modified_dietz_weights():
+    panel = price_panel(['2020-01', '2020-02', '2020-03'], [100.0, 110.0, 121.0])
+    ledger = trades([('2019-12-15', 'TA', 10.0, 90.0), ('2020-02-15', 'TA', 10.0, 100.0)])
+
+    ret_calc, port_ret = ledger_returns(panel, ledger, 1)
+
+    weight = 1 - 14 / 29
+    assert port_ret['mon ret'].iloc[0] == pytest.approx(200 / (1000 + 1000 * weight))
+    assert ret_calc['cum_twr'] == pytest.approx((1 + 200 / (1000 + 1000 * weight)) * 1.1 - 1)
+
+    # The money-weighted rate discounts the purchase from the day it was made
+    rate = ret_calc['mon_mwr']
+    assert -1000 - 1000 * (1 + rate) ** -(14 / 29) + 2420 * (1 + rate) ** -2 == pytest.approx(0, abs=1e-6)
+
+
+def test_dividends_are_income_paid_out():
+    # A 1.10 dividend on a 110 close in February
+    panel = price_panel(['2020-01', '2020-02', '2020-03'], [100.0, 110.0, 110.0], [100.0 / 1.01, 111.1 / 1.01, 111.1 / 1.01],
+                        [0.0, 1.1, 0.0])
+    ledger = trades([('2019-12-31', 'TA', 10.0, 100.0)])
+
+    ret_calc, port_ret = ledger_returns(panel, ledger, 1)
+
+    assert port_ret['income'].tolist() == pytest.approx([11.0, 0.0])
+    assert ret_calc['income'] == pytest.approx(11.0)
+    assert port_ret['mon ret'].tolist() == pytest.approx([0.111, 0.0])
+
+
+def test_split_recorded_as_free_shares_is_not_income():
+    # 2-for-1 split in March: the close halves and the adjusted close does not move
+    panel = price_panel(['2020-01', '2020-02', '2020-03'], [100.0, 100.0, 50.0], [50.0, 50.0, 50.0])
+    ledger = trades([('2019-12-31', 'TA', 10.0, 100.0), ('2020-03-02', 'TA', 10.0, 0.0)])
+
+    ret_calc, port_ret = ledger_returns(panel, ledger, 1)
+
+    assert port_ret['value'].tolist() == [1000.0, 1000.0]
+    assert port_ret['income'].tolist() == [0.0, 0.0]
+    assert port_ret['mon ret'].tolist() == [0.0, 0.0]
+    assert ret_calc['cum_twr'] == 0.0
+    assert ret_calc['ann_twr'] == 0.0
+    assert ret_calc['mon_mwr'] == pytest.approx(0.0, abs=1e-9)
+
+
+def test_positions_follow_the_panel_months_across_a_gap():
+    panel = price_panel(['2020-01', '2020-02', '2020-04', '2020-05'], [10.0, 11.0, 12.0, 13.0])
+    ledger = trades([('2019-06-10', 'TA', 1.0, np.nan), ('2020-03-16', 'TA', 2.0, 11.5),
+                     ('2020-04-16', 'TA', 4.0, 12.0), ('2020-06-01', 'TA', 8.0, 13.0)])
+
+    positions = ledger_positions(panel, ledger)
+
+    assert positions['positions'][:, 0].tolist() == [1.0, 1.0, 7.0, 7.0]
+    # The March trade (a month without prices) is booked in full at the start of April
+    assert positions['trade_month'].tolist() == [0, 2, 2]
+    assert positions['trade_frac'].tolist() == pytest.approx([0.0, 0.0, 15 / 30])
+    # The opening trade has no price and is valued at the first month-end close
+    assert positions['flows'].tolist() == [10.0, 0.0, 71.0, 0.0]
+
+
+def test_money_weighted_rate_without_a_sign_change_is_nan():
+    assert np.isnan(money_weighted_rate(np.array([-100.0, -50.0]), np.array([0.0, 1.0])))
+    assert money_weighted_rate(np.array([-100.0, 121.0]), np.array([0.0, 2.0])) == pytest.approx(0.1)
+
+
+def test_load_ledger_skips_invalid_rows(tmp_path, monkeypatch):
+    monkeypatch.setattr(app.ledger, 'INPUT_DIR', str(tmp_path))
+    (tmp_path / 'ledger.csv').write_text('Trade Date,Symbol,Shares,Price\n'
+                                         '2020-02-03,azo,"1,000",12.5\n'
+                                         '2020-01-02,MSFT,(5),\n'
+                                         'not a date,GE,1,1\n'
+                                         '2020-03-02,XOM,1,abc\n')
+
+    ledger = load_ledger('ledger.csv')
+
+    assert ledger['ticker'].tolist() == ['MSFT', 'AZO']
+    assert ledger['qty'].tolist() == [-5.0, 1000.0]
+    assert np.isnan(ledger['price'].iloc[0])
+    assert ledger['price'].iloc[1] == 12.5
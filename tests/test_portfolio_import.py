@@ -0,0 +1,87 @@
+# test_portfolio_import.py
+
+# IMPORT PACKAGES
+
+import pytest
+
+import app.portfolio_import
+from app.portfolio_import import TICKER_PATTERN, Holdings, normalize_ticker, parse_qty, load_holdings, portfolio_import
+
+# TESTS
+
+@pytest.fixture(autouse=True)
+def input_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(app.portfolio_import, 'INPUT_DIR', str(tmp_path))
+    return tmp_path
+
+
+@pytest.mark.parametrize('ticker', ['A', 'AZO', 'GOOGL', 'BRK.B', 'BF-B', 'X2', 'ABCDEF'])
+def test_ticker_pattern_accepts(ticker):
+    assert TICKER_PATTERN.match(ticker)
+
+
+@pytest.mark.parametrize('ticker', ['', '1A', 'ABCDEFG', 'BRK.', 'BRK.ABC', 'azo', 'A B', 'AZO$'])
+def test_ticker_pattern_rejects(ticker):
+    assert not TICKER_PATTERN.match(ticker)
+
+
+@pytest.mark.parametrize('value, expected', [(' azo ', 'AZO'), ('$msft', 'MSFT'), ('brk/b', 'BRK.B'), ('bf-b', 'BF-B'),
+                                             ('--', None), ('', None), ('CASH & EQUIVALENTS', None)])
+def test_normalize_ticker(value, expected):
+    assert normalize_ticker(value) == expected
+
+
+@pytest.mark.parametrize('value, expected', [('10', 10.0), (' 1,250.5 ', 1250.5), ('(10)', -10.0), ('-3', -3.0),
+                                             ('abc', None), ('', None), ('nan', None), ('inf', None)])
+def test_parse_qty(value, expected):
+    assert parse_qty(value) == expected
+
+
+def test_holdings_merge_rows_by_ticker_in_first_seen_order():
+    holdings = Holdings.from_portfolio([{'tck': 'AZO', 'qty': '10'}, {'tck': 'MSFT', 'qty': 5},
+                                        {'tck': 'AZO', 'qty': 2.5}, {'tck': 'GE', 'qty': 4}, {'tck': 'GE', 'qty': -4}])
+
+    assert holdings.tickers == ['AZO', 'MSFT', 'GE']
+    assert holdings.quantity('AZO') == 12.5
+    assert holdings.quantity('XOM') == 0.0
+    assert holdings.rows == 5
+    assert len(holdings) == 3
+    # Positions that net to zero shares are left out of the portfolio
+    assert holdings.portfolio() == [{'tck': 'AZO', 'qty': 12.5}, {'tck': 'MSFT', 'qty': 5.0}]
+
+    tickers, qty = holdings.to_numpy()
+    assert tickers.tolist() == ['AZO', 'MSFT', 'GE']
+    assert qty.tolist() == [12.5, 5.0, 0.0]
+
+
+def test_load_holdings_reads_brokerage_columns_and_records_bad_rows(input_dir):
+    (input_dir / 'export.csv').write_text('﻿Account,Symbol,Description,Quantity\n'
+                                          'IRA,azo,AutoZone,"1,000"\n'
+                                          'IRA,$MSFT,Microsoft,(2)\n'
+                                          'TAXABLE,AZO,AutoZone,5\n'
+                                          'TAXABLE,???,Cash,1\n'
+                                          'TAXABLE,GE,General Electric,n/a\n'
+                                          ',,,\n'
+                                          'TAXABLE,XOM\n', encoding='utf-8')
+
+    holdings = load_holdings('export.csv')
+
+    assert holdings.tickers == ['AZO', 'MSFT']
+    assert holdings.quantity('AZO') == 1005.0
+    assert holdings.quantity('MSFT') == -2.0
+    assert holdings.accounts == {'IRA', 'TAXABLE'}
+    assert holdings.errors == [(5, "invalid ticker '???'"), (6, "invalid quantity 'n/a' for GE"), (8, 'missing values')]
+
+
+def test_load_holdings_needs_ticker_and_quantity_columns(input_dir):
+    (input_dir / 'bad.csv').write_text('name,amount\nAZO,1\n')
+
+    with pytest.raises(ValueError, match='needs a ticker column'):
+        load_holdings('bad.csv')
+
+
+def test_portfolio_import_warns_about_skipped_rows(input_dir, capsys):
+    (input_dir / 'port.csv').write_text('id,tck,qty\n1,AZO,10\n2,1BAD,3\n')
+
+    assert portfolio_import('port.csv') == [{'tck': 'AZO', 'qty': 10.0}]
+    assert "line 3: invalid ticker '1BAD'" in capsys.readouterr().out
@@ -0,0 +1,89 @@
+# test_results_store.py
+
+# IMPORT PACKAGES
+
+import math
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.returns_engine import ReturnsPanel
+from app.results_store import new_state, update_state, state_results
+from benchmarks.synthetic import synthetic_prices, synthetic_rates
+
+# TESTS
+
+MEASURES = ['years_act', 'months_act', 'ann_ret', 'mon_ret', 'ann_sdev', 'mon_sdev', 'ann_spret', 'mon_spret',
+            'ann_sp_sdev', 'mon_sp_sdev', 'beta', 'sharpe_port', 'sharpe_sp']
+
+
+@pytest.fixture(scope='module')
+def market():
+    frames = synthetic_prices(['TA', 'TB', 'SPY'], 6, seed=11)
+    sub = pd.concat([frames[t].assign(ticker=t, qty=10.0 * (i + 1)) for i, t in enumerate(['TA', 'TB'])],
+                    ignore_index=True)
+    sub['month'] = sub['timestamp'].dt.to_period('M')
+
+    spy = frames['SPY'].set_index(frames['SPY']['timestamp'].dt.to_period('M').rename('month'))
+    spy_join = spy['adj close'].pct_change().rename('spret')
+
+    fred = synthetic_rates(6, seed=11)
+    fred_join = ((1 + fred.groupby(fred['date'].dt.to_period('M').rename('month'))['rate'].mean() / 200)**(1 / 6) - 1).rename('rate')
+
+    return sub, spy_join, fred_join
+
+
+def assert_same_results(state, panel, spy_join, fred_join):
+    end = panel.months[-1]
+    for p, a in zip(state['periods'], state_results(state)):
+        b, _, _ = panel.returns(p['years_tgt'], spy_join, fred_join, pd.Period(a['st_date'], 'M'), end)
+        for k in MEASURES:
+            if math.isnan(b[k]):
+                assert math.isnan(a[k]), k
+            else:
+                assert a[k] == pytest.approx(b[k], rel=1e-9), k
+
+
+def test_state_matches_the_full_report(market):
+    sub, spy_join, fred_join = market
+    panel = ReturnsPanel(sub)
+
+    state = new_state(panel, panel.qty, spy_join, fred_join)
+
+    assert_same_results(state, panel, spy_join, fred_join)
+
+
+def test_one_month_window_gives_nan_like_the_full_report(market):
+    sub, spy_join, fred_join = market
+    months = sorted(sub['month'].unique())
+    panel = ReturnsPanel(sub[sub['month'] >= months[-2]])
+
+    state = new_state(panel, panel.qty, spy_join, fred_join)
+    results = state_results(state)
+
+    assert [r['months_act'] for r in results] == [1, 1, 1, 1]
+    assert np.isnan(results[0]['beta']) and np.isnan(results[0]['sharpe_port']) and np.isnan(results[0]['mon_sdev'])
+    assert_same_results(state, panel, spy_join, fred_join)
+
+
+def test_empty_window_gives_nan(market):
+    sub, spy_join, fred_join = market
+    months = sorted(sub['month'].unique())
+    panel = ReturnsPanel(sub[sub['month'] == months[-1]])
+
+    results = state_results(new_state(panel, panel.qty, spy_join, fred_join))
+
+    assert results[0]['months_act'] == 0
+    assert results[0]['st_date'] == results[0]['end_date'] == str(months[-1])
+    assert all(np.isnan(results[0][k]) for k in MEASURES[2:])
+
+
+def test_update_adds_only_the_new_months(market):
+    sub, spy_join, fred_join = market
+    months = sorted(sub['month'].unique())
+    panel = ReturnsPanel(sub)
+    state = new_state(ReturnsPanel(sub[sub['month'] <= months[-4]]), panel.qty, spy_join, fred_join)
+
+    assert update_state(state, panel, spy_join, fred_join) == 3
+    assert state['last_month'] == str(months[-1])
+    assert update_state(state, panel, spy_join, fred_join) == 0
@@ -0,0 +1,136 @@
+# test_returns_engine.py
+
+# IMPORT PACKAGES
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.returns_engine import ReturnsPanel
+from benchmarks.synthetic import synthetic_prices, synthetic_rates
+
+# TESTS
+
+MEASURES = ['years_act', 'months_act', 'ann_ret', 'mon_ret', 'ann_sdev', 'mon_sdev', 'ann_spret', 'mon_spret',
+            'ann_sp_sdev', 'mon_sp_sdev', 'beta', 'sharpe_port', 'sharpe_sp']
+
+
+@pytest.fixture(scope='module')
+def market():
+    frames = synthetic_prices(['TA', 'TB', 'TC', 'SPY'], 8, seed=3)
+    sub = pd.concat([frames[t].assign(ticker=t, qty=10.0 * (i + 1)) for i, t in enumerate(['TA', 'TB', 'TC'])],
+                    ignore_index=True)
+    sub['month'] = sub['timestamp'].dt.to_period('M')
+
+    spy = frames['SPY'].set_index(frames['SPY']['timestamp'].dt.to_period('M').rename('month'))
+    spy_join = spy['adj close'].pct_change().rename('spret')
+
+    fred = synthetic_rates(8, seed=3)
+    fred_join = ((1 + fred.groupby(fred['date'].dt.to_period('M').rename('month'))['rate'].mean() / 200)**(1 / 6) - 1).rename('rate')
+
+    # Common window of the three positions, as port_data_pull trims it
+    maxomin = sub.groupby('ticker')['month'].min().max()
+    minomax = sub.groupby('ticker')['month'].max().min()
+    sub = sub[(sub['month'] >= maxomin) & (sub['month'] <= minomax)].reset_index(drop=True)
+
+    return sub, spy_join, fred_join, maxomin, minomax
+
+
+def baseline_returns(dataset, period_length, min_start, max_end, spy_join, fred_join):
+    '''
+    The groupby/join calculation of returns() before the ReturnsPanel (results dictionary only).
+    '''
+    working_data = dataset.copy()
+    working_data['mret'] = working_data.groupby('ticker')['adj close'].pct_change(fill_method=None)
+    working_data['mretp1'] = working_data['mret'] + 1
+    working_data['sh val'] = working_data['qty'] * working_data['close']
+
+    pd_start = max(max_end - (period_length * 12), min_start)
+
+    pd_start_val = working_data.loc[working_data['month'] == pd_start].set_index('ticker')['sh val'].rename('start val')
+
+    cum_ret_set = working_data.loc[(working_data['month'] > pd_start) & (working_data['month'] <= max_end)].set_index('ticker')
+    cum_ret_set['cumret'] = cum_ret_set.groupby('ticker')['mretp1'].cumprod()
+    cum_ret_set = cum_ret_set.join(pd_start_val, on='ticker')
+    cum_ret_set['mon val'] = cum_ret_set['start val'] * cum_ret_set['cumret']
+
+    port_ret = cum_ret_set.groupby('month')[['start val', 'mon val']].sum()
+    port_ret['cum ret'] = port_ret['mon val'] / port_ret['start val']
+    port_ret['mon ret'] = port_ret['mon val'].pct_change()
+    port_ret.loc[pd_start + 1, 'mon ret'] = port_ret.loc[pd_start + 1, 'cum ret'] - 1
+
+    port_ret = port_ret.join(spy_join).join(fred_join)
+    port_ret['cum spret'] = (port_ret['spret'] + 1).cumprod()
+    port_ret['exret'] = port_ret['mon ret'] - port_ret['rate']
+    port_ret['exspret'] = port_ret['spret'] - port_ret['rate']
+
+    months = len(port_ret)
+    years = months / 12
+    mon_sdev = port_ret['mon ret'].std()
+    mon_sp_sdev = port_ret['spret'].std()
+    cov = port_ret.cov()
+
+    return {'years_tgt': period_length, 'years_act': years, 'months_act': months,
+            'st_date': pd_start.strftime('%Y-%m'), 'end_date': max_end.strftime('%Y-%m'),
+            'ann_ret': port_ret.loc[max_end, 'cum ret']**(1 / years) - 1,
+            'mon_ret': port_ret.loc[max_end, 'cum ret']**(1 / months) - 1,
+            'ann_sdev': mon_sdev * (12 ** .5), 'mon_sdev': mon_sdev,
+            'ann_spret': port_ret.loc[max_end, 'cum spret']**(1 / years) - 1,
+            'mon_spret': port_ret.loc[max_end, 'cum spret']**(1 / months) - 1,
+            'ann_sp_sdev': mon_sp_sdev * (12 ** .5), 'mon_sp_sdev': mon_sp_sdev,
+            'beta': cov.loc['mon ret', 'spret'] / cov.loc['spret', 'spret'],
+            'sharpe_port': (port_ret['exret'].mean() / port_ret['exret'].std()) * (12 ** .5),
+            'sharpe_sp': (port_ret['exspret'].mean() / port_ret['exspret'].std()) * (12 ** .5)}
+
+
+@pytest.mark.parametrize('years', [1, 2, 3, 5])
+def test_returns_match_the_baseline_groupby(market, years):
+    sub, spy_join, fred_join, maxomin, minomax = market
+    expected = baseline_returns(sub, years, maxomin, minomax, spy_join, fred_join)
+
+    ret_calc, tot_ret_dict, port_ret = ReturnsPanel(sub).returns(years, spy_join, fred_join, maxomin, minomax)
+
+    assert ret_calc['st_date'] == expected['st_date']
+    assert ret_calc['end_date'] == expected['end_date']
+    for k in MEASURES:
+        assert ret_calc[k] == pytest.approx(expected[k], rel=1e-9), k
+    assert tot_ret_dict['month'][0] == expected['st_date']
+    assert len(port_ret) == expected['months_act']
+
+
+def test_returns_leave_the_dataset_unchanged(market):
+    sub = market[0]
+    before = sub.copy()
+
+    ReturnsPanel(sub).returns(3, market[1], market[2], market[3], market[4])
+
+    pd.testing.assert_frame_equal(sub, before)
+
+
+def test_returns_many_matches_returns_for_each_portfolio(market):
+    sub, spy_join, fred_join, maxomin, minomax = market
+    panel = ReturnsPanel(sub)
+    qty = np.array([[10.0, 0.0, 5.0], [20.0, 7.0, 0.0], [30.0, 1.0, 5.0]])
+
+    many = panel.returns_many(3, spy_join, fred_join, qty)
+
+    for j in range(qty.shape[1]):
+        first, last = panel.window(qty[:, [j]])
+        ret_calc, _, _ = panel.returns(3, spy_join, fred_join, panel.months[first[0]], panel.months[last[0]], qty[:, j])
+        for k in ['ann_ret', 'ann_sdev', 'beta', 'sharpe_port']:
+            assert many.loc[j, k] == pytest.approx(ret_calc[k], rel=1e-9), (j, k)
+
+
+def test_benchmark_columns_match_the_sp500_measures(market):
+    sub, spy_join, fred_join, maxomin, minomax = market
+    bench_join = pd.DataFrame({'SPY': spy_join, 'HALF': spy_join / 2})
+
+    ret_calc, _, _ = ReturnsPanel(sub).returns(3, spy_join, fred_join, maxomin, minomax, bench_join=bench_join)
+    benchmarks = ret_calc['benchmarks']
+
+    assert list(benchmarks.index) == ['SPY', 'HALF']
+    assert benchmarks.loc['SPY', 'ann_bench_ret'] == pytest.approx(ret_calc['ann_spret'], rel=1e-9)
+    assert benchmarks.loc['SPY', 'ann_bench_sdev'] == pytest.approx(ret_calc['ann_sp_sdev'], rel=1e-9)
+    assert benchmarks.loc['SPY', 'beta'] == pytest.approx(ret_calc['beta'], rel=1e-9)
+    assert benchmarks.loc['SPY', 'sharpe_bench'] == pytest.approx(ret_calc['sharpe_sp'], rel=1e-9)
+    assert benchmarks.loc['HALF', 'beta'] == pytest.approx(2 * ret_calc['beta'], rel=1e-9)
@@ -0,0 +1,85 @@
+# test_rolling.py
+
+# IMPORT PACKAGES
+
+import numpy as np
+import pytest
+
+from app.rolling import rolling_moments, rolling_stats
+
+# TESTS
+
+@pytest.fixture
+def series():
+    rng = np.random.default_rng(5)
+    port = rng.normal(0.0005, 0.01, 300)
+    bench = 0.8 * port + rng.normal(0.0003, 0.006, 300)
+    rate = np.full(300, 0.0001)
+    return port, bench, rate
+
+
+def brute_moments(x, y, window):
+    '''
+    Statistics of each window from the days where both series have values.
+    '''
+    out = {k: [] for k in ['mean_x', 'mean_y', 'var_x', 'var_y', 'cov']}
+    for end in range(window, len(x) + 1):
+        a, b = x[end - window:end], y[end - window:end]
+        keep = np.isfinite(a) & np.isfinite(b)
+        a, b = a[keep], b[keep]
+        out['mean_x'].append(a.mean())
+        out['mean_y'].append(b.mean())
+        out['var_x'].append(a.var(ddof=1))
+        out['var_y'].append(b.var(ddof=1))
+        out['cov'].append(np.cov(a, b)[0, 1])
+    return out
+
+
+def test_rolling_moments_match_each_window(series):
+    port, bench, _ = series
+
+    moments = rolling_moments(port, bench, 60)
+    expected = brute_moments(port, bench, 60)
+
+    for k in expected:
+        np.testing.assert_allclose(moments[k], expected[k], rtol=1e-9, atol=1e-15)
+
+
+def test_missing_benchmark_days_are_skipped(series):
+    port, bench, _ = series
+    bench = bench.copy()
+    # SPY starting late leaves the first days missing, and one day is missing later on
+    bench[:5] = np.nan
+    bench[150] = np.nan
+
+    moments = rolling_moments(port, bench, 60)
+    expected = brute_moments(port, bench, 60)
+
+    for k in expected:
+        np.testing.assert_allclose(moments[k], expected[k], rtol=1e-9, atol=1e-15)
+
+
+def test_rolling_stats_keep_beta_after_a_missing_day(series):
+    port, bench, rate = series
+    bench = bench.copy()
+    bench[0] = np.nan
+    rate = rate.copy()
+    rate[:3] = np.nan
+
+    stats = rolling_stats(port, bench, rate, 60)
+
+    assert np.isfinite(stats['beta'][59:]).all()
+    assert np.isfinite(stats['sharpe'][59:]).all()
+    assert np.isfinite(stats['bench_sharpe'][59:]).all()
+    assert np.isnan(stats['beta'][:59]).all()
+
+
+def test_window_without_enough_days_is_nan():
+    x = np.array([0.01, np.nan, np.nan, 0.02, 0.03])
+    y = np.array([0.02, 0.01, np.nan, np.nan, 0.01])
+
+    moments = rolling_moments(x, y, 3)
+
+    assert moments['mean_x'].tolist() == pytest.approx([0.01, np.nan, 0.03], nan_ok=True)
+    assert np.isnan(moments['var_x']).all()
+    assert np.isnan(moments['cov']).all()
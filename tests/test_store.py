@@ -0,0 +1,39 @@
+# test_store.py
+
+# IMPORT PACKAGES
+
+import os
+import pandas as pd
+import pytest
+
+import app.store
+from app.store import store_write, store_read
+
+# TESTS
+
+@pytest.fixture(autouse=True)
+def store_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(app.store, 'STORE_DIR', str(tmp_path))
+    return tmp_path
+
+
+def test_round_trip_keeps_column_types(store_dir):
+    df = pd.DataFrame({'ticker': ['TA', 'TB'], 'close': [1.5, 2.5],
+                       'month': pd.PeriodIndex(['2020-01', '2020-02'], freq='M')})
+
+    store_write(df, 'prices')
+
+    pd.testing.assert_frame_equal(store_read('prices'), df)
+    assert os.listdir(store_dir) == ['prices.feather']
+
+
+def test_rewrite_replaces_the_file_under_an_open_reader(store_dir):
+    store_write(pd.DataFrame({'close': [1.0, 2.0, 3.0]}), 'prices')
+    before = store_read('prices')
+
+    store_write(pd.DataFrame({'close': [4.0]}), 'prices')
+
+    # The earlier frame still reads from the old file, and new readers see the new one
+    assert before['close'].tolist() == [1.0, 2.0, 3.0]
+    assert store_read('prices')['close'].tolist() == [4.0]
+    assert os.listdir(store_dir) == ['prices.feather']
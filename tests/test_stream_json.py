@@ -0,0 +1,94 @@
+# test_stream_json.py
+
+# IMPORT PACKAGES
+
+import json
+import numpy as np
+import pandas as pd
+
+from app.stream_json import av_stream_frame, fred_stream_frame
+from benchmarks.synthetic import synthetic_prices, synthetic_rates, av_json, fred_json
+
+# TESTS
+
+def chunks(body, size):
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+def test_av_response_is_parsed_into_typed_columns():
+    frame = synthetic_prices(['SPY'], 3)['SPY']
+
+    parsed = av_stream_frame(chunks(av_json(frame), 65536))
+
+    assert list(parsed.columns) == ['timestamp', 'close', 'adj close', 'volume', 'div amt']
+    assert pd.api.types.is_datetime64_dtype(parsed['timestamp'])
+    assert parsed['volume'].dtype == 'int64'
+    # Responses list the newest month first
+    expected = frame.iloc[::-1].reset_index(drop=True)
+    assert (parsed['timestamp'] == expected['timestamp']).all()
+    np.testing.assert_allclose(parsed['adj close'], expected['adj close'], atol=1e-4)
+    np.testing.assert_allclose(parsed['div amt'], expected['div amt'], atol=1e-4)
+
+
+def test_av_response_split_at_any_byte_gives_the_same_frame():
+    body = av_json(synthetic_prices(['SPY'], 2)['SPY'])
+
+    whole = av_stream_frame([body])
+    for size in [1, 7, 64]:
+        pd.testing.assert_frame_equal(av_stream_frame(chunks(body, size)), whole)
+
+
+def test_av_utf8_characters_split_across_chunks_are_decoded():
+    body = json.dumps({'Error Message': 'Invalid API call – ticker “ZZZZ”'}, ensure_ascii=False).encode('utf-8')
+
+    assert av_stream_frame(chunks(body, 1)) == {'Error Message': 'Invalid API call – ticker “ZZZZ”'}
+
+
+def test_av_error_message_is_returned_as_a_dict():
+    body = json.dumps({'Error Message': 'Invalid API call. Please retry or visit the documentation.'}).encode('utf-8')
+
+    assert av_stream_frame(chunks(body, 5)) == {'Error Message': 'Invalid API call. Please retry or visit the documentation.'}
+
+
+def test_av_note_is_returned_with_the_rest_of_the_body():
+    body = json.dumps({'Note': 'Thank you for using Alpha Vantage! Our standard API call frequency is 5 calls per minute.',
+                       'Information': 'See the premium plans.'}).encode('utf-8')
+
+    parsed = av_stream_frame(chunks(body, 16))
+
+    assert list(parsed) == ['Note', 'Information']
+    assert parsed['Information'] == 'See the premium plans.'
+
+
+def test_av_response_without_the_series_is_other():
+    body = json.dumps({'Meta Data': {'2. Symbol': 'SPY'}}).encode('utf-8')
+
+    assert av_stream_frame([body]) == {'Other': None}
+
+
+def test_av_daily_series_key():
+    frame = synthetic_prices(['SPY'], 1)['SPY']
+
+    parsed = av_stream_frame([av_json(frame, series_key='Time Series (Daily)')], series_key='Time Series (Daily)')
+
+    assert len(parsed) == len(frame)
+
+
+def test_fred_missing_values_are_skipped():
+    rates = synthetic_rates(2)
+
+    parsed = fred_stream_frame(chunks(fred_json(rates), 100))
+
+    expected = rates.dropna().reset_index(drop=True)
+    assert list(parsed.columns) == ['date', 'rate']
+    assert len(parsed) == len(expected) < len(rates)
+    assert (parsed['date'] == expected['date']).all()
+    np.testing.assert_allclose(parsed['rate'], expected['rate'])
+
+
+def test_fred_error_response_is_returned_as_a_dict():
+    body = json.dumps({'error_code': 400, 'error_message': 'Bad Request.  The value for variable api_key is not registered.'}).encode('utf-8')
+
+    parsed = fred_stream_frame(chunks(body, 9))
+
+    assert parsed == {'error_code': 400, 'error_message': 'Bad Request.  The value for variable api_key is not registered.'}
@@ -0,0 +1,128 @@
+# test_validate.py
+
+# IMPORT PACKAGES
+
+import numpy as np
+import pandas as pd
+
+from app.panel import CompactPanel
+from app.validate import validate_panel
+
+# TESTS
+
+def panel(rows):
+    '''
+    Builds a float64 CompactPanel from (ticker, month, close, adj close, volume, div amt) rows.
+    '''
+    dataset = pd.DataFrame(rows, columns=['ticker', 'month', 'close', 'adj close', 'volume', 'div amt'])
+    dataset['month'] = pd.PeriodIndex(dataset['month'], freq='M')
+    dataset['qty'] = 1.0
+
+    return CompactPanel.from_dataset(dataset, 'float64')
+
+
+def clean(ticker, months, price=100.0):
+    return [(ticker, str(m), price, price, 1000, 0.0) for m in pd.period_range(months[0], months[1], freq='M')]
+
+
+def column(compact, ticker, name):
+    return compact.columns[name][compact.codes == compact.tickers.get_loc(ticker)]
+
+
+def test_clean_panel_has_no_anomalies_and_is_not_copied():
+    compact = panel(clean('TA', ['2020-01', '2020-12']) + clean('TB', ['2020-03', '2020-12']))
+
+    checked, anomalies = validate_panel(compact, repair=True, fill_gaps=True)
+
+    assert checked is compact
+    assert len(anomalies) == 0
+
+
+def test_unsorted_rows_are_sorted_by_ticker_and_month():
+    compact = panel(clean('TB', ['2020-01', '2020-03'])[::-1] + clean('TA', ['2020-01', '2020-03']))
+
+    checked, anomalies = validate_panel(compact)
+
+    assert len(anomalies) == 0
+    assert checked.codes.tolist() == [0, 0, 0, 1, 1, 1]
+    assert np.diff(checked.ordinals[:3]).tolist() == [1, 1]
+
+
+def test_unadjusted_split_is_found_and_rescaled():
+    rows = clean('TA', ['2020-01', '2020-06'])
+    # 2-for-1 split in April that the adjusted prices do not reflect: price halves, volume doubles
+    rows = [(t, m, c / 2, a / 2, v * 2, d) if m >= '2020-04' else (t, m, c, a, v, d) for t, m, c, a, v, d in rows]
+
+    repaired, anomalies = validate_panel(panel(rows), repair=True)
+
+    assert anomalies[['ticker', 'check']].values.tolist() == [['TA', 'split']]
+    assert str(anomalies['month'].iloc[0]) == '2020-04'
+    assert anomalies['value'].iloc[0] == 0.5
+    assert column(repaired, 'TA', 'adj close').tolist() == [50.0] * 6
+    # Close prices are left alone
+    assert column(repaired, 'TA', 'close').tolist() == [100.0] * 3 + [50.0] * 3
+
+
+def test_move_without_volume_change_is_a_jump_and_not_repaired():
+    rows = clean('TA', ['2020-01', '2020-04'])
+    rows[2] = ('TA', '2020-03', 50.0, 50.0, 1000, 0.0)
+
+    repaired, anomalies = validate_panel(panel(rows), repair=True)
+
+    assert anomalies['check'].tolist() == ['jump', 'jump']
+    assert not anomalies['repaired'].any()
+    assert column(repaired, 'TA', 'adj close').tolist() == [100.0, 100.0, 50.0, 100.0]
+
+
+def test_bad_prices_are_blanked_and_negative_values_zeroed():
+    rows = clean('TA', ['2020-01', '2020-04'])
+    rows[1] = ('TA', '2020-02', 0.0, 0.0, 1000, 0.0)
+    rows[2] = ('TA', '2020-03', 100.0, 100.0, -5, -0.25)
+
+    repaired, anomalies = validate_panel(panel(rows), repair=True)
+
+    assert sorted(anomalies['check']) == ['bad dividend', 'bad price', 'bad volume']
+    assert anomalies['repaired'].all()
+    assert np.isnan(column(repaired, 'TA', 'close')[1])
+    assert np.isnan(column(repaired, 'TA', 'adj close')[1])
+    assert column(repaired, 'TA', 'volume')[2] == 0
+    assert column(repaired, 'TA', 'div amt')[2] == 0
+
+
+def test_duplicate_month_keeps_the_last_row():
+    rows = clean('TA', ['2020-01', '2020-03'])
+    rows.insert(2, ('TA', '2020-02', 101.0, 101.0, 1000, 0.0))
+
+    repaired, anomalies = validate_panel(panel(rows), repair=True)
+
+    assert anomalies['check'].tolist() == ['duplicate']
+    assert len(repaired) == 3
+    assert column(repaired, 'TA', 'close').tolist() == [100.0, 101.0, 100.0]
+
+
+def test_gaps_are_reported_and_filled_from_the_previous_month():
+    rows = clean('TA', ['2020-01', '2020-02'], 100.0) + clean('TA', ['2020-05', '2020-06'], 110.0)
+    rows[1] = ('TA', '2020-02', 105.0, 105.0, 1000, 0.5)
+
+    reported, anomalies = validate_panel(panel(rows), repair=False, fill_gaps=False)
+    filled, _ = validate_panel(panel(rows), repair=False, fill_gaps=True)
+
+    assert anomalies[['check', 'value']].values.tolist() == [['gap', 2.0]]
+    assert len(reported) == 4
+    assert pd.PeriodIndex.from_ordinals(filled.ordinals.astype('int64'), freq='M').astype(str).tolist() == \
+        ['2020-01', '2020-02', '2020-03', '2020-04', '2020-05', '2020-06']
+    assert column(filled, 'TA', 'close').tolist() == [100.0, 105.0, 105.0, 105.0, 110.0, 110.0]
+    assert column(filled, 'TA', 'volume').tolist() == [1000, 1000, 0, 0, 1000, 1000]
+    assert column(filled, 'TA', 'div amt').tolist() == [0.0, 0.5, 0.0, 0.0, 0.0, 0.0]
+
+
+def test_report_only_mode_changes_nothing():
+    rows = clean('TA', ['2020-01', '2020-03'])
+    rows[1] = ('TA', '2020-02', -1.0, -1.0, 1000, 0.0)
+    compact = panel(rows)
+
+    checked, anomalies = validate_panel(compact, repair=False, fill_gaps=False)
+
+    assert checked is compact
+    assert anomalies['check'].tolist() == ['bad price']
+    assert not anomalies['repaired'].any()